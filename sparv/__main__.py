@@ -147,6 +147,7 @@ def main():
         "   preload          Preload annotators and models",
         "   autocomplete     Enable tab completion in bash",
         "   schema           Print a JSON schema for the Sparv config format",
+        "   bench            Run performance benchmarks on a synthetic corpus",
         "",
         "See 'sparv <command> -h' for help with a specific command",
         "For full documentation, visit https://spraakbanken.gu.se/sparv/docs/"
@@ -236,10 +237,19 @@ def main():
     createfile_parser.add_argument("--force", action="store_true", help="Force recreation of target")
 
     preloader_parser = subparsers.add_parser("preload", description="Preload annotators and models")
-    preloader_parser.add_argument("preload_command", nargs="?", default="start", choices=["start", "stop"])
+    preloader_parser.add_argument("preload_command", nargs="?", default="start", choices=["start", "stop", "status"])
     preloader_parser.add_argument("--socket", default="sparv.socket", help="Path to socket file")
     preloader_parser.add_argument("-j", "--processes", help="Number of processes to use", default=1, type=int)
     preloader_parser.add_argument("-l", "--list", action="store_true", help="List annotators available for preloading")
+    preloader_parser.add_argument("--reload-interval", type=float, default=0, metavar="SECONDS",
+                                  help="Reload models when their files change, checking this often (disabled by "
+                                       "default)")
+    preloader_parser.add_argument("--stats", action="store_true",
+                                  help="Show request counts, latencies and worker utilization (with 'status')")
+    preloader_parser.add_argument("--metrics-file", help="Periodically write metrics to this file in the OpenMetrics "
+                                                         "text format")
+    preloader_parser.add_argument("--metrics-interval", type=float, default=60, metavar="SECONDS",
+                                  help="How often to write the metrics file")
 
     autocomplete_parser = subparsers.add_parser("autocomplete", description="Enable tab completion in bash")
     autocomplete_parser.add_argument("--enable", action="store_true", help="Output script to be sourced in bash")
@@ -247,6 +257,7 @@ def main():
                                      help="Output script to be sourced in bash, for bash version 4.3 and below")
 
     subparsers.add_parser("schema", description="Print a JSON schema for the Sparv config format")
+    subparsers.add_parser("bench", no_help=True)
 
     # Add common arguments
     for subparser in [run_parser, runrule_parser]:
@@ -268,6 +279,14 @@ def main():
                                     "specified, 'info' if LOGLEVEL is not specified)",
                                nargs="?", choices=["debug", "info", "warning", "error"])
         subparser.add_argument("--stats", action="store_true", help="Show summary of time spent per annotator")
+        subparser.add_argument("--profile", action="store_true",
+                               help="Show a performance report per annotator (time, CPU, memory and tokens/s) and "
+                                    "save detailed job statistics to the logs directory")
+        subparser.add_argument("--profile-annotator", metavar="ANNOTATOR[,ANNOTATOR...]", type=lambda s: s.split(","),
+                               default=[], help="Run the given annotator(s) under cProfile and save the profiles "
+                                                "to logs/profiles")
+        subparser.add_argument("--profile-files", nargs="+", metavar="PATTERN", default=[],
+                               help="Only profile annotators for source files matching the given pattern(s)")
         subparser.add_argument("--json-log", action="store_true", help="Use JSON format for logging")
         subparser.add_argument("--debug", action="store_true", help="Show debug messages")
         subparser.add_argument("--socket", help="Path to socket file created by the 'preload' command")
@@ -294,6 +313,11 @@ def main():
         from sparv.core import run
         run.main(unknown_args, log_level=args.log)
         sys.exit()
+    # The "bench" command is handled by a separate script
+    elif args.command == "bench":
+        from sparv.core import bench
+        bench.main(unknown_args)
+        sys.exit()
     elif args.command == "autocomplete":
         if args.enable or args.enable_old:
             import appdirs
@@ -387,6 +411,7 @@ def main():
     json_log = False
     simple_mode = False
     stats = False
+    profile = False
     pass_through = False
     dry_run = False
     keep_going = False
@@ -411,6 +436,11 @@ def main():
             config["socket"] = str(Path(args.socket).resolve())
             config["preloader"] = True
             config["processes"] = args.processes
+            config["reload_interval"] = args.reload_interval
+            config["preload_stats"] = args.stats
+            if args.metrics_file:
+                config["metrics_file"] = str(Path(args.metrics_file).resolve())
+            config["metrics_interval"] = args.metrics_interval
             config["preload_command"] = args.preload_command
             config["targets"] = ["preload"]
             if args.list:
@@ -436,6 +466,7 @@ def main():
             simple_target = True
 
         stats = args.stats
+        profile = args.profile
         dry_run = args.dry_run
         keep_going = args.keep_going
 
@@ -515,6 +546,9 @@ def main():
                        "log_file_level": log_file_level,
                        "socket": socket,
                        "force_preloader": args.force_preloader,
+                       "profile": args.profile,
+                       "profile_annotators": args.profile_annotator,
+                       "profile_files": args.profile_files,
                        "targets": snakemake_args["targets"],
                        "threads": args.cores})
 
@@ -534,6 +568,7 @@ def main():
         dry_run=dry_run,
         keep_going=keep_going,
         json=json_log,
+        profile=profile,
     )
     snakemake_args["log_handler"] = [progress.log_handler]
 
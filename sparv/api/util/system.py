@@ -5,14 +5,24 @@ import os
 import shlex
 import shutil
 import subprocess
+import threading
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Callable, List, Optional, Union
 
 import sparv.core.paths as paths
 from sparv.api import get_logger, SparvErrorMessage
 
 logger = get_logger(__name__)
 
+# Number of CPU threads available to the current job, set by Sparv based on the number of cores it may use and the
+# number of jobs that may run in parallel, if that number is limited
+job_cpu_threads: Optional[int] = None
+
+# Maximum number of bytes of dummy input written at once by communicate_until, i.e. a few pipe buffers
+MAX_FLUSH_SIZE = 4 * 65536
+# Seconds to wait for communicate_until to finish writing its input after the sentinel has been read
+WRITE_TIMEOUT = 10
+
 
 def kill_process(process):
     """Kill a process, and ignore the error if it is already dead."""
@@ -104,6 +114,111 @@ def call_binary(name, arguments=(), stdin="", raw_command=None, search_paths=(),
         return stdout, stderr
 
 
+def communicate_until(process, stdin: bytes, sentinel: bytes, is_sentinel: Callable[[bytes], bool],
+                      trailing_lines: int = 0, flush: bytes = b"", flush_interval: float = 0.05) -> List[bytes]:
+    """Send data to an already running process and read its output up until a sentinel.
+
+    This makes it possible to use the same process for several inputs, e.g. when preloading. The sentinel is sent
+    after the input, and the output is read line by line until is_sentinel returns True for a line. The input is
+    written in a separate thread, so that neither of the pipes can fill up and block, no matter the size of the input.
+
+    Args:
+        process: Process started by call_binary or call_java using return_command=True.
+        stdin: Input data.
+        sentinel: Input making the process output a line recognized by is_sentinel.
+        is_sentinel: Function returning True for the output line corresponding to the sentinel.
+        trailing_lines: Number of lines following the sentinel line in the output, which are read and discarded.
+        flush: Dummy input for processes that buffer their output. This is written after the sentinel, and then again
+            whenever no output has been read for flush_interval seconds, until the sentinel line has been read. The
+            amount of dummy input is doubled for every consecutive interval without output (up to MAX_FLUSH_SIZE
+            bytes), and reset as soon as output is read. That way the output is pushed out no matter the size of the
+            buffer. The output for the dummy input is not read, and needs to be skipped when reading the output for
+            the next input.
+        flush_interval: Seconds without output before writing the flush input.
+
+    Returns:
+        The output lines preceding the sentinel line, including line breaks.
+
+    Raises:
+        OSError: If the process stops before the sentinel is reached.
+    """
+    done = threading.Event()
+    lines = []
+
+    def write():
+        try:
+            process.stdin.write(stdin + sentinel + flush)
+            process.stdin.flush()
+            repeat = 1
+            max_repeat = max(1, MAX_FLUSH_SIZE // len(flush)) if flush else 1
+            lines_read = len(lines)
+            while flush and not done.wait(flush_interval):
+                if len(lines) == lines_read:
+                    repeat = min(repeat * 2, max_repeat)
+                    process.stdin.write(flush * repeat)
+                    process.stdin.flush()
+                else:
+                    repeat = 1
+                    lines_read = len(lines)
+        except OSError:
+            # The process has died, which is detected when reading
+            pass
+
+    writer = threading.Thread(target=write, daemon=True)
+    writer.start()
+
+    try:
+        while True:
+            line = process.stdout.readline()
+            if not line:
+                kill_process(process)
+                raise OSError(f"Process {process.args[0]} stopped unexpectedly")
+            if is_sentinel(line):
+                break
+            lines.append(line)
+    finally:
+        done.set()
+    for _ in range(trailing_lines):
+        process.stdout.readline()
+
+    # The output for the dummy input is left unread, so if the process blocks on writing it, the writer may block too.
+    # The output for this input is complete at this point, so kill the process instead of waiting, which makes the
+    # caller start a new one for the next input.
+    writer.join(WRITE_TIMEOUT)
+    if writer.is_alive():
+        logger.debug("Process %s is not reading its input; killing it", process.args[0])
+        kill_process(process)
+        writer.join()
+        process.wait()
+    return lines
+
+
+def log_stderr(process, log: Callable[[str], None], encoding: str = "UTF-8") -> Optional[threading.Thread]:
+    """Read the stderr of a running process in a background thread, and pass every line to a logging function.
+
+    Use this for processes started with return_command=True whose stderr is not read using communicate(), to keep the
+    pipe from filling up and blocking the process.
+
+    Args:
+        process: Process started by call_binary or call_java using return_command=True.
+        log: Function called with every line (without line break).
+        encoding: Encoding of the output.
+
+    Returns:
+        The thread reading stderr, or None if stderr isn't piped.
+    """
+    if process.stderr is None:
+        return None
+
+    def read():
+        for line in iter(process.stderr.readline, b""):
+            log(line.decode(encoding, errors="replace").rstrip())
+
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    return thread
+
+
 def find_binary(name: Union[str, list], search_paths=(), executable: bool = True, allow_dir: bool = False,
                 raise_error: bool = False) -> Optional[str]:
     """Search for the binary for a program.
@@ -198,3 +313,15 @@ def gpus() -> Optional[List[int]]:
         return [i[1] for i in memory]
     except:
         return None
+
+
+def cpu_threads() -> int:
+    """Return the number of threads the current job should use for CPU-bound work.
+
+    When run by Sparv with a limit on the number of jobs of the current annotator that may run in parallel (or by the
+    preloader), this is the number of cores Sparv may use divided by that limit (or the number of preloader processes),
+    so that parallel jobs don't compete for the same cores. Otherwise the number of CPUs is returned.
+    """
+    if job_cpu_threads:
+        return job_cpu_threads
+    return os.cpu_count() or 1
@@ -0,0 +1,220 @@
+"""Benchmark suite for measuring Sparv's performance on synthetic corpora."""
+import argparse
+import json
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from sparv import __version__
+from sparv.api.classes import Annotation, Output
+from sparv.core import io, paths
+from sparv.core.console import console
+
+# Vocabulary used for generating synthetic sentences
+VOCABULARY = [
+    "och", "i", "att", "det", "som", "en", "på", "är", "av", "för", "med", "till", "den", "har", "de", "inte", "om",
+    "ett", "han", "men", "var", "jag", "sig", "från", "vi", "så", "kan", "man", "när", "år", "säger", "hon", "under",
+    "också", "efter", "eller", "nu", "sin", "där", "vid", "mot", "ska", "skulle", "kommer", "ut", "får", "finns",
+    "vara", "hade", "alla", "andra", "mycket", "än", "här", "då", "sedan", "över", "bara", "blir", "upp", "även",
+    "vad", "få", "två", "vill", "ha", "många", "hur", "mer", "gå", "sverige", "kronor", "detta", "nya", "procent",
+    "skall", "hans", "utan", "sina", "något", "svenska", "allt", "första", "fick", "måste", "mellan", "blev", "bli",
+    "dag", "någon", "några", "sitt", "stora", "varit", "dem", "bland", "bra", "tre", "ta", "genom", "del", "hela",
+    "annat", "fanns", "regeringen", "vår", "kanske", "arbetsmarknadspolitik", "rävar", "skogen", "barnbarn",
+    "sommarstuga", "fotbollsmatch", "järnvägsstation", "kunskap", "vänner", "snabbt", "gamla", "vackra", "hus"
+]
+
+DEFAULT_ANNOTATIONS = ["<sentence>:misc.id", "<token>:saldo.baseform", "<token>:saldo.lemgram"]
+
+
+def generate_corpus(corpus_dir: Path, files: int = 10, sentences: int = 100, sentence_length: int = 15,
+                    depth: int = 1, seed: int = 0, export: str = "xml_export:pretty",
+                    annotations: Optional[List[str]] = None) -> int:
+    """Generate a synthetic Swedish corpus with a config file, modeled on the 'standard-swe' test corpus.
+
+    Args:
+        corpus_dir: Directory to create the corpus in.
+        files: Number of source files.
+        sentences: Number of sentences per source file.
+        sentence_length: Mean number of words per sentence.
+        depth: Number of nested XML elements between the text element and the paragraphs.
+        seed: Seed for the random number generator, making the output reproducible.
+        export: Export to create when running the pipeline.
+        annotations: Annotations to include in the export.
+
+    Returns:
+        The total number of tokens (words and punctuation) in the corpus.
+    """
+    rnd = random.Random(seed)
+    source_dir = corpus_dir / paths.source_dir
+    source_dir.mkdir(parents=True, exist_ok=True)
+    total_tokens = 0
+
+    for file_no in range(files):
+        lines = [f'<text id="{file_no}" date="{2000 + file_no % 20}-01-01">']
+        lines.extend("  " * (d + 1) + f'<div level="{d}">' for d in range(depth))
+        indent = "  " * (depth + 1)
+        sentence_no = 0
+        while sentence_no < sentences:
+            paragraph = []
+            for _ in range(min(rnd.randint(1, 5), sentences - sentence_no)):
+                # Vary sentence length between half and one and a half times the mean
+                length = max(1, rnd.randint(sentence_length // 2, sentence_length + sentence_length // 2))
+                words = [rnd.choice(VOCABULARY) for _ in range(length)]
+                paragraph.append(" ".join(words).capitalize() + ".")
+                total_tokens += length + 1
+                sentence_no += 1
+            lines.append(f"{indent}<p>{' '.join(paragraph)}</p>")
+        lines.extend("  " * (d + 1) + "</div>" for d in reversed(range(depth)))
+        lines.append("</text>")
+        (source_dir / f"document{file_no + 1}.xml").write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    config = [
+        "metadata:",
+        "  id: sparv-bench",
+        "  language: swe",
+        "import:",
+        "  importer: xml_import:parse",
+        "  text_annotation: text",
+        "segment:",
+        "  sentence_chunk: <text>",
+        "export:",
+        "  default:",
+        f"    - {export}",
+        "  annotations:",
+        *(f"    - {a}" for a in (annotations or DEFAULT_ANNOTATIONS)),
+        "sparv:",
+        "  compression: none"
+    ]
+    (corpus_dir / paths.config_file).write_text("\n".join(config) + "\n", encoding="utf-8")
+
+    return total_tokens
+
+
+def run_pipeline(corpus_dir: Path, cores: int = 1) -> dict:
+    """Run the pipeline on a corpus from scratch and return the wall time together with the profiling summary."""
+    for d in (paths.work_dir, paths.export_dir, paths.log_dir):
+        shutil.rmtree(corpus_dir / d, ignore_errors=True)
+
+    start_time = time.perf_counter()
+    process = subprocess.run([sys.executable, "-m", "sparv", "run", "-j", str(cores), "--profile", "--simple"],
+                             cwd=corpus_dir)
+    wall_time = time.perf_counter() - start_time
+
+    profile_files = sorted((corpus_dir / paths.log_dir).glob("profile_*.json"))
+    summary = {}
+    if profile_files:
+        with open(profile_files[-1], encoding="utf-8") as f:
+            summary = json.load(f)["summary"]
+
+    return {
+        "success": process.returncode == 0,
+        "wall_time": wall_time,
+        "annotators": summary
+    }
+
+
+def io_benchmark(items: int = 100000, compressions: Optional[List[str]] = None) -> Dict[str, dict]:
+    """Measure read and write throughput (items per second) for spans and attributes, per compression codec."""
+    spans = [(i * 10, i * 10 + 8) for i in range(items)]
+    values = [f"value{i % 1000}" for i in range(items)]
+    original_compression = io.compression
+    results = {}
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for compression in compressions or list(io._compressed_open):
+                io.compression = compression
+                span_output = Output("bench.token", source_file="bench")
+                attribute_output = Output("bench.token:bench.value", source_file="bench")
+                span_input = Annotation("bench.token", source_file="bench")
+                attribute_input = Annotation("bench.token:bench.value", source_file="bench")
+                for annotation in (span_output, attribute_output, span_input, attribute_input):
+                    annotation.root = Path(tmp_dir, compression)
+
+                timings = {}
+                start_time = time.perf_counter()
+                span_output.write(spans)
+                timings["write_spans"] = time.perf_counter() - start_time
+
+                start_time = time.perf_counter()
+                attribute_output.write(values)
+                timings["write_attributes"] = time.perf_counter() - start_time
+
+                start_time = time.perf_counter()
+                for _ in span_input.read_spans():
+                    pass
+                timings["read_spans"] = time.perf_counter() - start_time
+
+                start_time = time.perf_counter()
+                for _ in attribute_input.read():
+                    pass
+                timings["read_attributes"] = time.perf_counter() - start_time
+
+                results[compression] = {k: items / v if v else None for k, v in timings.items()}
+    finally:
+        io.compression = original_compression
+    return results
+
+
+def main(argv=None):
+    """Parse command line arguments and run the benchmarks."""
+    parser = argparse.ArgumentParser(prog="sparv bench",
+                                     description="Run reproducible performance benchmarks on a synthetic corpus.")
+    parser.add_argument("--corpus-dir", help="Directory to generate the corpus in (default: temporary directory)")
+    parser.add_argument("--files", type=int, default=10, help="Number of source files")
+    parser.add_argument("--sentences", type=int, default=100, help="Number of sentences per source file")
+    parser.add_argument("--sentence-length", type=int, default=15, help="Mean number of words per sentence")
+    parser.add_argument("--depth", type=int, default=1, help="XML nesting depth below the text element")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the corpus generator")
+    parser.add_argument("--export", default="xml_export:pretty", help="Export to run")
+    parser.add_argument("--annotations", nargs="+", default=DEFAULT_ANNOTATIONS,
+                        help="Annotations to include in the export")
+    parser.add_argument("-j", "--cores", type=int, default=1, help="Number of cores to use")
+    parser.add_argument("--io-items", type=int, default=100000, help="Number of items used in the I/O benchmarks")
+    parser.add_argument("--skip-pipeline", action="store_true", help="Skip running the pipeline")
+    parser.add_argument("--skip-io", action="store_true", help="Skip the I/O benchmarks")
+    parser.add_argument("-o", "--output", help="Save results as JSON to this file instead of printing them")
+    args = parser.parse_args(argv)
+
+    settings = {k: v for k, v in vars(args).items() if k not in ("corpus_dir", "output")}
+    result = {
+        "sparv_version": __version__,
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": settings
+    }
+
+    if not args.skip_pipeline:
+        tmp_dir = None
+        if args.corpus_dir:
+            corpus_dir = Path(args.corpus_dir)
+        else:
+            tmp_dir = tempfile.TemporaryDirectory()
+            corpus_dir = Path(tmp_dir.name)
+        try:
+            console.print(f"Generating corpus in {corpus_dir}")
+            result["tokens"] = generate_corpus(corpus_dir, args.files, args.sentences, args.sentence_length,
+                                               args.depth, args.seed, args.export, args.annotations)
+            console.print("Running pipeline")
+            result["pipeline"] = run_pipeline(corpus_dir, args.cores)
+            result["pipeline"]["tokens_per_second"] = result["tokens"] / result["pipeline"]["wall_time"]
+        finally:
+            if tmp_dir:
+                tmp_dir.cleanup()
+
+    if not args.skip_io:
+        console.print("Running I/O benchmarks")
+        result["io"] = io_benchmark(args.io_items)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        console.print(f"Results saved to {args.output}")
+    else:
+        print(json.dumps(result, indent=2))
@@ -1,5 +1,6 @@
 """Handler for log messages, both from the logging library and from Snakemake."""
 import datetime
+import json
 import logging
 import logging.handlers
 import os
@@ -41,11 +42,50 @@ INTERNAL = 100
 logging.addLevelName(INTERNAL, "INTERNAL")
 
 
+# Minimum time in seconds between progress updates sent from a job, and between sending batches of log records
+PROGRESS_INTERVAL = 0.1
+BATCH_INTERVAL = 0.25
+# Maximum number of log records to buffer before sending them to the log handler
+BATCH_CAPACITY = 200
+
+# Progress advances not yet sent to the log handler, and the time of the last progress update sent
+_pending_progress = {"advance": 0, "time": 0.0, "logger": None}
+
+
 def _log_progress(self, progress=None, advance=None, total=None):
-    """Log progress of task."""
-    if self.isEnabledFor(INTERNAL):
-        self._log(INTERNAL, "progress", (), extra={"progress": progress, "advance": advance, "total": total,
-                                                   "job": current_job, "file": current_file})
+    """Log progress of task.
+
+    Calls that only advance the progress are coalesced, so that at most one update is sent per PROGRESS_INTERVAL
+    seconds. This makes it cheap to call this function in tight loops.
+    """
+    if not self.isEnabledFor(INTERNAL):
+        return
+    if progress is None and total is None:
+        _pending_progress["advance"] += advance or 1
+        _pending_progress["logger"] = self
+        now = time.monotonic()
+        if now - _pending_progress["time"] < PROGRESS_INTERVAL:
+            return
+        advance = _pending_progress["advance"]
+        _pending_progress["advance"] = 0
+        _pending_progress["time"] = now
+    elif progress is not None:
+        # Absolute progress makes any pending advances obsolete
+        _pending_progress["advance"] = 0
+    else:
+        flush_progress()
+    self._log(INTERNAL, "progress", (), extra={"progress": progress, "advance": advance, "total": total,
+                                               "job": current_job, "file": current_file})
+
+
+def flush_progress():
+    """Send any progress advances that have been held back by the rate limiting in _log_progress."""
+    if _pending_progress["advance"]:
+        advance = _pending_progress["advance"]
+        _pending_progress["advance"] = 0
+        _pending_progress["time"] = time.monotonic()
+        _pending_progress["logger"]._log(INTERNAL, "progress", (), extra={
+            "progress": None, "advance": advance, "total": None, "job": current_job, "file": current_file})
 
 
 # Add progress function to logger
@@ -71,6 +111,17 @@ def _export_dirs(self, dirs):
 logging.export_dirs = _export_dirs
 logging.Logger.export_dirs = _export_dirs
 
+
+def _job_stats(self, stats):
+    """Send performance statistics for a job to log handler."""
+    if self.isEnabledFor(INTERNAL):
+        self._log(INTERNAL, "job_stats", (), extra={"job_stats": stats})
+
+
+# Add log function to logger
+logging.job_stats = _job_stats
+logging.Logger.job_stats = _job_stats
+
 # Messages from the Sparv core
 messages = {
     "missing_configs": defaultdict(set),
@@ -87,7 +138,10 @@ class LogRecordStreamHandler(socketserver.StreamRequestHandler):
     """Handler for streaming logging requests."""
 
     def handle(self):
-        """Handle multiple requests - each expected to be a 4-byte length followed by the LogRecord in pickle format."""
+        """Handle multiple requests - each expected to be a 4-byte length followed by the LogRecord in pickle format.
+
+        The pickled data is either a single LogRecord dictionary or a list of them, as sent by BatchedSocketHandler.
+        """
         while True:
             chunk = self.connection.recv(4)
             if len(chunk) < 4:
@@ -97,8 +151,8 @@ class LogRecordStreamHandler(socketserver.StreamRequestHandler):
             while len(chunk) < slen:
                 chunk = chunk + self.connection.recv(slen - len(chunk))
             obj = pickle.loads(chunk)
-            record = logging.makeLogRecord(obj)
-            self.handle_log_record(record)
+            for record_dict in obj if isinstance(obj, list) else [obj]:
+                self.handle_log_record(logging.makeLogRecord(record_dict))
 
     @staticmethod
     def handle_log_record(record):
@@ -107,6 +161,72 @@ class LogRecordStreamHandler(socketserver.StreamRequestHandler):
         sparv_logger.handle(record)
 
 
+class BatchedSocketHandler(logging.handlers.SocketHandler):
+    """SocketHandler which buffers log records and sends them in batches.
+
+    Buffered records are sent when the buffer is full, when a record of level WARNING or higher (except progress
+    updates) is logged, and periodically by a background thread.
+    """
+
+    def __init__(self, host, port, capacity: int = BATCH_CAPACITY, interval: float = BATCH_INTERVAL):
+        super().__init__(host, port)
+        self.capacity = capacity
+        self.interval = interval
+        self.buffer = []
+        self.closed = threading.Event()
+        self.flusher = None
+
+    def emit(self, record):
+        """Add record to buffer, and send the buffer if needed."""
+        try:
+            record_dict = self.make_dict(record)
+        except Exception:
+            self.handleError(record)
+            return
+        with self.lock:
+            self.buffer.append(record_dict)
+            if self.flusher is None:
+                self.flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+                self.flusher.start()
+            if len(self.buffer) >= self.capacity or (record.levelno >= logging.WARNING and record.msg != "progress"):
+                self.flush()
+
+    def make_dict(self, record) -> dict:
+        """Convert record to a picklable dictionary, in the same way as SocketHandler.makePickle()."""
+        ei = record.exc_info
+        if ei:
+            # Make sure exception text is saved in record.exc_text
+            self.format(record)
+        d = dict(record.__dict__)
+        d["msg"] = record.getMessage()
+        d["args"] = None
+        d["exc_info"] = None
+        d.pop("message", None)
+        return d
+
+    def flush(self):
+        """Send all buffered records as one frame."""
+        with self.lock:
+            if not self.buffer:
+                return
+            data = pickle.dumps(self.buffer, 1)
+            self.buffer = []
+            self.send(struct.pack(">L", len(data)) + data)
+
+    def _flush_periodically(self):
+        while not self.closed.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        """Send any held back progress and buffered records, and close the socket."""
+        with self.lock:
+            if not self.closed.is_set():
+                flush_progress()
+                self.flush()
+                self.closed.set()
+        super().close()
+
+
 class LogLevelCounterHandler(logging.Handler):
     """Handler that counts the number of log messages per log level."""
 
@@ -149,8 +269,9 @@ class ProgressInternalFilter(logging.Filter):
 class InternalLogHandler(logging.Handler):
     """Handler for internal log messages."""
 
-    def __init__(self, export_dirs_list, progress_, jobs, job_ids):
+    def __init__(self, export_dirs_list, progress_, jobs, job_ids, job_stats_list):
         self.export_dirs_list = export_dirs_list
+        self.job_stats_list = job_stats_list
         self.progress: progress.Progress = progress_
         self.jobs = jobs
         self.job_ids = job_ids
@@ -160,6 +281,8 @@ class InternalLogHandler(logging.Handler):
         """Handle log record."""
         if record.msg == "export_dirs":
             self.export_dirs_list.update(record.export_dirs)
+        elif record.msg == "job_stats":
+            self.job_stats_list.append(record.job_stats)
         elif record.msg == "progress":
             job_id = self.job_ids.get((record.job, record.file or ""))
             if job_id is not None:
@@ -244,7 +367,7 @@ class LogHandler:
     icon = "\U0001f426"
 
     def __init__(self, progressbar=True, log_level=None, log_file_level=None, simple=False, stats=False,
-                 pass_through=False, dry_run=False, keep_going=False, json=False):
+                 pass_through=False, dry_run=False, keep_going=False, json=False, profile=False):
         """Initialize log handler.
 
         Args:
@@ -257,6 +380,7 @@ class LogHandler:
             dry_run: Set to True to print summary about jobs.
             keep_going: Set to True if the keepgoing flag is enabled for Snakemake.
             json: Set to True to enable JSON output.
+            profile: Set to True to show a performance report per annotator after completion.
         """
         self.use_progressbar = progressbar and console.is_terminal
         self.simple = simple or not console.is_terminal
@@ -280,6 +404,8 @@ class LogHandler:
         self.jobs_max_len = 0
         self.stats = stats
         self.stats_data = defaultdict(float)
+        self.profile = profile
+        self.job_stats = []
         self.logger = None
         self.terminated = False
 
@@ -366,7 +492,8 @@ class LogHandler:
         self.logger.addHandler(levelcount_handler)
 
         # Internal log handler
-        internal_handler = InternalLogHandler(self.export_dirs, self.progress, self.current_jobs, self.job_ids)
+        internal_handler = InternalLogHandler(self.export_dirs, self.progress, self.current_jobs, self.job_ids,
+                                              self.job_stats)
         internal_handler.setLevel(INTERNAL)
         self.logger.addHandler(internal_handler)
 
@@ -757,6 +884,10 @@ class LogHandler:
                                       "{:.1f}%".format(100 * elapsed / total_time))
                     console.print(table)
 
+                if self.profile and self.job_stats:
+                    spacer = ""
+                    self.print_profile()
+
                 if self.log_levelcount:
                     # Errors or warnings were logged but execution finished anyway. Notify user of potential problems.
                     problems = []
@@ -783,6 +914,36 @@ class LogHandler:
                 if self.terminated:
                     self.info(f"{spacer}Sparv was stopped by a TERM signal")
 
+    def print_profile(self):
+        """Print a performance report per annotator and save all collected job statistics to a JSON file."""
+        from sparv.core import profiler
+
+        summary = profiler.summarize(self.job_stats)
+
+        table = Table(box=box.SIMPLE)
+        table.add_column("Task", no_wrap=True, min_width=self.jobs_max_len + 2, ratio=1)
+        for column in ("Jobs", "Total time", "Mean", "P95", "CPU time", "Peak RSS", "Tokens/s"):
+            table.add_column(column, no_wrap=True, justify="right")
+        for task, data in sorted(summary.items(), key=lambda x: -x[1]["total_time"]):
+            table.add_row(
+                task,
+                str(data["jobs"]),
+                f"{data['total_time']:.2f}s",
+                f"{data['mean_time']:.2f}s",
+                f"{data['p95_time']:.2f}s",
+                f"{data['cpu_time']:.2f}s",
+                f"{data['max_peak_rss'] / 1024 ** 2:.0f} MB" if data["max_peak_rss"] is not None else "",
+                f"{data['tokens_per_second']:.0f}" if data["tokens_per_second"] is not None else ""
+            )
+        console.print(table)
+
+        profile_filename = "profile_{}.json".format(datetime.datetime.now().strftime("%Y-%m-%d_%H.%M.%S.%f"))
+        profile_file = Path(paths.log_dir) / profile_filename
+        profile_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(profile_file, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "jobs": self.job_stats}, f, indent=2)
+        self.info(f"Performance report saved to {profile_file}")
+
     @staticmethod
     def cleanup():
         """Remove Snakemake log files."""
@@ -802,8 +963,9 @@ def setup_logging(log_server, log_level: str = "warning", log_file_level: str =
     log_level = min(logging.WARNING, getattr(logging, log_level.upper()), getattr(logging, log_file_level.upper()))
     socket_logger = logging.getLogger("sparv")
     socket_logger.setLevel(log_level)
-    socket_handler = logging.handlers.SocketHandler(*log_server)
+    socket_handler = BatchedSocketHandler(*log_server)
     socket_logger.addHandler(socket_handler)
     global current_file, current_job
     current_file = file
     current_job = job
+    _pending_progress.update({"advance": 0, "time": 0.0, "logger": None})
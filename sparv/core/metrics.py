@@ -0,0 +1,223 @@
+"""Collect and aggregate metrics for the preloader workers."""
+import math
+import os
+import time
+from typing import Dict, List, Optional
+
+from sparv.core import profiler
+
+# Upper bounds (in seconds) of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, math.inf)
+
+
+class Histogram:
+    """Histogram of durations, with fixed bucket boundaries."""
+
+    def __init__(self, counts: Optional[List[int]] = None, total: float = 0.0):
+        self.counts = counts or [0] * len(BUCKETS)
+        self.total = total
+
+    @property
+    def count(self) -> int:
+        """Number of observations."""
+        return sum(self.counts)
+
+    def observe(self, value: float) -> None:
+        """Add an observation to the histogram."""
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+
+    def merge(self, other: "Histogram") -> None:
+        """Add all the observations of another histogram to this one."""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    def mean(self) -> Optional[float]:
+        """Return the mean value, or None if the histogram is empty."""
+        count = self.count
+        return self.total / count if count else None
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Return the upper bound of the bucket containing the p:th percentile, or None if the histogram is empty."""
+        count = self.count
+        if not count:
+            return None
+        rank = max(math.ceil(p / 100 * count), 1)
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, self.counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound
+
+    def to_dict(self) -> dict:
+        """Return the histogram as a dictionary that can be pickled without depending on this class."""
+        return {"counts": list(self.counts), "total": self.total}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Histogram":
+        """Create histogram from a dictionary created by to_dict()."""
+        return cls(list(data["counts"]), data["total"])
+
+
+class AnnotatorMetrics:
+    """Metrics for one preloaded annotator within one worker."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.wait = Histogram()
+        self.latency = Histogram()
+        self.cleanup = Histogram()
+
+    def to_dict(self) -> dict:
+        """Return the metrics as a dictionary."""
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "wait": self.wait.to_dict(),
+            "latency": self.latency.to_dict(),
+            "cleanup": self.cleanup.to_dict()
+        }
+
+
+class WorkerMetrics:
+    """Metrics for one preloader worker, published to a dictionary shared between all workers."""
+
+    def __init__(self, worker_no: int, shared: Optional[dict] = None):
+        """Initialize metrics.
+
+        Args:
+            worker_no: Worker number.
+            shared: Dictionary (e.g. from multiprocessing.Manager) shared between the workers, indexed by worker number.
+        """
+        self.worker_no = worker_no
+        self.shared = shared
+        self.start_time = time.time()
+        self.busy_time = 0.0
+        self.annotators: Dict[str, AnnotatorMetrics] = {}
+
+    def annotator(self, name: str) -> AnnotatorMetrics:
+        """Return the metrics for an annotator."""
+        if name not in self.annotators:
+            self.annotators[name] = AnnotatorMetrics()
+        return self.annotators[name]
+
+    def request(self, name: str, wait: Optional[float], latency: float, failed: bool) -> None:
+        """Record a handled request."""
+        annotator = self.annotator(name)
+        annotator.requests += 1
+        if failed:
+            annotator.errors += 1
+        if wait is not None:
+            annotator.wait.observe(max(wait, 0.0))
+        annotator.latency.observe(latency)
+        self.busy_time += latency
+
+    def cleanup(self, name: str, duration: float) -> None:
+        """Record time spent running the cleanup function after a request."""
+        self.annotator(name).cleanup.observe(duration)
+        self.busy_time += duration
+
+    def snapshot(self) -> dict:
+        """Return the current metrics as a dictionary."""
+        return {
+            "worker": self.worker_no,
+            "pid": os.getpid(),
+            "uptime": time.time() - self.start_time,
+            "busy_time": self.busy_time,
+            "rss": get_rss(),
+            "annotators": {name: a.to_dict() for name, a in self.annotators.items()}
+        }
+
+    def publish(self) -> None:
+        """Update the shared dictionary with the current metrics."""
+        if self.shared is not None:
+            try:
+                self.shared[self.worker_no] = self.snapshot()
+            except (OSError, EOFError):
+                # The manager process is gone, so stop publishing
+                self.shared = None
+
+    def collect(self) -> Dict[int, dict]:
+        """Publish the metrics for this worker, and return the metrics for all workers."""
+        self.publish()
+        if self.shared is None:
+            return {self.worker_no: self.snapshot()}
+        return dict(self.shared)
+
+
+def get_rss() -> Optional[int]:
+    """Return the current resident set size of this process in bytes, falling back on the peak value."""
+    try:
+        with open("/proc/self/statm", encoding="utf-8") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return profiler.get_peak_rss()
+
+
+def aggregate(workers: Dict[int, dict]) -> Dict[str, dict]:
+    """Combine the per-annotator metrics from several workers, returning Histogram objects."""
+    annotators = {}
+    for snapshot in workers.values():
+        for name, metrics in snapshot["annotators"].items():
+            if name not in annotators:
+                annotators[name] = {"requests": 0, "errors": 0, "wait": Histogram(), "latency": Histogram(),
+                                    "cleanup": Histogram()}
+            combined = annotators[name]
+            combined["requests"] += metrics["requests"]
+            combined["errors"] += metrics["errors"]
+            for key in ("wait", "latency", "cleanup"):
+                combined[key].merge(Histogram.from_dict(metrics[key]))
+    return annotators
+
+
+def to_openmetrics(workers: Dict[int, dict]) -> str:
+    """Return metrics for all workers in the OpenMetrics text format."""
+    annotators = aggregate(workers)
+    lines = []
+
+    for metric, key, help_text in (("requests", "requests", "Number of handled requests"),
+                                   ("request_errors", "errors", "Number of requests that failed")):
+        lines.append(f"# TYPE sparv_preloader_{metric} counter")
+        lines.append(f"# HELP sparv_preloader_{metric} {help_text}.")
+        for name, metrics in sorted(annotators.items()):
+            lines.append(f'sparv_preloader_{metric}_total{{annotator="{name}"}} {metrics[key]}')
+
+    for key, help_text in (("wait", "Time between sending a request and the worker starting to handle it"),
+                           ("latency", "Time spent executing the annotator"),
+                           ("cleanup", "Time spent running the cleanup function after a request")):
+        metric = f"sparv_preloader_{key}_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        lines.append(f"# UNIT {metric} seconds")
+        lines.append(f"# HELP {metric} {help_text}.")
+        for name, metrics in sorted(annotators.items()):
+            histogram = metrics[key]
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                lines.append(f'{metric}_bucket{{annotator="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{annotator="{name}"}} {histogram.total}')
+            lines.append(f'{metric}_count{{annotator="{name}"}} {cumulative}')
+
+    lines.append("# TYPE sparv_preloader_worker_busy_ratio gauge")
+    lines.append("# HELP sparv_preloader_worker_busy_ratio Share of the worker's uptime spent handling requests.")
+    for worker_no, snapshot in sorted(workers.items()):
+        lines.append(f'sparv_preloader_worker_busy_ratio{{worker="{worker_no}"}} {busy_ratio(snapshot)}')
+    lines.append("# TYPE sparv_preloader_worker_rss_bytes gauge")
+    lines.append("# UNIT sparv_preloader_worker_rss_bytes bytes")
+    lines.append("# HELP sparv_preloader_worker_rss_bytes Resident set size of the worker process.")
+    for worker_no, snapshot in sorted(workers.items()):
+        if snapshot["rss"] is not None:
+            lines.append(f'sparv_preloader_worker_rss_bytes{{worker="{worker_no}"}} {snapshot["rss"]}')
+
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def busy_ratio(snapshot: dict) -> float:
+    """Return the share of a worker's uptime spent handling requests."""
+    return min(snapshot["busy_time"] / snapshot["uptime"], 1.0) if snapshot["uptime"] else 0.0
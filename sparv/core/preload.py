@@ -3,22 +3,31 @@ import logging
 import multiprocessing
 import os
 import pickle
+import signal
 import socket
 import struct
+import subprocess
+import threading
 import time
+from collections import Counter
 from contextlib import contextmanager
+from datetime import datetime
+from multiprocessing.managers import SyncManager
 from pathlib import Path
-from typing import Dict, Iterator
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
 from rich.logging import RichHandler
 
-from sparv.core import config, io, log_handler
+from sparv.api.classes import Model
+from sparv.api.util import system
+from sparv.core import config, io, log_handler, metrics, profiler
 from sparv.core.console import console
 from sparv.core.misc import SparvErrorMessage
 from sparv.core.snake_utils import SnakeStorage
 
 INFO = "INFO"
 STATUS = "STATUS"
+STATS = "STATS"
 STOP = "STOP"
 PING = "PING"
 PONG = "PONG"
@@ -30,12 +39,26 @@ handler = RichHandler(show_path=False, rich_tracebacks=True, console=console)
 handler.setFormatter(logging.Formatter("%(message)s", datefmt=log_handler.DATE_FORMAT))
 log.addHandler(handler)
 
+# Lock used when swapping a preloaded object for a reloaded one
+reload_lock = threading.Lock()
+
 # Set compression
 compression = config.get("sparv.compression")
 if compression:
     io.compression = compression
 
 
+class Request(NamedTuple):
+    """A request to run a preloaded annotator, identified by an ID used to match it with its response."""
+
+    id: int
+    name: str
+    parameters: dict
+    config: dict
+    file: Optional[str]
+    sent: Optional[float] = None  # Time when the request was sent
+
+
 class Preloader:
     """Class representing a preloader."""
 
@@ -47,6 +70,133 @@ class Preloader:
         self.cleanup = cleanup
         self.shared = shared
         self.preloaded = None
+        self.version = 0
+        self.models = {}
+        self.pid = None  # ID of the process that loaded the current version
+        self.in_use = Counter()  # Number of running requests per version
+        self.replaced = {}  # Replaced versions still used by running requests
+
+    def load(self) -> None:
+        """Load (or reload) the preloaded object, and remember the state of the model files it was loaded from.
+
+        A replaced version is closed once no running request uses it anymore, unless it was loaded (and shared) by
+        another process.
+        """
+        # Check the model files before loading, to make sure that any changes made during loading trigger a reload
+        models = get_model_state(self.params)
+        preloaded = self.preloader(**self.params)
+        old = None
+        with reload_lock:
+            if self.preloaded is not None and self.pid == os.getpid():
+                if self.in_use[self.version]:
+                    self.replaced[self.version] = self.preloaded
+                else:
+                    old = self.preloaded
+            self.preloaded = preloaded
+            self.models = models
+            self.version += 1
+            self.pid = os.getpid()
+        if old is not None:
+            close_preloaded(old)
+
+    def acquire(self) -> Tuple[Any, int]:
+        """Return the current preloaded object and its version, for use by a request."""
+        with reload_lock:
+            self.in_use[self.version] += 1
+            return self.preloaded, self.version
+
+    def release(self, preloaded: Any, version: int) -> None:
+        """Mark a request as done, and close its version of the preloaded object if it has been replaced meanwhile.
+
+        Args:
+            preloaded: The preloaded object used by the request, or the object returned by the cleanup function.
+            version: The version returned by acquire().
+        """
+        with reload_lock:
+            self.in_use[version] -= 1
+            if version == self.version:
+                self.preloaded = preloaded
+                return
+            if version not in self.replaced:
+                return
+            self.replaced[version] = preloaded
+            if self.in_use[version]:
+                return
+            old = self.replaced.pop(version)
+            del self.in_use[version]
+        close_preloaded(old)
+
+    def info(self) -> dict:
+        """Return preloader parameters together with the version and modification times of the loaded models."""
+        return {
+            "params": self.params,
+            "version": self.version,
+            "models": {path: datetime.fromtimestamp(mtime / 1e9).isoformat(timespec="seconds")
+                       for path, (mtime, _size) in self.models.items()}
+        }
+
+
+def close_preloaded(preloaded: Any) -> None:
+    """Stop any processes and close any other resources held by a preloaded object that is no longer used.
+
+    Processes are looked for in dictionaries, lists and tuples, and any other object with a close() method is closed.
+    """
+    if isinstance(preloaded, subprocess.Popen):
+        system.kill_process(preloaded)
+        preloaded.wait()
+    elif isinstance(preloaded, dict):
+        for value in preloaded.values():
+            close_preloaded(value)
+    elif isinstance(preloaded, (list, tuple)):
+        for value in preloaded:
+            close_preloaded(value)
+    elif callable(getattr(preloaded, "close", None)):
+        try:
+            preloaded.close()
+        except Exception:
+            log.exception("Could not close replaced preloaded object %r", preloaded)
+
+
+def get_model_state(params: dict) -> Dict[str, Tuple[int, int]]:
+    """Return modification time and size for every existing model file among the preloader parameters."""
+    models = {}
+    for value in params.values():
+        if isinstance(value, Model):
+            try:
+                stat = value.path.stat()
+            except OSError:
+                continue
+            models[str(value.path.resolve())] = (stat.st_mtime_ns, stat.st_size)
+    return models
+
+
+def watch_models(annotators: Dict[str, Preloader], interval: float) -> None:
+    """Periodically check the model files used by the preloaded annotators and reload annotators whose models changed.
+
+    Reloading happens in the background while requests keep being handled using the old version. Once loaded, the new
+    version is used for all new requests, and the old version is closed when the last request using it is done. A model
+    is only reloaded once its files have remained unchanged for one interval, to avoid loading files that are still
+    being written.
+    """
+    pending = {}
+    while True:
+        time.sleep(interval)
+        for name, annotator in annotators.items():
+            state = get_model_state(annotator.params)
+            if state == annotator.models:
+                pending.pop(name, None)
+                continue
+            if pending.get(name) != state:
+                pending[name] = state
+                continue
+            del pending[name]
+            log.info("Model files for %s have changed. Reloading...", name)
+            try:
+                annotator.load()
+                log.info("Reloaded %s (version %d)", name, annotator.version)
+            except Exception:
+                log.exception("Could not reload %s. Keeping the previous version.", name)
+                annotator.models = state
 
 
 def connect_to_socket(socket_path: str, timeout: bool = False) -> socket.socket:
@@ -70,6 +220,72 @@ def socketcontext(socket_path: str) -> Iterator[socket.socket]:
         s.close()
 
 
+class PreloaderClient:
+    """A persistent connection to the preloader, supporting several pipelined requests."""
+
+    def __init__(self, socket_path: str, timeout: bool = False, max_in_flight: int = 16):
+        """Connect to the preloader.
+
+        Args:
+            socket_path: Path to the preloader socket.
+            timeout: Set to True to time out if the connection can't be made within a second.
+            max_in_flight: Maximum number of requests sent before waiting for responses.
+        """
+        self.sock = connect_to_socket(socket_path, timeout=timeout)
+        self.max_in_flight = max_in_flight
+        self.next_id = 0
+
+    def ping(self, timeout: Optional[float] = None) -> None:
+        """Check that the preloader is free, raising socket.timeout if no answer is received within the timeout."""
+        self.sock.settimeout(timeout)
+        try:
+            send_data(self.sock, PING)
+            receive_data(self.sock)
+        finally:
+            self.sock.settimeout(None)
+
+    def submit(self, name: str, parameters: dict, config_: dict, source_file: Optional[str]) -> int:
+        """Send a request without waiting for the response, and return the request ID."""
+        request_id = self.next_id
+        self.next_id += 1
+        send_data(self.sock, Request(request_id, name, parameters, config_, source_file, time.time()))
+        return request_id
+
+    def receive(self) -> Tuple[int, Any]:
+        """Wait for the next response and return it together with its request ID."""
+        response = receive_data(self.sock)
+        if response is None:
+            raise ConnectionError("The connection to the preloader was closed.")
+        return response
+
+    def run(self, requests: Iterable[Tuple[str, dict, dict, Optional[str]]]) -> List[Any]:
+        """Run several requests over this connection and return the responses in the same order as the requests.
+
+        Requests are pipelined, with at most max_in_flight requests waiting for a response at a time.
+        """
+        responses = {}
+        request_ids = []
+        for request in requests:
+            if len(request_ids) - len(responses) >= self.max_in_flight:
+                request_id, response = self.receive()
+                responses[request_id] = response
+            request_ids.append(self.submit(*request))
+        while len(responses) < len(request_ids):
+            request_id, response = self.receive()
+            responses[request_id] = response
+        return [responses[i] for i in request_ids]
+
+    def close(self) -> None:
+        """Close the connection."""
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 def receive_data(sock):
     """Receive pickled data from socket and unpickle."""
     # Get data length
@@ -89,9 +305,8 @@ def receive_data(sock):
 
 def send_data(sock, data):
     """Send pickled data over socket."""
-    datap = pickle.dumps(data)
-    sock.sendall(struct.pack(">I", len(datap)))
-    sock.sendall(datap)
+    datap = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(struct.pack(">I", len(datap)) + datap)
 
 
 def get_preloader_info(socket_path):
@@ -110,6 +325,65 @@ def get_preloader_status(socket_path):
     return response
 
 
+def get_preloader_stats(socket_path):
+    """Get metrics for all preloader workers."""
+    with socketcontext(socket_path) as sock:
+        send_data(sock, STATS)
+        response = receive_data(sock)
+    return response
+
+
+def print_status(socket_path: str, stats: bool = False) -> None:
+    """Print preloader status, and optionally metrics per annotator and worker."""
+    from rich import box
+    from rich.table import Table
+
+    try:
+        status = get_preloader_status(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        raise SparvErrorMessage(f"Could not connect to socket '{socket_path}'.")
+
+    console.print(f"The preloader at {socket_path} is running with the following annotators:")
+    for name, version in sorted(status["annotators"].items()):
+        console.print(f"  {name} (model version {version})")
+
+    if not stats:
+        return
+
+    workers = get_preloader_stats(socket_path)
+
+    def seconds(value):
+        return "" if value is None else f"{value:.3f}"
+
+    table = Table(title="Annotators", box=box.SIMPLE, title_justify="left")
+    for column in ("Annotator", "Requests", "Errors", "Mean wait (s)", "Mean time (s)", "p50 ≤ (s)", "p95 ≤ (s)",
+                   "Mean cleanup (s)"):
+        table.add_column(column, justify="left" if column == "Annotator" else "right")
+    for name, annotator in sorted(metrics.aggregate(workers).items()):
+        table.add_row(name, str(annotator["requests"]), str(annotator["errors"]),
+                      seconds(annotator["wait"].mean()), seconds(annotator["latency"].mean()),
+                      seconds(annotator["latency"].percentile(50)), seconds(annotator["latency"].percentile(95)),
+                      seconds(annotator["cleanup"].mean()))
+    console.print(table)
+
+    table = Table(title="Workers", box=box.SIMPLE, title_justify="left")
+    for column in ("Worker", "PID", "Requests", "Busy", "RSS (MB)"):
+        table.add_column(column, justify="right")
+    for worker_no, snapshot in sorted(workers.items()):
+        rss = snapshot["rss"]
+        table.add_row(str(worker_no), str(snapshot["pid"]),
+                      str(sum(a["requests"] for a in snapshot["annotators"].values())),
+                      f"{metrics.busy_ratio(snapshot):.0%}", "" if rss is None else f"{rss / 1024 ** 2:.0f}")
+    console.print(table)
+
+
+def write_metrics(workers: Dict[int, dict], metrics_file: Path) -> None:
+    """Write metrics for all workers to a file in the OpenMetrics text format, replacing the file atomically."""
+    tmp_file = metrics_file.with_name(metrics_file.name + ".tmp")
+    tmp_file.write_text(metrics.to_openmetrics(workers), encoding="utf-8")
+    tmp_file.replace(metrics_file)
+
+
 def stop(socket_path):
     """Send stop signal to Sparv preloader."""
     try:
@@ -135,73 +409,127 @@ def recvall(sock, size: int):
     return buf
 
 
-def handle(client_sock, annotators: Dict[str, Preloader]):
-    """Handle request and execute preloaded function."""
+def handle(client_sock, annotators: Dict[str, Preloader],
+           worker_metrics: Optional[metrics.WorkerMetrics] = None) -> Optional[bool]:
+    """Handle one request and execute preloaded function.
+
+    The request is either a command, a Request, or (for backward compatibility) a plain tuple with the same contents as
+    a Request but without the ID. The response to a Request is a tuple with the request ID and the result.
+
+    Returns:
+        False if the preloader should stop, None if the client closed the connection, otherwise True.
+    """
     # Get data
     data = receive_data(client_sock)
     if data is None:
-        return
+        return None
 
     # Check if we got a command instead of annotator info
     if isinstance(data, str):
         if data == STOP:
             return False
         elif data == INFO:
-            send_data(client_sock, {k: v.params for k, v in annotators.items()})
-            return
+            send_data(client_sock, {k: v.info() for k, v in annotators.items()})
+        elif data == STATUS:
+            send_data(client_sock, {"annotators": {k: v.version for k, v in annotators.items()}})
+        elif data == STATS:
+            send_data(client_sock, worker_metrics.collect() if worker_metrics else {})
         elif data == PING:
             try:
                 send_data(client_sock, PONG)
             except BrokenPipeError:
-                return
-            data = receive_data(client_sock)
+                return None
+        return True
 
-    log.info("Running %s...", data[0])
+    start_time = time.time()
+    if isinstance(data, Request):
+        request_id, name, parameters, config_, source_file, sent = data
+    else:
+        request_id, sent = None, None
+        name, parameters, config_, source_file = data
 
-    annotator = annotators[data[0]]
+    def respond(response):
+        send_data(client_sock, response if request_id is None else (request_id, response))
 
-    # Set target parameter to preloaded data
-    data[1][annotator.target] = annotator.preloaded
+    log.info("Running %s...", name)
 
-    # Set up logging over socket
-    log_handler.setup_logging(data[2]["log_server"],
-                              log_level=data[2]["log_level"],
-                              log_file_level=data[2]["log_file_level"],
-                              file=data[3],
-                              job=data[0])
+    annotator = annotators[name]
 
-    # Call annotator function
+    # Set target parameter to preloaded data. If the model is reloaded while running, this request still finishes
+    # using the old version, which is closed afterwards.
+    preloaded, version = annotator.acquire()
     try:
-        annotator.function(**data[1])
-    except SparvErrorMessage as e:
-        send_data(client_sock, e)
-        return
-    except Exception as e:
-        console.print_exception()
-        send_data(client_sock, e)
-        return
-    finally:
-        # Clear log handlers
-        logger = logging.getLogger("sparv")
-        logger.handlers.clear()
-
-    log.info("Done")
+        parameters[annotator.target] = preloaded
 
-    send_data(client_sock, True)
+        # Set up logging over socket
+        log_handler.setup_logging(config_["log_server"],
+                                  log_level=config_["log_level"],
+                                  log_file_level=config_["log_file_level"],
+                                  file=source_file,
+                                  job=name)
 
-    # Run cleanup if available
-    if annotator.cleanup:
-        annotator.preloaded = annotator.cleanup(**{**annotator.params, **{annotator.target: annotator.preloaded}})
+        # Call annotator function
+        failed = True
+        try:
+            if config_.get("profile"):
+                job_profiler = profiler.JobProfiler(name, source_file, parameters,
+                                                    config_["profile"]["token_annotation"])
+                job_profiler.start()
+            with profiler.profile_annotator(name, source_file, config_.get("profile_annotator")):
+                annotator.function(**parameters)
+            if config_.get("profile"):
+                # Peak RSS is measured for the whole lifetime of the worker process
+                logging.getLogger("sparv").job_stats(job_profiler.stop())
+            failed = False
+        except SparvErrorMessage as e:
+            respond(e)
+            return True
+        except Exception as e:
+            console.print_exception()
+            respond(e)
+            return True
+        finally:
+            # Send any buffered log records and clear log handlers
+            logger = logging.getLogger("sparv")
+            for log_handler_ in logger.handlers:
+                log_handler_.close()
+            logger.handlers.clear()
+            if worker_metrics:
+                worker_metrics.request(name, start_time - sent if sent else None, time.time() - start_time, failed)
+
+        log.info("Done")
+
+        respond(True)
+
+        # Run cleanup if available
+        if annotator.cleanup:
+            cleanup_start = time.time()
+            preloaded = annotator.cleanup(**{**annotator.params, **{annotator.target: preloaded}})
+            if worker_metrics:
+                worker_metrics.cleanup(name, time.time() - cleanup_start)
+
+        return True
+    finally:
+        annotator.release(preloaded, version)
 
 
-def worker(worker_no: int, server_socket, annotators: Dict[str, Preloader], stop_event):
+def worker(worker_no: int, server_socket, annotators: Dict[str, Preloader], stop_event, reload_interval: float = 0,
+           shared_metrics: Optional[dict] = None):
     """Listen to the socket server and handle incoming requests."""
     log.info(f"Worker {worker_no} started")
+    worker_metrics = metrics.WorkerMetrics(worker_no, shared_metrics)
 
     # Load any non-shared preloaders
     for annotator in annotators.values():
         if not annotator.shared:
-            annotator.preloaded = annotator.preloader(**annotator.params)
+            annotator.load()
+
+    worker_metrics.publish()
+
+    # Reload models in the background when their files change. A reloaded shared model is no longer shared between
+    # the workers, since every worker reloads its own copy.
+    if reload_interval:
+        threading.Thread(target=watch_models, args=(annotators, reload_interval), daemon=True).start()
 
     while True:
         try:
@@ -210,19 +538,37 @@ def worker(worker_no: int, server_socket, annotators: Dict[str, Preloader], stop
             stop_event.set()
             return
 
+        # Handle requests until the client closes the connection
         try:
-            log.debug("Handling request")
-            result = handle(client_sock, annotators)
-            if result is False:
-                stop_event.set()
-                return
+            while True:
+                log.debug("Handling request")
+                result = handle(client_sock, annotators, worker_metrics)
+                worker_metrics.publish()
+                if result is False:
+                    client_sock.close()
+                    stop_event.set()
+                    return
+                elif result is None:
+                    break
         except:
             log.exception("Error during handling")
         client_sock.close()
 
 
-def serve(socket_path: str, processes: int, storage: SnakeStorage, stop_signal: multiprocessing.Event):
-    """Start the Sparv preloader socket server."""
+def serve(socket_path: str, processes: int, storage: SnakeStorage, stop_signal: multiprocessing.Event,
+          reload_interval: float = 0, metrics_file: Optional[str] = None, metrics_interval: float = 60):
+    """Start the Sparv preloader socket server.
+
+    Args:
+        socket_path: Path to the socket file.
+        processes: Number of worker processes.
+        storage: SnakeStorage object with all available rules.
+        stop_signal: Event used for stopping the preloader.
+        reload_interval: How often (in seconds) to check whether any model files have changed and need reloading.
+            Reloading is disabled by default (0).
+        metrics_file: Path to a file to periodically write metrics to, in the OpenMetrics text format.
+        metrics_interval: How often (in seconds) to write the metrics file.
+    """
     socket_file = Path(socket_path)
     if socket_file.exists():
         raise SparvErrorMessage(f"Socket {socket_path} already exists.")
@@ -231,6 +577,9 @@ def serve(socket_path: str, processes: int, storage: SnakeStorage, stop_signal:
     if not processes:
         processes = multiprocessing.cpu_count()
 
+    # Share the available cores between the worker processes
+    system.job_cpu_threads = max(multiprocessing.cpu_count() // processes, 1)
+
     # Dictionary of preloaded models, indexed by module and annotator name
     annotators = {}
 
@@ -263,7 +612,7 @@ def serve(socket_path: str, processes: int, storage: SnakeStorage, stop_signal:
             rule.annotator_info["preloader_shared"]
         )
         if annotator_obj.shared:
-            annotator_obj.preloaded = annotator_obj.preloader(**annotator_obj.params)
+            annotator_obj.load()
         annotators[annotator] = annotator_obj
 
     # Start the socket (AF_UNIX should be supported in Windows 10 since 2018)
@@ -273,10 +622,17 @@ def serve(socket_path: str, processes: int, storage: SnakeStorage, stop_signal:
 
     stop_event = multiprocessing.Event()
 
+    # Dictionary shared by the workers for collecting metrics
+    metrics_manager = SyncManager()
+    metrics_manager.start(signal.signal, (signal.SIGINT, signal.SIG_IGN))  # Let the manager outlive Ctrl-C
+    shared_metrics = metrics_manager.dict()
+
     workers = []
 
     for i in range(processes):
-        p = multiprocessing.Process(target=worker, args=(i + 1, server_socket, annotators, stop_event))
+        p = multiprocessing.Process(target=worker,
+                                    args=(i + 1, server_socket, annotators, stop_event, reload_interval,
+                                          shared_metrics))
         p.start()
         workers.append(p)
 
@@ -290,7 +646,11 @@ def serve(socket_path: str, processes: int, storage: SnakeStorage, stop_signal:
              f"preloader by sending an interrupt signal to the process with id {os.getpid()}.")
 
     # Periodically check whether stop_event is set or not and stop all processes when set
+    last_metrics_write = time.time()
     while True:
+        if metrics_file and time.time() - last_metrics_write >= metrics_interval:
+            write_metrics(dict(shared_metrics), Path(metrics_file))
+            last_metrics_write = time.time()
         if stop_event.is_set() or stop_signal.is_set():
             log.info("Stopping all workers...")
             for p in workers:
@@ -300,6 +660,13 @@ def serve(socket_path: str, processes: int, storage: SnakeStorage, stop_signal:
             break
         time.sleep(2)
 
+    if metrics_file:
+        # Write the final metrics once all workers have stopped
+        for p in workers:
+            p.join(5)
+        write_metrics(dict(shared_metrics), Path(metrics_file))
+    metrics_manager.shutdown()
+
     # Remove socket file
     if socket_file.exists():
         socket_file.unlink()
@@ -0,0 +1,172 @@
+"""Collect performance statistics for individual jobs."""
+import cProfile
+import logging
+import math
+import os
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from sparv.api.classes import BaseAnnotation
+from sparv.core import io
+
+
+class JobProfiler:
+    """Measure wall time, CPU time, peak memory usage, I/O and number of input tokens for a single job."""
+
+    def __init__(self, job: str, source_file: Optional[str] = None, parameters: Optional[dict] = None,
+                 token_annotation: Optional[str] = None):
+        """Initialize profiler.
+
+        Args:
+            job: Name of the job, e.g. 'saldo:annotate'.
+            source_file: Source file processed by the job, if any.
+            parameters: Parameters used to call the annotator function, used for finding the input token count.
+            token_annotation: Name of the token annotation (without attribute).
+        """
+        self.job = job
+        self.source_file = source_file
+        self.parameters = parameters or {}
+        self.token_annotation = token_annotation
+        self._start_wall = None
+        self._start_cpu = None
+        self._start_io = None
+
+    def start(self) -> None:
+        """Start measuring."""
+        self._start_io = get_io_counters()
+        self._start_cpu = time.process_time()
+        self._start_wall = time.perf_counter()
+
+    def stop(self) -> dict:
+        """Stop measuring and return the collected statistics."""
+        wall_time = time.perf_counter() - self._start_wall
+        cpu_time = time.process_time() - self._start_cpu
+        end_io = get_io_counters()
+        bytes_read, bytes_written = None, None
+        if self._start_io and end_io:
+            bytes_read = end_io[0] - self._start_io[0]
+            bytes_written = end_io[1] - self._start_io[1]
+
+        return {
+            "job": self.job,
+            "file": self.source_file,
+            "pid": os.getpid(),
+            "wall_time": wall_time,
+            "cpu_time": cpu_time,
+            "peak_rss": get_peak_rss(),
+            "bytes_read": bytes_read,
+            "bytes_written": bytes_written,
+            "tokens": self.count_tokens()
+        }
+
+    def count_tokens(self) -> Optional[int]:
+        """Return the number of tokens in the source file, if the job uses tokens as input."""
+        if not self.token_annotation or not self.source_file:
+            return None
+        for value in self.parameters.values():
+            if (isinstance(value, BaseAnnotation) and value.is_input and not value.all_files and not value.data and
+                    io.split_annotation(value.name)[0] == self.token_annotation):
+                try:
+                    return io.get_annotation_size(self.source_file, type(value)(self.token_annotation))
+                except OSError:
+                    return None
+        return None
+
+
+def get_peak_rss() -> Optional[int]:
+    """Return peak resident set size of the current process in bytes."""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def get_io_counters() -> Optional[tuple]:
+    """Return the number of bytes read and written by the current process so far.
+
+    On Linux, /proc/self/io is used, which also includes data served from the page cache. Elsewhere we fall back on
+    the number of block operations reported by getrusage.
+    """
+    try:
+        with open("/proc/self/io", encoding="utf-8") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        pass
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_inblock * 512, usage.ru_oublock * 512
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Return the p:th percentile of a list of values, using the nearest-rank method."""
+    values = sorted(values)
+    rank = max(math.ceil(p / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def summarize(job_stats: List[dict]) -> Dict[str, dict]:
+    """Aggregate statistics for several jobs, grouped by job name."""
+    grouped = defaultdict(list)
+    for stats in job_stats:
+        grouped[stats["job"]].append(stats)
+
+    summary = {}
+    for job, jobs in grouped.items():
+        wall_times = [j["wall_time"] for j in jobs]
+        total_time = sum(wall_times)
+        tokens = [j["tokens"] for j in jobs if j["tokens"] is not None]
+        peak_rss = [j["peak_rss"] for j in jobs if j["peak_rss"] is not None]
+        summary[job] = {
+            "jobs": len(jobs),
+            "total_time": total_time,
+            "mean_time": total_time / len(jobs),
+            "p95_time": percentile(wall_times, 95),
+            "cpu_time": sum(j["cpu_time"] for j in jobs),
+            "max_peak_rss": max(peak_rss) if peak_rss else None,
+            "bytes_read": sum(j["bytes_read"] or 0 for j in jobs),
+            "bytes_written": sum(j["bytes_written"] or 0 for j in jobs),
+            "tokens": sum(tokens) if tokens else None,
+            "tokens_per_second": sum(tokens) / total_time if tokens and total_time else None
+        }
+    return summary
+
+
+@contextmanager
+def profile_annotator(job: str, source_file: Optional[str], options: Optional[dict]) -> Iterator[None]:
+    """Run the code within the context under cProfile and save the result as a .pstats file.
+
+    Nothing is profiled unless options is set and source_file matches one of the file patterns (if any).
+
+    Args:
+        job: Name of the job, e.g. 'saldo:compound'.
+        source_file: Source file processed by the job, if any.
+        options: Dictionary with the output directory ('dir') and a list of source file patterns ('files').
+    """
+    if not options or (options["files"] and not any(fnmatch(source_file or "", p) for p in options["files"])):
+        yield
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        # Keep the subdirectory structure of the source files to avoid name clashes
+        profile_file = Path(options["dir"], job.replace(":", "."), (source_file or "__corpus__") + ".pstats")
+        profile_file.parent.mkdir(parents=True, exist_ok=True)
+        profile.dump_stats(profile_file)
+        logging.getLogger("sparv").info("Profile for %s saved to %s", job, profile_file)
@@ -7,7 +7,8 @@ import traceback
 
 from importlib_metadata import entry_points
 
-from sparv.core import io, log_handler, paths
+from sparv.api.util import system
+from sparv.core import io, log_handler, paths, profiler
 from sparv.core import registry
 from sparv.core.misc import SparvErrorMessage
 
@@ -54,6 +55,9 @@ class StreamToLogger:
 if snakemake.params.compression:
     io.compression = snakemake.params.compression
 
+# Set number of CPU threads available to the annotator
+system.job_cpu_threads = snakemake.params.cpu_threads
+
 # Import module
 modules_path = ".".join(("sparv", paths.modules_dir))
 module_name = snakemake.params.module_name
@@ -64,23 +68,20 @@ preloader_busy = False
 if use_preloader:
     from sparv.core import preload
     import socket
-    sock = None
+    client = None
     try:
         if snakemake.params.force_preloader:
-            sock = preload.connect_to_socket(snakemake.params.socket)
+            client = preload.PreloaderClient(snakemake.params.socket)
         else:
             # Try to connect to the preloader and fall back to running without it if it's unavailable
-            sock = preload.connect_to_socket(snakemake.params.socket, timeout=True)
-            sock.settimeout(0.5)
+            client = preload.PreloaderClient(snakemake.params.socket, timeout=True)
             # Ping preloader to verify that it's free
-            preload.send_data(sock, preload.PING)
-            response = preload.receive_data(sock)  # Timeouts if busy
-            sock.settimeout(None)
+            client.ping(timeout=0.5)  # Timeouts if busy
     except (BlockingIOError, socket.timeout):
         use_preloader = False
         preloader_busy = True
-        if sock is not None:
-            sock.close()
+        if client is not None:
+            client.close()
 
 if not use_preloader:
     # Import custom module
@@ -108,6 +109,8 @@ if not use_preloader:
 # Get function name and parameters
 f_name = snakemake.params.f_name
 parameters = snakemake.params.parameters
+profile = snakemake.params.profile
+profile_annotator = snakemake.params.profile_annotator
 
 log_handler.setup_logging(snakemake.config["log_server"],
                           log_level=snakemake.config["log_level"],
@@ -130,7 +133,14 @@ if not use_preloader:
         logger.info("Preloader busy; executing without preloader")
     # Execute function
     try:
-        registry.modules[module_name].functions[f_name]["function"](**parameters)
+        if profile:
+            job_profiler = profiler.JobProfiler(f"{module_name}:{f_name}", snakemake.params.source_file, parameters,
+                                                profile["token_annotation"])
+            job_profiler.start()
+        with profiler.profile_annotator(f"{module_name}:{f_name}", snakemake.params.source_file, profile_annotator):
+            registry.modules[module_name].functions[f_name]["function"](**parameters)
+        if profile:
+            logger.job_stats(job_profiler.stop())
         if snakemake.params.export_dirs:
             logger.export_dirs(snakemake.params.export_dirs)
     except KeyboardInterrupt as e:
@@ -156,8 +166,11 @@ if not use_preloader:
         sys.stderr = old_stderr
 else:
     try:
-        preload.send_data(sock, (f"{module_name}:{f_name}", parameters, snakemake.config, snakemake.params.source_file))
-        response = preload.receive_data(sock)
+        # Every Snakemake job runs a single annotator for a single source file, so there is only one request to send,
+        # even though the client can pipeline several requests over the connection
+        response, = client.run([(f"{module_name}:{f_name}", parameters,
+                                 {**snakemake.config, "profile": profile, "profile_annotator": profile_annotator},
+                                 snakemake.params.source_file)])
         if isinstance(response, SparvErrorMessage):
             exit_with_error_message(response.message, "sparv.modules." + module_name)
         elif isinstance(response, BaseException):
@@ -166,6 +179,6 @@ else:
             exit_with_error_message("An error occurred while using the Sparv preloader.",
                                     f"sparv.modules.{module_name}")
     finally:
-        sock.close()
+        client.close()
         sys.stdout = old_stdout
         sys.stderr = old_stderr
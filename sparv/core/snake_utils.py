@@ -553,8 +553,8 @@ def rule_helper(rule: RuleStorage, config: dict, storage: SnakeStorage, config_m
 
     # Check if preloader can be used for this rule
     if storage.preloader_info and rule.target_name in storage.preloader_info:
-        rule.use_preloader = storage.preloader_info[rule.target_name] == {k: rule.parameters[k] for k in
-                                                                          storage.preloader_info[rule.target_name]}
+        preloader_params = storage.preloader_info[rule.target_name]["params"]
+        rule.use_preloader = preloader_params == {k: rule.parameters[k] for k in preloader_params}
 
     if config.get("debug"):
         print()
@@ -214,6 +214,12 @@ def _formatter(in_from: Annotation, in_to: Optional[Annotation], out_from: Outpu
     informat = informat.split("|")
     outformat = outformat.split("|")
 
+    # Compile the regular expressions once instead of for every value
+    if pre_regex:
+        pre_regex = re.compile(pre_regex)
+    if regex:
+        regex = re.compile(regex)
+
     assert len(outformat) == 1 or (len(outformat) == len(informat)), "The number of out-formats must be equal to one " \
                                                                      "or the number of in-formats."
 
@@ -227,7 +233,7 @@ def _formatter(in_from: Annotation, in_to: Optional[Annotation], out_from: Outpu
             continue
 
         if pre_regex:
-            matches = re.match(pre_regex, val)
+            matches = pre_regex.match(val)
             if not matches:
                 raise SparvErrorMessage(f"dateformat.pre_regex did not match the value {val!r}")
             val = [v for v in matches.groups() if v][0]
@@ -250,7 +256,7 @@ def _formatter(in_from: Annotation, in_to: Optional[Annotation], out_from: Outpu
             if regex:
                 temp = []
                 for v in vals:
-                    matches = re.search(regex, v)
+                    matches = regex.search(v)
                     if matches:
                         temp.append([x for x in matches.groups() if x][0])
                 if not temp:
@@ -301,7 +307,7 @@ def _formatter(in_from: Annotation, in_to: Optional[Annotation], out_from: Outpu
                 continue
 
             if pre_regex:
-                matches = re.match(pre_regex, val)
+                matches = pre_regex.match(val)
                 val = [v for v in matches.groups() if v][0]
                 if not val:
                     # If the regex doesn't match, treat as no date
@@ -322,7 +328,7 @@ def _formatter(in_from: Annotation, in_to: Optional[Annotation], out_from: Outpu
                 if regex:
                     temp = []
                     for v in vals:
-                        matches = re.search(regex, v)
+                        matches = regex.search(v)
                         if matches:
                             temp.append([x for x in matches.groups() if x][0])
                     if not temp:
@@ -7,6 +7,8 @@ import sparv.modules.saldo.saldo as saldo
 from sparv.api import Annotation, Config, Model, Output, annotator, get_logger, util
 from sparv.api.util.tagsets import tagmappings
 
+from .models import SpellingVariants
+
 logger = get_logger(__name__)
 
 
@@ -190,8 +192,13 @@ def posset(pos: Annotation = Annotation("<token:pos>"),
     _annotate_standard(out, pos, makeset, delimiter=delimiter, affix=affix, split=False)
 
 
+def spelling_preloader(spellingmodel):
+    """Preload spelling variants model."""
+    return SpellingVariants(spellingmodel.path)
+
+
 @annotator("Get spelling variants from spelling model for Old Swedish", language=["swe-fsv"],
-           preloader=saldo.preloader, preloader_params=["model"], preloader_target="model_preloaded")
+           preloader=spelling_preloader, preloader_params=["spellingmodel"], preloader_target="spelling_preloaded")
 def spelling_variants(word: Annotation = Annotation("<token:word>"),
                       out: Output = Output("<token>:hist.spelling_variants", description="token spelling variants"),
                       spellingmodel: Model = Model("[hist.fsv_spelling]"),
@@ -199,17 +206,18 @@ def spelling_variants(word: Annotation = Annotation("<token:word>"),
                       delimiter: str = Config("hist.delimiter"),
                       affix: str = Config("hist.affix"),
                       # model_preloaded: Optional[dict] = None
-                      ):
+                      spelling_preloaded: Optional[SpellingVariants] = None):
     """Use a lexicon model and a spelling model to annotate words with their spelling variants.
 
     Args:
         word: Input annotation with token strings.
         out: Output annotation with spelling variations.
-        spellingmodel: The spelling model.
+        spellingmodel: The spelling model, either a compiled index or a text file.
         model: The lexicon model.
         delimiter: Character to put between ambiguous results.
         affix: Character to put before and after sets of results.
         model_preloaded: Preloaded morphology model.
+        spelling_preloaded: Preloaded spelling model.
     """
     # # Load model
     # model_name = model.path.stem
@@ -220,27 +228,10 @@ def spelling_variants(word: Annotation = Annotation("<token:word>"),
     #     assert model_preloaded.get(model_name, None) is not None, "Lexicon %s not found!" % model_name
     #     lexicon = (model_name, model_preloaded[model_name])
 
-    def parsevariant(modelfile):
-        # spellingmodel -> {word : [(variant, dist)]}
-        d = {}
-
-        def addword(res, word, info):
-            for part in info.strip().split("^^"):
-                if part:
-                    xs = part.split(",")
-                    res.setdefault(word, []).append((xs[0], float(xs[1])))
-
-        with open(modelfile, encoding="utf8") as f:
-            for line in f:
-                wd, info = line.split(":::")
-                addword(d, wd, info)
-        return d
-
-    variations = parsevariant(spellingmodel.path)
+    variations = spelling_preloaded or SpellingVariants(spellingmodel.path)
 
     def findvariants(_, theword):
-        variants = [x_d for x_d in variations.get(theword.lower(), []) if x_d[0] != theword]
-        return sorted(list(set([v for v, d in variants])))
+        return [v for v in variations.lookup(theword.lower()) if v != theword]
         # variants_lists = [_get_single_annotation([lexicon], v, "lem", "") for v, _d in variants]
         # return set([y for x in variants_lists for y in x])
 
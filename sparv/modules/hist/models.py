@@ -1,7 +1,12 @@
 """Model builders for older Swedish lexicons."""
 
+import functools
+import mmap
+import pathlib
 import re
+import struct
 import xml.etree.ElementTree as etree
+from typing import Dict, List, Tuple
 
 from sparv.api import Model, ModelOutput, get_logger, modelbuilder, util
 from sparv.api.util.tagsets import tagmappings
@@ -9,6 +14,9 @@ from sparv.modules.saldo.saldo_model import HashableDict, SaldoLexicon
 
 logger = get_logger(__name__)
 
+# Identifies a compiled spelling variants index
+VARIANT_INDEX_MAGIC = b"SPRVVAR1"
+
 
 @modelbuilder("Dalin morphology model", language=["swe-1800"])
 def build_dalin(out: ModelOutput = ModelOutput("hist/dalin.pickle")):
@@ -57,6 +65,107 @@ def build_fsv_spelling(out: ModelOutput = ModelOutput("hist/fsv-spelling-variant
     out.download("https://github.com/spraakbanken/sparv-models/raw/master/hist/fsv-spelling-variants.txt")
 
 
+@modelbuilder("Spelling variants index for Old Swedish", language=["swe-fsv"])
+def build_fsv_spelling_index(out: ModelOutput = ModelOutput("hist/fsv-spelling-variants.index"),
+                             variants: Model = Model("hist/fsv-spelling-variants.txt")):
+    """Compile the spelling variants list for Old Swedish into an index that can be memory mapped."""
+    write_variant_index(read_spelling_variants(variants.path), out.path)
+
+
+################################################################################
+# SPELLING VARIANTS
+################################################################################
+
+
+class SpellingVariants:
+    """Spelling variants of words.
+
+    The variants are read from a compiled index (see write_variant_index()) which is memory mapped instead of being read
+    into memory, or from a text file in the original format.
+    """
+
+    def __init__(self, path: pathlib.Path, verbose: bool = True):
+        """Open index or read text file."""
+        if verbose:
+            logger.info("Reading spelling variants: %s", path)
+        with open(path, "rb") as f:
+            is_index = f.read(len(VARIANT_INDEX_MAGIC)) == VARIANT_INDEX_MAGIC
+            if is_index:
+                self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if is_index:
+            self.variants = None
+            self.count = struct.unpack_from("<Q", self.mmap, len(VARIANT_INDEX_MAGIC))[0]
+            self.offsets_start = len(VARIANT_INDEX_MAGIC) + 8
+            self.data_start = self.offsets_start + 8 * (self.count + 1)
+        else:
+            self.mmap = None
+            self.variants = {word: tuple(variants) for word, variants in read_spelling_variants(path).items()}
+            self.count = len(self.variants)
+        self.lookup = functools.lru_cache(maxsize=100000)(self._lookup)
+        if verbose:
+            logger.info("OK, read %d words", self.count)
+
+    def _lookup(self, word: str) -> Tuple[str, ...]:
+        """Return the sorted spelling variants of word."""
+        if self.variants is not None:
+            return self.variants.get(word, ())
+        # Binary search in the sorted index
+        key = word.encode(util.constants.UTF8)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start, end = struct.unpack_from("<QQ", self.mmap, self.offsets_start + 8 * mid)
+            start += self.data_start
+            end += self.data_start
+            sep = self.mmap.find(b"\0", start, end)
+            entry_key = self.mmap[start:sep]
+            if entry_key < key:
+                lo = mid + 1
+            elif entry_key > key:
+                hi = mid
+            else:
+                return tuple(self.mmap[sep + 1:end].decode(util.constants.UTF8).split("\0"))
+        return ()
+
+
+def read_spelling_variants(path: pathlib.Path) -> Dict[str, List[str]]:
+    """Read a text file with spelling variants, with lines in the format 'word:::variant1,dist1^^variant2,dist2'.
+
+    Returns:
+        A dictionary with words as keys and sorted lists of unique variants as values.
+    """
+    variants = {}
+    with open(path, encoding="utf8") as f:
+        for line in f:
+            word, info = line.split(":::")
+            for part in info.strip().split("^^"):
+                if part:
+                    variants.setdefault(word, set()).add(part.split(",")[0])
+    return {word: sorted(word_variants) for word, word_variants in variants.items()}
+
+
+def write_variant_index(variants: Dict[str, List[str]], path: pathlib.Path) -> None:
+    """Write spelling variants to a compiled index file.
+
+    The file consists of a header, a table of offsets to each entry, and the entries themselves, sorted by word. Every
+    entry is the word followed by its variants, separated by null bytes.
+    """
+    entries = []
+    for word in sorted(variants, key=lambda w: w.encode(util.constants.UTF8)):
+        if variants[word]:
+            entries.append("\0".join([word] + list(variants[word])).encode(util.constants.UTF8))
+    offsets = [0]
+    for entry in entries:
+        offsets.append(offsets[-1] + len(entry))
+    with open(path, "wb") as f:
+        f.write(VARIANT_INDEX_MAGIC)
+        f.write(struct.pack("<Q", len(entries)))
+        f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        for entry in entries:
+            f.write(entry)
+    logger.info("Wrote spelling variants index with %d words", len(entries))
+
+
 ################################################################################
 # LMF CONVERSION
 ################################################################################
@@ -1,7 +1,7 @@
 """Part of Speech annotation using Hunpos."""
 
 import re
-from typing import Optional
+from typing import Callable, Dict, Optional, Tuple
 
 from sparv.api import (
     Annotation, Binary, Config, Model, ModelOutput, Output, SparvErrorMessage, annotator, get_logger,
@@ -16,8 +16,36 @@ TOK_SEP = "\n"
 TAG_SEP = "\t"
 TAG_COLUMN = 1
 
+# Functions for replacing words matching Hunpos patterns, indexed by patterns file path and modification time
+_pattern_replacers: Dict[Tuple[str, int], Callable[[str], str]] = {}
 
-@annotator("Part-of-speech annotation with morphological descriptions", language=["swe"])
+# Sentence sent after every document to a running Hunpos process, to find the end of the output
+SENTINEL = "__SPARV_END_OF_INPUT__"
+
+
+def preloader(binary, model, morphtable):
+    """Preload Hunpos tagger process."""
+    return {"process": hunpos_start(binary, model, morphtable)}
+
+
+def hunpos_start(binary, model, morphtable=None):
+    """Start a Hunpos tagger process for tagging several documents and return it."""
+    process = util.system.call_binary(binary, get_args(model, morphtable), return_command=True)
+    util.system.log_stderr(process, lambda line: logger.debug("Message from Hunpos: %s", line))
+    return process
+
+
+def get_args(model: Model, morphtable: Optional[Model] = None):
+    """Return command line arguments for Hunpos."""
+    args = [model.path]
+    if morphtable:
+        args.extend(["-m", morphtable.path])
+    return args
+
+
+@annotator("Part-of-speech annotation with morphological descriptions", language=["swe"], preloader=preloader,
+           preloader_params=["binary", "model", "morphtable"], preloader_target="process_dict",
+           preloader_shared=False)
 def msdtag(out: Output = Output("<token>:hunpos.msd", cls="token:msd",
                                 description="Part-of-speeches with morphological descriptions"),
            word: Annotation = Annotation("<token:word>"),
@@ -27,13 +55,19 @@ def msdtag(out: Output = Output("<token>:hunpos.msd", cls="token:msd",
            morphtable: Optional[Model] = Model("[hunpos.morphtable]"),
            patterns: Optional[Model] = Model("[hunpos.patterns]"),
            tag_mapping: Optional[str] = Config("hunpos.tag_mapping"),
-           encoding: str = Config("hunpos.encoding")):
-    """POS/MSD tag modern Swedish texts using the Hunpos tagger."""
+           encoding: str = Config("hunpos.encoding"),
+           process_dict=None):
+    """POS/MSD tag modern Swedish texts using the Hunpos tagger.
+
+    The process_dict argument should never be set from the command line.
+    """
     main(out, word, sentence, binary, model, morphtable=morphtable, patterns=patterns, tag_mapping=tag_mapping,
-         encoding=encoding)
+         encoding=encoding, process_dict=process_dict)
 
 
-@annotator("Part-of-speech annotation with morphological descriptions for older Swedish", language=["swe-1800"])
+@annotator("Part-of-speech annotation with morphological descriptions for older Swedish", language=["swe-1800"],
+           preloader=preloader, preloader_params=["binary", "model", "morphtable"], preloader_target="process_dict",
+           preloader_shared=False)
 def msdtag_hist(out: Output = Output("<token>:hunpos.msd_hist", cls="token:msd",
                                      description="Part-of-speeches with morphological descriptions"),
                 word: Annotation = Annotation("<token:word>"),
@@ -42,47 +76,49 @@ def msdtag_hist(out: Output = Output("<token>:hunpos.msd_hist", cls="token:msd",
                 model: Model = Model("[hunpos.model_hist]"),
                 morphtable: Optional[Model] = Model("[hunpos.morphtable_hist]"),
                 tag_mapping: Optional[str] = Config("hunpos.tag_mapping_hist"),
-                encoding: str = Config("hunpos.encoding")):
-    """POS/MSD tag modern Swedish texts using the Hunpos tagger."""
+                encoding: str = Config("hunpos.encoding"),
+                process_dict=None):
+    """POS/MSD tag older Swedish texts using the Hunpos tagger.
+
+    The process_dict argument should never be set from the command line.
+    """
     main(out, word, sentence, binary, model, morphtable=morphtable, patterns=None, tag_mapping=tag_mapping,
-         encoding=encoding)
+         encoding=encoding, process_dict=process_dict)
 
 
 def main(out, word, sentence, binary, model, morphtable=None, patterns=None, tag_mapping=None,
-         encoding=util.constants.UTF8):
-    """POS/MSD tag using the Hunpos tagger."""
+         encoding=util.constants.UTF8, process_dict=None):
+    """POS/MSD tag using the Hunpos tagger.
+
+    If process_dict is set, the Hunpos process in it is used, and kept running for the next call.
+    """
     if isinstance(tag_mapping, str) and tag_mapping:
         tag_mapping = tagmappings.mappings[tag_mapping]
     elif tag_mapping is None or tag_mapping == "":
         tag_mapping = {}
 
-    pattern_list = []
-
-    if patterns:
-        with open(patterns.path, encoding="utf-8") as pat:
-            for line in pat:
-                if line.strip() and not line.startswith("#"):
-                    name, pattern, tags = line.strip().split("\t", 2)
-                    pattern_list.append((name, re.compile("^%s$" % pattern), tags))
-
-    def replace_word(w):
-        """Replace word with alias if word matches a regex pattern."""
-        for p in pattern_list:
-            if re.match(p[1], w):
-                return "[[%s]]" % p[0]
-        return w
+    replace_word = get_pattern_replacer(patterns) if patterns else lambda w: w
+    # Words are often repeated, so remember the result for every word
+    replaced_words = {}
 
     sentences, _orphans = sentence.get_children(word)
+    # Hunpos doesn't output anything for empty sentences, so these are left out
+    sentences = [sent for sent in sentences if sent]
     token_word = list(word.read())
-    stdin = SENT_SEP.join(TOK_SEP.join(replace_word(token_word[token_index]) for token_index in sent)
-                          for sent in sentences)
-    args = [model.path]
-    if morphtable:
-        args.extend(["-m", morphtable.path])
-    stdout, _ = util.system.call_binary(binary, args, stdin, encoding=encoding)
+    for w in token_word:
+        if w not in replaced_words:
+            replaced_words[w] = replace_word(w)
+    stdin = "".join(TOK_SEP.join(replaced_words[token_word[token_index]] for token_index in sent) + SENT_SEP
+                    for sent in sentences)
+
+    if process_dict is None:
+        stdout, _ = util.system.call_binary(binary, get_args(model, morphtable), stdin, encoding=encoding)
+    else:
+        stdout = run_preloaded(process_dict, stdin, binary, model, morphtable, encoding)
+    tagged_sentences = stdout.strip().split(SENT_SEP)
 
     out_annotation = word.create_empty_attribute()
-    for sent, tagged_sent in zip(sentences, stdout.strip().split(SENT_SEP)):
+    for sent, tagged_sent in zip(sentences, tagged_sentences):
         for token_index, tagged_token in zip(sent, tagged_sent.strip().split(TOK_SEP)):
             tag = tagged_token.strip().split(TAG_SEP)[TAG_COLUMN]
             tag = tag_mapping.get(tag, tag)
@@ -91,6 +127,85 @@ def main(out, word, sentence, binary, model, morphtable=None, patterns=None, tag
     out.write(out_annotation)
 
 
+def run_preloaded(process_dict: dict, stdin: str, binary, model: Model, morphtable: Optional[Model],
+                  encoding: str) -> str:
+    """Tag a document using the running Hunpos process in process_dict and return the output.
+
+    Hunpos flushes its output after every tagged sentence, so the output for the sentinel sentence sent after the
+    document is available as soon as it has been tagged, and no dummy input is needed to push it out.
+    """
+    process = process_dict["process"]
+    # If process seems dead, spawn a new
+    if process.stdin.closed or process.stdout.closed or process.poll() is not None:
+        util.system.kill_process(process)
+        process = hunpos_start(binary, model, morphtable)
+        process_dict["process"] = process
+
+    # The sentinel is tagged as a sentence of its own, followed by an empty line
+    sentinel = SENTINEL.encode(encoding)
+    try:
+        stdout = util.system.communicate_until(process, stdin.encode(encoding), sentinel + SENT_SEP.encode(encoding),
+                                               lambda line: line.split(TAG_SEP.encode(encoding))[0] == sentinel,
+                                               trailing_lines=1)
+    except OSError:
+        raise SparvErrorMessage("Hunpos stopped unexpectedly.")
+    return b"".join(stdout).decode(encoding)
+
+
+def get_pattern_replacer(patterns: Model) -> Callable[[str], str]:
+    """Return a function replacing a word with the name of the first pattern it matches, as '[[name]]'.
+
+    The patterns are compiled into a single regular expression, which is cached for as long as the file is unchanged.
+    """
+    key = (str(patterns.path), patterns.path.stat().st_mtime_ns)
+    if key not in _pattern_replacers:
+        pattern_list = []
+        with open(patterns.path, encoding="utf-8") as pat:
+            for line in pat:
+                if line.strip() and not line.startswith("#"):
+                    name, pattern, _tags = line.strip().split("\t", 2)
+                    pattern_list.append((name, pattern))
+        _pattern_replacers.clear()
+        _pattern_replacers[key] = compile_patterns(pattern_list)
+    return _pattern_replacers[key]
+
+
+def compile_patterns(pattern_list) -> Callable[[str], str]:
+    """Compile a list of (name, pattern) tuples into a function replacing words matching a pattern with its name.
+
+    All patterns are combined into one regular expression with one named group per pattern. Since alternatives are
+    tried in order, the first matching pattern wins, just like when trying the patterns one by one.
+    """
+    if not pattern_list:
+        return lambda w: w
+
+    combined = None
+    # Patterns referring to their own groups can't be combined, since the group numbers would change
+    if not any(re.search(r"\\\d|\(\?P", pattern) for _, pattern in pattern_list):
+        try:
+            combined = re.compile("|".join("(?P<p%d>^%s$)" % (i, pattern)
+                                           for i, (_, pattern) in enumerate(pattern_list)))
+        except re.error:
+            pass
+
+    if combined is None:
+        compiled = [(name, re.compile("^%s$" % pattern)) for name, pattern in pattern_list]
+
+        def replace_word(w):
+            for name, regex in compiled:
+                if regex.match(w):
+                    return "[[%s]]" % name
+            return w
+        return replace_word
+
+    names = [name for name, _ in pattern_list]
+
+    def replace_word(w):
+        m = combined.match(w)
+        return "[[%s]]" % names[int(m.lastgroup[1:])] if m else w
+    return replace_word
+
+
 @annotator("Extract POS from MSD", language=["swe", "swe-1800"])
 def postag(out: Output = Output("<token>:hunpos.pos", cls="token:pos", description="Part-of-speech tags"),
            msd: Annotation = Annotation("<token:msd>")):
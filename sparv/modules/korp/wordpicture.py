@@ -127,6 +127,8 @@ def wordpicture(
     ]
 
     triples = []
+    # Compiled regular expressions used when matching relations, indexed by pattern
+    compiled_patterns = {}
 
     for sentid, sent in zip(sentence_ids, sentence_tokens):
         incomplete = {}  # Tokens looking for heads, with head as key
@@ -173,7 +175,9 @@ def wordpicture(
         assert not incomplete, "incomplete is not empty"
 
         def _match(pattern, value):
-            return bool(re.match(r"^%s$" % pattern, value))
+            if pattern not in compiled_patterns:
+                compiled_patterns[pattern] = re.compile(r"^%s$" % pattern)
+            return bool(compiled_patterns[pattern].match(value))
 
         def _findrel(head, rel, dep):
             result = []
@@ -1,17 +1,19 @@
 """Dependency parsing using MaltParser."""
 
+import math
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 
-from sparv.api import Annotation, Binary, Config, Model, ModelOutput, Output, annotator, get_logger, modelbuilder, util
+from sparv.api import (Annotation, Binary, Config, Model, ModelOutput, Output, SparvErrorMessage, annotator,
+                       get_logger, modelbuilder, util)
 
 logger = get_logger(__name__)
 
-
-# Running Malt processes are only kept if the input is small: otherwise
-# flush() on stdin blocks, and readline() on stdout is too slow to be
-# practical on long texts. We cannot use read() because it reads to EOF.
-# The value of this constant is a bit arbitrary, and could probably be longer.
-RESTART_THRESHOLD_LENGTH = 64000
+# Max number of sentences sent to a Malt process before reading back the parsed sentences. Writing is done in a
+# separate thread, so this only limits how much unparsed input is buffered.
+MAX_IN_FLIGHT = 500
 
 SENT_SEP = "\n\n"
 TOK_SEP = "\n"
@@ -21,31 +23,19 @@ DEPREL_COLUMN = 7
 UNDEF = "_"
 
 
-def preloader(maltjar, model, encoding):
-    """Preload MaltParser executable."""
-    process = maltstart(maltjar, model, encoding, send_empty_sentence=True)
-    process_dict = {
-        "process": process,
-        "restart": False
-    }
-    return process_dict
-
-
-def cleanup(maltjar, model, encoding, process_dict):
-    """Cleanup function used by preloader to restart Malt."""
-    if process_dict["restart"]:
-        util.system.kill_process(process_dict["process"])
-        logger.info("Restarting MaltParser process")
-        process_dict = preloader(maltjar, model, encoding)
-    return process_dict
+def preloader(maltjar, model, encoding, processes):
+    """Preload MaltParser executables."""
+    return [maltstart(maltjar, model, encoding, send_empty_sentence=True) for _ in range(processes)]
 
 
 @annotator("Dependency parsing using MaltParser", language=["swe"], config=[
     Config("malt.jar", default="maltparser-1.7.2/maltparser-1.7.2.jar",
            description="Path name of the executable .jar file"),
-    Config("malt.model", default="malt/swemalt-1.7.2.mco", description="Path to Malt model")],
-    preloader=preloader, preloader_params=["maltjar", "model", "encoding"], preloader_target="process_dict",
-    preloader_cleanup=cleanup, preloader_shared=False)
+    Config("malt.model", default="malt/swemalt-1.7.2.mco", description="Path to Malt model"),
+    Config("malt.processes", default=1, description="Number of MaltParser processes to use in parallel for every "
+           "source file", datatype=int, min=1)],
+    preloader=preloader, preloader_params=["maltjar", "model", "encoding", "processes"],
+    preloader_target="process_pool", preloader_shared=False)
 def annotate(maltjar: Binary = Binary("[malt.jar]"),
              model: Model = Model("[malt.model]"),
              out_dephead: Output = Output("<token>:malt.dephead", cls="token:dephead",
@@ -61,22 +51,15 @@ def annotate(maltjar: Binary = Binary("[malt.jar]"),
              sentence: Annotation = Annotation("<sentence>"),
              token: Annotation = Annotation("<token>"),
              encoding: str = util.constants.UTF8,
-             process_dict=None):
+             processes: int = Config("malt.processes"),
+             process_pool=None):
     """
-    Run the malt parser, in an already started process defined in process_dict, or start a new process (default).
+    Run the malt parser, in already started processes in process_pool, or start new processes (default).
 
-    The process_dict argument should never be set from the command line.
-    """
-    if process_dict is None:
-        process = maltstart(maltjar, model, encoding)
-    else:
-        process = process_dict["process"]
-        # If process seems dead, spawn a new
-        if process.stdin.closed or process.stdout.closed or process.poll():
-            util.system.kill_process(process)
-            process = maltstart(maltjar, model, encoding, send_empty_sentence=True)
-            process_dict["process"] = process
+    The sentences are streamed through the processes, split evenly between them when there are more than one.
 
+    The process_pool argument should never be set from the command line.
+    """
     sentences, orphans = sentence.get_children(token)
     if orphans:
         logger.warning(f"Found {len(orphans)} tokens not belonging to any sentence. These will not be annotated with "
@@ -94,42 +77,44 @@ def annotate(maltjar: Binary = Binary("[malt.jar]"),
         feats = re.sub(r"[ ,.]", "|", msd_annotation[token_index]).replace("+", "/")
         return TAG_SEP.join((str(nr), form, lemma, cpos, pos, feats))
 
-    stdin = SENT_SEP.join(TOK_SEP.join(conll_token(n + 1, token_index) for n, token_index in enumerate(sent))
-                          for sent in sentences)
-
-    if encoding:
-        stdin = stdin.encode(encoding)
-
-    keep_process = len(stdin) < RESTART_THRESHOLD_LENGTH and process_dict is not None
-    logger.info("Stdin length: %s, keep process: %s", len(stdin), keep_process)
-
-    if process_dict is not None:
-        process_dict["restart"] = not keep_process
+    # Malt doesn't output anything for empty sentences, so these are left out
+    sentences = [sent for sent in sentences if sent]
 
-    if keep_process:
-        # Chatting with malt: send a SENT_SEP and read correct number of lines
-        stdin_fd, stdout_fd = process.stdin, process.stdout
-        stdin_fd.write(stdin + SENT_SEP.encode(util.constants.UTF8))
-        stdin_fd.flush()
-
-        malt_sentences = []
-        for sent in sentences:
-            malt_sent = []
-            for _ in sent:
-                line = stdout_fd.readline()
-                if encoding:
-                    line = line.decode(encoding)
-                malt_sent.append(line)
-            line = stdout_fd.readline()
-            assert line == b"\n"
-            malt_sentences.append(malt_sent)
+    keep_processes = process_pool is not None
+    if process_pool is None:
+        process_pool = [maltstart(maltjar, model, encoding) for _ in range(max(min(processes, len(sentences)), 1))]
     else:
-        # Otherwise use communicate which buffers properly
-        stdout, _ = process.communicate(stdin)
-        if encoding:
-            stdout = stdout.decode(encoding)
-        malt_sentences = (malt_sent.split(TOK_SEP)
-                          for malt_sent in stdout.split(SENT_SEP))
+        # If any process seems dead, spawn a new
+        for i, process in enumerate(process_pool):
+            if process.stdin.closed or process.stdout.closed or process.poll() is not None:
+                util.system.kill_process(process)
+                process_pool[i] = maltstart(maltjar, model, encoding, send_empty_sentence=True)
+
+    encoding = encoding or util.constants.UTF8
+    stdin = [(TOK_SEP.join(conll_token(n + 1, token_index) for n, token_index in enumerate(sent)) + SENT_SEP
+              ).encode(encoding) for sent in sentences]
+
+    # Split the sentences into one contiguous chunk per process
+    chunk_size = max(math.ceil(len(sentences) / len(process_pool)), 1)
+    chunks = [(process, stdin[i:i + chunk_size], [len(sent) for sent in sentences[i:i + chunk_size]])
+              for process, i in zip(process_pool, range(0, len(sentences), chunk_size))]
+    logger.info("Parsing %d sentences using %d MaltParser process(es)", len(sentences), len(chunks))
+
+    try:
+        if len(chunks) > 1:
+            with ThreadPoolExecutor(len(chunks)) as executor:
+                results = list(executor.map(lambda chunk: malt_parse(*chunk, encoding), chunks))
+        else:
+            results = [malt_parse(*chunk, encoding) for chunk in chunks]
+    finally:
+        if not keep_processes:
+            for process in process_pool:
+                try:
+                    process.stdin.close()
+                except OSError:
+                    pass
+                process.wait()
+    malt_sentences = [malt_sent for result in results for malt_sent in result]
 
     out_dephead_annotation = word.create_empty_attribute()
     out_dephead_ref_annotation = out_dephead_annotation.copy()
@@ -157,6 +142,48 @@ def make_ref(out: Output = Output("<token>:malt.ref", cls="token:ref",
     number.number_relative(out, sentence, token)
 
 
+def malt_parse(process, stdin: List[bytes], sentence_lengths: List[int], encoding: str) -> List[List[str]]:
+    """Stream sentences through a running Malt process and return the parsed sentences as lists of CoNLL lines.
+
+    The sentences are written to the process in a separate thread while the output is being read, so that neither
+    pipe can fill up and block, no matter the size of the input. At most MAX_IN_FLIGHT sentences are written before
+    waiting for the corresponding output.
+    """
+    in_flight = threading.Semaphore(MAX_IN_FLIGHT)
+
+    def write():
+        try:
+            for sent in stdin:
+                if not in_flight.acquire(blocking=False):
+                    # Make sure Malt gets everything written so far before waiting for output
+                    process.stdin.flush()
+                    in_flight.acquire()
+                process.stdin.write(sent)
+            process.stdin.flush()
+        except OSError:
+            # The process has died, which is detected when reading
+            pass
+
+    writer = threading.Thread(target=write, daemon=True)
+    writer.start()
+
+    malt_sentences = []
+    for length in sentence_lengths:
+        malt_sent = [process.stdout.readline().decode(encoding).rstrip("\n") for _ in range(length)]
+        # Every sentence is followed by an empty line
+        if process.stdout.readline() != b"\n" or not all(malt_sent):
+            util.system.kill_process(process)
+            # Unblock the writer thread so that it can exit
+            for _ in range(MAX_IN_FLIGHT):
+                in_flight.release()
+            raise SparvErrorMessage("MaltParser returned unexpected output or stopped unexpectedly.")
+        in_flight.release()
+        malt_sentences.append(malt_sent)
+
+    writer.join()
+    return malt_sentences
+
+
 def maltstart(maltjar, model, encoding, send_empty_sentence=False):
     """Start a malt process and return it."""
     java_opts = ["-Xmx1024m"]
@@ -175,6 +202,7 @@ def maltstart(maltjar, model, encoding, send_empty_sentence=False):
         logger.info("Using local Malt model: %s (in directory %s)", model_file, model_dir or ".")
 
     process = util.system.call_java(maltjar, malt_args, options=java_opts, encoding=encoding, return_command=True)
+    util.system.log_stderr(process, lambda line: logger.debug("Message from MaltParser: %s", line))
 
     if send_empty_sentence:
         # Send a simple sentence to malt, this greatly enhances performance
@@ -1,15 +1,19 @@
 """Compound analysis."""
 
+import hashlib
 import itertools
 import pathlib
 import pickle
 import re
+import sqlite3
 import time
 import xml.etree.ElementTree as etree
 from functools import reduce
+from typing import Optional
 
 from sparv.api import Annotation, Config, Model, ModelOutput, Output, annotator, get_logger, modelbuilder, util
 from sparv.api.util.tagsets import tagmappings
+from sparv.core import paths
 
 logger = get_logger(__name__)
 
@@ -25,6 +29,10 @@ PART_DELIM1 = "^1"
 PART_DELIM2 = "^2"
 PART_DELIM3 = "^3"
 
+# Version of the compound analysis, used to invalidate the persistent cache when the analysis changes
+CACHE_VERSION = 2
+CACHE_FILENAME = "saldo.compound.cache"
+
 
 def preloader(saldo_comp_model, stats_model):
     """Preload models."""
@@ -56,6 +64,27 @@ def preloader(saldo_comp_model, stats_model):
             description="Also use source text as lexicon for compound analysis",
             datatype=bool,
         ),
+        Config(
+            "saldo.comp_cache",
+            default=False,
+            description="Cache compound analyses on disk, so that every word form only needs to be analysed once, "
+            "across source files",
+            datatype=bool,
+        ),
+        Config(
+            "saldo.comp_cache_dir",
+            description="Directory for the compound analysis cache. Defaults to the corpus work directory. Set this to "
+            "share the cache between corpora. The directory must be writable and on a local file system.",
+            datatype=str,
+        ),
+        Config(
+            "saldo.comp_cache_size",
+            default=1000000,
+            description="Maximum number of analyses to keep in the compound analysis cache. The least recently used "
+            "analyses are removed when the cache is full.",
+            datatype=int,
+            min=1,
+        ),
     ],
     preloader=preloader,
     preloader_params=["saldo_comp_model", "stats_model"],
@@ -73,6 +102,9 @@ def annotate(out_complemgrams: Output = Output("<token>:saldo.complemgram",
              nst_model: Model = Model("[saldo.comp_nst_model]"),
              stats_model: Model = Model("[saldo.comp_stats_model]"),
              comp_use_source: bool = Config("saldo.comp_use_source"),
+             comp_cache: bool = Config("saldo.comp_cache"),
+             comp_cache_dir: Optional[str] = Config("saldo.comp_cache_dir"),
+             comp_cache_size: int = Config("saldo.comp_cache_size"),
              complemgramfmt: str = util.constants.SCORESEP + "%.3e",
              delimiter: str = util.constants.DELIM,
              compdelim: str = util.constants.COMPSEP,
@@ -90,6 +122,9 @@ def annotate(out_complemgrams: Output = Output("<token>:saldo.complemgram",
     - saldo_comp_model is the Saldo compound model
     - nst_model is the NST part of speech compound model
     - stats_model is the statistics model (pickled file)
+    - comp_cache: whether to use a persistent cache of compound analyses, shared between source files
+    - comp_cache_dir: directory for the persistent cache (defaults to the work directory)
+    - comp_cache_size: maximum number of analyses in the persistent cache
     - complemgramfmt is a format string for how to print the complemgram and its probability
       (use empty string to omit probablility)
     - preloaded_models: Preloaded models if using preloader
@@ -104,6 +139,7 @@ def annotate(out_complemgrams: Output = Output("<token>:saldo.complemgram",
         saldo_comp_lexicon = SaldoCompLexicon(saldo_comp_model.path)
         stats_lexicon = StatsLexicon(stats_model.path)
 
+    model_files = [saldo_comp_model.path, nst_model.path, stats_model.path]
     with open(nst_model.path, "rb") as f:
         nst_model = pickle.load(f)
 
@@ -122,6 +158,23 @@ def annotate(out_complemgrams: Output = Output("<token>:saldo.complemgram",
 
     previous_compounds = {}
 
+    # Get previous analyses from the persistent cache
+    compound_cache = None
+    cache_keys = {}
+    new_compounds = {}
+    if comp_cache:
+        cache_dir = pathlib.Path(comp_cache_dir).expanduser() if comp_cache_dir else paths.work_dir
+        compound_cache = CompoundCache(cache_dir / CACHE_FILENAME, model_files, comp_cache_size, extra=(cutoff,))
+        if not compound_cache.db:
+            compound_cache = None
+    if compound_cache:
+        for word, msd, _ in word_msd_baseform_annotations:
+            if (word, msd) not in cache_keys:
+                cache_keys[(word, msd)] = compound_cache.key(word, msd, altlexicon)
+        cached = compound_cache.get(cache_keys.values())
+        previous_compounds = {key: cached[cache_key] for key, cache_key in cache_keys.items() if cache_key in cached}
+        logger.debug("Found %d of %d word forms in compound cache", len(previous_compounds), len(cache_keys))
+
     for word, msd, baseform_orig in word_msd_baseform_annotations:
         key = (word, msd)
         if key in previous_compounds:
@@ -144,6 +197,8 @@ def annotate(out_complemgrams: Output = Output("<token>:saldo.complemgram",
                     compounds = compounds[:i]
 
             previous_compounds[key] = compounds
+            if compound_cache:
+                new_compounds[cache_keys[key]] = compounds
 
         # Create complem and compwf annotations
         make_complem_and_compwf(complem_annotation, compwf_annotation, complemgramfmt, compounds, compdelim, delimiter,
@@ -157,6 +212,10 @@ def annotate(out_complemgrams: Output = Output("<token>:saldo.complemgram",
 
         logger.progress()
 
+    if compound_cache:
+        compound_cache.update(new_compounds, set(cache_keys.values()).difference(new_compounds))
+        compound_cache.close()
+
     out_complemgrams.write(complem_annotation)
     logger.progress()
     out_compwf.write(compwf_annotation)
@@ -279,6 +338,21 @@ class InFileLexicon:
         """Get all possible prefixes."""
         return [(prefix, "0", (s[1],)) for s in self.lookup(prefix.lower())]
 
+    def get_substring_entries(self, word):
+        """Get the entries for all substrings of word, i.e. everything that may be used in a compound analysis of word.
+
+        Substrings with their last letter doubled are included because of the three consonant rule.
+        """
+        if not self.lexicon:
+            return ()
+        entries = set()
+        for i in range(len(word)):
+            for j in range(i + 1, len(word) + 1):
+                for part in (word[i:j].lower(), (word[i:j] + word[j - 1]).lower()):
+                    if part in self.lexicon:
+                        entries.update(self.lexicon[part])
+        return tuple(sorted(entries))
+
     def get_suffixes(self, suffix, msd=None):
         """Get all possible suffixes."""
         return [(suffix, "0", (s[1],)) for s in self.lookup(suffix.lower())
@@ -287,144 +361,166 @@ class InFileLexicon:
                 ]
 
 
+class CompoundCache:
+    """A persistent cache of compound analyses, shared between source files and corpora.
+
+    The analyses are stored in an SQLite database (read through memory mapping), keyed by the versions of the models
+    together with the word, its MSD, and the words from the in-file lexicon that may be used in its analysis. Reads are
+    done in batches, and new analyses are written in a single transaction per source file. The number of analyses is
+    kept in a separate table, and if the cache gets too large, the least recently used analyses are removed. Any errors
+    accessing the database just disable the cache.
+    """
+
+    def __init__(self, path: pathlib.Path, model_files: list, max_size: int, extra: tuple = ()):
+        """Open the cache.
+
+        Args:
+            path: Path to the database file.
+            model_files: Paths to the models used in the analysis. Any change to these files invalidates the cache.
+            max_size: Maximum number of analyses to keep.
+            extra: Other settings affecting the analysis.
+        """
+        self.path = path
+        self.max_size = max_size
+        version = [CACHE_VERSION, extra]
+        for model_file in model_files:
+            stat = pathlib.Path(model_file).stat()
+            version.append((str(model_file), stat.st_mtime_ns, stat.st_size))
+        self.version = pickle.dumps(version)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(path), timeout=60)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA mmap_size=268435456")
+            self.db.execute("CREATE TABLE IF NOT EXISTS compounds (key BLOB PRIMARY KEY, value BLOB, "
+                            "last_used INTEGER)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS last_used ON compounds (last_used)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS size (count INTEGER)")
+            with self.db:
+                if self.db.execute("SELECT count FROM size").fetchone() is None:
+                    self.db.execute("INSERT INTO size SELECT COUNT(*) FROM compounds")
+        except (OSError, sqlite3.Error) as e:
+            self._disable(e)
+
+    def _disable(self, error):
+        logger.warning("Compound analysis cache %s could not be used: %s", self.path, error)
+        self.close()
+        self.db = None
+
+    def key(self, word, msd, altlexicon):
+        """Return the cache key for a word and MSD, given the in-file lexicon."""
+        return hashlib.sha1(pickle.dumps((self.version, word, msd, altlexicon.get_substring_entries(word)))).digest()
+
+    def get(self, keys):
+        """Return a dictionary with the cached analyses for the given keys."""
+        result = {}
+        if not self.db:
+            return result
+        keys = list(keys)
+        try:
+            # Stay below SQLite's default limit of 999 variables per statement
+            for i in range(0, len(keys), 900):
+                chunk = keys[i:i + 900]
+                rows = self.db.execute(f"SELECT key, value FROM compounds WHERE key IN ({','.join('?' * len(chunk))})",
+                                       chunk)
+                for key, value in rows:
+                    result[key] = pickle.loads(value)
+        except sqlite3.Error as e:
+            self._disable(e)
+            return {}
+        return result
+
+    def update(self, new, used=()):
+        """Add new analyses to the cache, mark used analyses as recently used, and remove old analyses if needed."""
+        if not self.db:
+            return
+        now = time.time_ns()
+        try:
+            with self.db:
+                # Analyses added by another process in the meantime are identical, so they are just kept
+                added = self.db.executemany("INSERT OR IGNORE INTO compounds (key, value, last_used) VALUES (?, ?, ?)",
+                                            ((key, pickle.dumps(value, protocol=-1), now)
+                                             for key, value in new.items())).rowcount
+                self.db.executemany("UPDATE compounds SET last_used = ? WHERE key = ?", ((now, key) for key in used))
+                self.db.execute("UPDATE size SET count = count + ?", (added,))
+                size = self.db.execute("SELECT count FROM size").fetchone()[0]
+                if size > self.max_size:
+                    # Remove an extra tenth, to not have to do this for every source file
+                    remove = size - self.max_size + self.max_size // 10
+                    removed = self.db.execute("DELETE FROM compounds WHERE key IN "
+                                              "(SELECT key FROM compounds ORDER BY last_used LIMIT ?)",
+                                              (remove,)).rowcount
+                    self.db.execute("UPDATE size SET count = count - ?", (removed,))
+        except sqlite3.Error as e:
+            self._disable(e)
+
+    def close(self):
+        """Close the database connection."""
+        if getattr(self, "db", None):
+            self.db.close()
+
+
 ################################################################################
 # Auxiliaries
 ################################################################################
 
 
 def split_word(saldo_lexicon, altlexicon, w, msd):
-    """Split word w into every possible combination of substrings."""
-    MAX_ITERATIONS = 250000
-    MAX_TIME = 20  # Seconds
-    invalid_spans = set()
-    valid_spans = set()
-    # Create list of possible splitpoint indices for w
-    nsplits = list(range(1, len(w)))
-    counter = 0
-    giveup = False
-    iterations = 0
-    start_time = time.time()
-
-    for n in nsplits:
-        first = True
-        nn = len(nsplits)
-        indices = list(range(n))
-
-        # Similar to itertools.combinations, but customized for our needs
-        while True:
-            iterations += 1
-            if iterations > MAX_ITERATIONS:
-                giveup = True
-                logger.info("Too many iterations for word '%s'", w)
-                break
-            if time.time() - start_time > MAX_TIME:
-                giveup = True
-                logger.info("Compound analysis took to long for word '%s'", w)
-                break
+    """Split word w into every possible combination of valid prefix, infixes and suffix.
 
-            if first:
-                first = False
+    Every substring of w is looked up at most once for each role, with an extra consonant added where the three
+    consonant rule applies, and the valid combinations are found by dynamic programming over the positions in w.
+    If there are SPLIT_LIMIT or more combinations, no combinations are returned.
+    """
+    length = len(w)
+
+    def spellings(i, j):
+        """Return the possible spellings of the part w[i:j], when followed by another part.
+
+        The part is also expanded with its last letter if that letter equals the first letter of the following part
+        (three consonant rule), e.g. "glas" in "glasskål" --> "glas", "glass".
+        """
+        if w[j - 1].lower() in "bdfgjlmnprstv" and w[j - 1] == w[j]:
+            return w[i:j], w[i:j] + w[j - 1]
+        return (w[i:j],)
+
+    # For every position i, the parts starting at i that can be followed by a valid analysis of the rest of the word,
+    # and the number of such analyses
+    parts = [[] for _ in range(length)]  # [(end, spelling)]
+    count = [0] * (length + 1)
+    for i in range(length - 1, 0, -1):
+        suffix = w[i:]
+        if not exception(suffix) and (saldo_lexicon.get_suffixes(suffix, msd) or altlexicon.get_suffixes(suffix, msd)):
+            parts[i].append((length, suffix))
+            count[i] += 1
+        for j in range(i + 1, length):
+            if count[j]:
+                for infix in spellings(i, j):
+                    if not exception(infix) and (saldo_lexicon.get_infixes(infix) or altlexicon.get_prefixes(infix)):
+                        parts[i].append((j, infix))
+                        count[i] += count[j]
+    for j in range(1, length):
+        if count[j]:
+            for prefix in spellings(0, j):
+                if saldo_lexicon.get_prefixes(prefix) or altlexicon.get_prefixes(prefix):
+                    parts[0].append((j, prefix))
+                    count[0] += count[j]
+
+    if count[0] >= SPLIT_LIMIT:
+        logger.info("Too many possible compounds for word '%s'" % w)
+        return []
+
+    def combinations(i):
+        """Yield (split points, parts) for every valid analysis of w[i:]."""
+        for j, part in parts[i]:
+            if j == length:
+                yield (), [part]
             else:
-                for i in reversed(list(range(n))):
-                    if indices[i] != i + nn - n:
-                        break
-                else:
-                    break
-                indices[i] += 1
-                for j in range(i + 1, n):
-                    indices[j] = indices[j - 1] + 1
-
-            splitpoint = tuple(i + 1 for i in indices)
-
-            # Create list of affix spans
-            spans = list(zip((0,) + splitpoint, splitpoint + (None,)))
-
-            # Abort if current compound contains an affix known to be invalid
-            abort = False
-            for ii, s in enumerate(spans):
-                if s in invalid_spans:
-                    if not s[1] is None:
-                        # Skip any combination of spans following the invalid span
-                        for j in range(ii + 1, n):
-                            indices[j] = j + nn - n
-                    abort = True
-                    break
-            if abort:
-                continue
+                for splitpoints, rest in combinations(j):
+                    yield (j,) + splitpoints, [part] + rest
 
-            # Expand spans with additional consonants where possible
-            comps = three_consonant_rule([w[i:j] for i, j in spans])
-            for comp_i, comp in enumerate(comps):
-                multicomp = len(comps) > 1
-                # Check if prefix is valid
-                this_span = (spans[0], comp_i) if multicomp else spans[0]
-                if this_span not in valid_spans:
-                    if this_span in invalid_spans:
-                        continue
-                    else:
-                        if not (saldo_lexicon.get_prefixes(comp[0]) or altlexicon.get_prefixes(comp[0])):
-                            invalid_spans.add(this_span)
-                            if multicomp:
-                                if all((spans[0], i) in invalid_spans for i in range(len(comps))):
-                                    invalid_spans.add(spans[0])
-                            continue
-                        else:
-                            valid_spans.add(this_span)
-
-                # Check if suffix is valid
-                this_span = (spans[-1], comp_i) if multicomp else spans[-1]
-                if this_span not in valid_spans:
-                    if this_span in invalid_spans:
-                        continue
-                    else:
-                        # Is there a possible suffix analysis?
-                        if exception(comp[-1]) or not (saldo_lexicon.get_suffixes(comp[-1], msd)
-                                                       or altlexicon.get_suffixes(comp[-1], msd)):
-                            invalid_spans.add(this_span)
-                            if multicomp:
-                                if all((spans[-1], i) in invalid_spans for i in range(len(comps))):
-                                    invalid_spans.add(spans[-1])
-                            continue
-                        else:
-                            valid_spans.add(this_span)
-
-                # Check if other spans are valid
-                abort = False
-                for k, infix in enumerate(comp[1:-1], start=1):
-                    this_span = (spans[k], comp_i) if multicomp else spans[k]
-                    if this_span not in valid_spans:
-                        if this_span in invalid_spans:
-                            abort = True
-                            break
-                        else:
-                            if exception(infix) or not (saldo_lexicon.get_infixes(infix)
-                                                        or altlexicon.get_prefixes(infix)):
-                                invalid_spans.add(this_span)
-                                if multicomp:
-                                    if all((spans[k], i) in invalid_spans for i in range(len(comps))):
-                                        invalid_spans.add(spans[k])
-                                abort = True
-                                # Skip any combination of spans following the invalid span
-                                for j in range(k + 1, n):
-                                    indices[j] = j + nn - n
-                                break
-                            else:
-                                valid_spans.add(this_span)
-
-                if abort:
-                    continue
-
-                counter += 1
-                if counter > SPLIT_LIMIT:
-                    giveup = True
-                    logger.info("Too many possible compounds for word '%s'" % w)
-                    break
-                yield comp
-
-            if giveup:
-                break
-        if giveup:
-            break
+    # Order by number of parts, then by split points
+    return [comp for _, comp in sorted(combinations(0), key=lambda c: (len(c[1]), c[0], c[1]))]
 
 
 def exception(w):
@@ -438,25 +534,6 @@ def exception(w):
         "y", "z", "ä"]
 
 
-def three_consonant_rule(compound):
-    """Expand each stem if its last letter equals the first letter of the following stem.
-
-    ("glas", "skål") --> ("glas", "skål"), ("glass", "skål")
-    """
-    combinations = []
-    suffix = compound[-1]
-    for index in range(len(compound) - 1):
-        current_prefix = compound[index]
-        current_suffix = compound[index + 1]
-        # Last prefix letter == first suffix letter; and prefix ends in one of "bdfgjlmnprstv"
-        if current_prefix[-1].lower() in "bdfgjlmnprstv" and current_prefix[-1] == current_suffix[0]:
-            combinations.append((current_prefix, current_prefix + current_prefix[-1]))
-        else:
-            combinations.append((current_prefix, current_prefix))
-    combinations.append((suffix, suffix))
-    return [list(i) for i in sorted(set(itertools.product(*combinations)))]
-
-
 def rank_compounds(compounds, nst_model, stats_lexicon):
     """Return a list of compounds, ordered according to their ranks.
 
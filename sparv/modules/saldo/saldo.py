@@ -1,7 +1,9 @@
 """Create annotations from SALDO."""
 
 import itertools
+import multiprocessing
 import re
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Optional
 
 from sparv.api import Annotation, Config, Model, Output, annotator, get_logger, util
@@ -13,6 +15,12 @@ logger = get_logger(__name__)
 # The minimum precision difference for two annotations to be considered equal
 PRECISION_DIFF = 0.01
 
+# Minimum number of sentences in a source file for it to be annotated using several processes
+PARALLEL_MIN_SENTENCES = 1000
+
+# Data for the worker processes when annotating in parallel, inherited when the processes are forked
+_worker_args = {}
+
 
 def preloader(models):
     """Preload SALDO models."""
@@ -82,6 +90,14 @@ def preloader(models):
             description="Character used to split the values of 'word' into several word variations",
             datatype=str,
         ),
+        Config(
+            "saldo.processes",
+            default=1,
+            description="Number of processes to use for annotating large source files, each annotating a part of the "
+            "sentences. Set to 0 to use the number of cores available to the job.",
+            datatype=int,
+            min=0,
+        ),
     ],
     preloader=preloader,
     preloader_params=["models"],
@@ -106,6 +122,7 @@ def annotate(token: Annotation = Annotation("<token>"),
              max_gaps: int = Config("saldo.max_mwe_gaps"),
              allow_multiword_overlap: bool = Config("saldo.allow_multiword_overlap"),
              word_separator: Optional[str] = Config("saldo.word_separator"),
+             processes: int = Config("saldo.processes"),
              models_preloaded: Optional[dict] = None):
     """Use the Saldo lexicon model to annotate msd-tagged words.
 
@@ -131,18 +148,20 @@ def annotate(token: Annotation = Annotation("<token>"),
         allow_multiword_overlap: Whether all multiword expressions may overlap with each other. If set to False,
             some cleanup is done.
         word_separator: Character used to split the values of 'word' into several word variations.
+        processes: Number of processes to use for large source files, or 0 to use the number of cores available to
+            the job.
         models_preloaded: Preloaded models.
     """
     main(token=token, word=word, sentence=sentence, reference=reference, out_sense=out_sense, out_lemgram=out_lemgram,
          out_baseform=out_baseform, models=models, msd=msd, delimiter=delimiter, affix=affix, precision=precision,
          precision_filter=precision_filter, min_precision=min_precision, skip_multiword=skip_multiword,
          max_gaps=max_gaps, allow_multiword_overlap=allow_multiword_overlap, word_separator=word_separator,
-         models_preloaded=models_preloaded)
+         models_preloaded=models_preloaded, processes=processes)
 
 
 def main(token, word, sentence, reference, out_sense, out_lemgram, out_baseform, models, msd, delimiter, affix,
          precision, precision_filter, min_precision, skip_multiword, max_gaps, allow_multiword_overlap, word_separator,
-         models_preloaded):
+         models_preloaded, processes=1):
     """Do SALDO annotations with models."""
     # Allow use of multiple lexicons
     logger.progress()
@@ -190,15 +209,67 @@ def main(token, word, sentence, reference, out_sense, out_lemgram, out_baseform,
     out_annotation = word.create_empty_attribute()
     logger.progress(total=len(sentences) + 1)
 
+    args = (lexicon_list, word_annotation, ref_annotation, msd_annotation, bool(msd), delimiter, affix, precision,
+            precision_filter, min_precision, skip_multiword, max_gaps, allow_multiword_overlap, word_separator,
+            skip_pos_check)
+
+    if processes == 0:
+        processes = util.system.cpu_threads()
+    if len(sentences) < PARALLEL_MIN_SENTENCES:
+        processes = 1
+    if processes > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        logger.warning("Annotating using several processes is not supported on this platform")
+        processes = 1
+
+    if processes > 1:
+        # Split the sentences into chunks, annotated in forked processes sharing the lexicons. Multi-word expressions
+        # never span more than one sentence, so this gives the same result as annotating all sentences at once.
+        logger.info("Annotating %d sentences using %d processes", len(sentences), processes)
+        chunk_size = -(-len(sentences) // (processes * 4))
+        chunks = [sentences[i:i + chunk_size] for i in range(0, len(sentences), chunk_size)]
+        _worker_args["args"] = args
+        try:
+            with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("fork")) as executor:
+                for chunk, result in zip(chunks, executor.map(_annotate_chunk, chunks)):
+                    for token_index, value in result:
+                        out_annotation[token_index] = value
+                    logger.progress(advance=len(chunk))
+        finally:
+            _worker_args.clear()
+    else:
+        for token_index, value in _annotate_sentences(sentences, *args, progress=True):
+            out_annotation[token_index] = value
+
+    for out_annotation_obj, annotation_name in annotations:
+        out_annotation_obj.write([v.get(annotation_name, delimiter) if v is not None else None for v in out_annotation])
+    logger.progress()
+
+
+################################################################################
+# Auxiliaries
+################################################################################
+
+def _annotate_sentences(sentences, lexicon_list, word_annotation, ref_annotation, msd_annotation, has_msd, delimiter,
+                        affix, precision, precision_filter, min_precision, skip_multiword, max_gaps,
+                        allow_multiword_overlap, word_separator, skip_pos_check, progress=False):
+    """Annotate the tokens in a list of sentences.
+
+    Returns:
+        A list of (token index, annotations) for every token in the sentences.
+    """
+    result = []
+    # Tries of multi-word expressions starting with a word, cached by word variants
+    multiword_tries = {}
+
     for sent in sentences:
-        incomplete_multis = []  # [{annotation, words, [ref], is_particle, lastwordWasGap, numberofgaps}]
+        incomplete_multis = []  # [(edges, [ref], last_word_was_gap, gap_count, kind, start)]
         complete_multis = []    # ([ref], annotation)
         sentence_tokens = {}
 
-        for token_index in sent:
+        for position, token_index in enumerate(sent):
             theword = word_annotation[token_index]
             ref = ref_annotation[token_index]
-            msdtag = msd_annotation[token_index] if msd else ""
+            msdtag = msd_annotation[token_index] if has_msd else ""
 
             annotation_info = {}
             sentence_tokens[ref] = {"token_index": token_index, "annotations": annotation_info}
@@ -215,11 +286,17 @@ def main(token, word, sentence, reference, out_sense, out_lemgram, out_baseform,
 
             # Find multi-word expressions
             if not skip_multiword:
-                _find_multiword_expressions(incomplete_multis, complete_multis, thewords, ref, msdtag, max_gaps,
-                                            ann_tags_words, msd_annotation, sent, skip_pos_check)
+                key = tuple(thewords)
+                tries = multiword_tries.get(key)
+                if tries is None:
+                    tries = multiword_tries[key] = _build_multiword_tries(ann_tags_words)
+                incomplete_multis = _find_multiword_expressions(incomplete_multis, complete_multis, thewords, ref,
+                                                                msdtag, max_gaps, tries, position, msd_annotation,
+                                                                sent, skip_pos_check)
 
             # Loop to next token
-        logger.progress()
+        if progress:
+            logger.progress()
 
         if not allow_multiword_overlap:
             # Check that we don't have any unwanted overlaps
@@ -229,18 +306,17 @@ def main(token, word, sentence, reference, out_sense, out_lemgram, out_baseform,
         _save_multiwords(complete_multis, sentence_tokens)
 
         for tok in list(sentence_tokens.values()):
-            out_annotation[tok["token_index"]] = _join_annotation(tok["annotations"], delimiter, affix)
+            result.append((tok["token_index"], _join_annotation(tok["annotations"], delimiter, affix)))
 
         # Loop to next sentence
 
-    for out_annotation_obj, annotation_name in annotations:
-        out_annotation_obj.write([v.get(annotation_name, delimiter) if v is not None else None for v in out_annotation])
-    logger.progress()
+    return result
 
 
-################################################################################
-# Auxiliaries
-################################################################################
+def _annotate_chunk(sentences):
+    """Annotate a chunk of sentences in a worker process."""
+    return _annotate_sentences(sentences, *_worker_args["args"])
+
 
 def _find_single_word(thewords, lexicon_list, msdtag, precision, min_precision, precision_filter, annotation_info):
     ann_tags_words = []
@@ -301,81 +377,148 @@ def _find_single_word(thewords, lexicon_list, msdtag, precision, min_precision,
     return ann_tags_words
 
 
-def _find_multiword_expressions(incomplete_multis, complete_multis, thewords, ref, msdtag, max_gaps, ann_tags_words,
-                                msd_annotation, sent, skip_pos_check):
-    todelfromincomplete = []  # list to keep track of which expressions that have been completed
-
-    for i, x in enumerate(incomplete_multis):
-        # x = (annotations, following_words, [ref], gap_allowed, is_particle, [part-of-gap-boolean, gap_count])
-        seeking_word = x[1][0]  # The next word we are looking for in this multi-word expression
-
-        # Is a gap necessary in this position for this expression?
-        if seeking_word == "*":
-            if x[1][1].lower() in (w.lower() for w in thewords):
-                seeking_word = x[1][1]
-                del x[1][0]
-
-        # If current gap is greater than max_gaps, stop searching
-        if x[5][1] > max_gaps:
-            todelfromincomplete.append(i)
-        #                                                         |  Last word may not be PP if this is a particle-multi-word                      |
-        elif seeking_word.lower() in (w.lower() for w in thewords) and (skip_pos_check or not (len(x[1]) == 1 and x[4] and msdtag.startswith("PP"))):
-            x[5][0] = False     # last word was not a gap
-            del x[1][0]
-            x[2].append(ref)
-
-            # Is current word the last word we are looking for?
-            if len(x[1]) == 0:
-                todelfromincomplete.append(i)
-
-                # Create a list of msdtags of words belonging to the completed multi-word expr.
-                msdtag_list = [msd_annotation[sent[int(ref) - 1]] for ref in x[2]]
-
-                # For completed verb multis, check that at least one of the words is a verb:
-                if not skip_pos_check and "..vbm." in x[0]["lem"][0]:
-                    for tag in msdtag_list:
-                        if tag.startswith("VB"):
-                            complete_multis.append((x[2], x[0]))
-                            break
-
-                # For completed noun multis, check that at least one of the words is a noun:
-                elif not skip_pos_check and "..nnm." in x[0]["lem"][0]:
-                    for tag in msdtag_list:
-                        if tag[:2] in ("NN", "PM", "UO"):
-                            complete_multis.append((x[2], x[0]))
-                            break
+class _TrieNode:
+    """A node in a trie of the words following the first word of multi-word expressions."""
 
-                else:
-                    complete_multis.append((x[2], x[0]))
+    __slots__ = ("children", "entries")
+
+    def __init__(self, children=None, entries=None):
+        self.children = children if children is not None else {}  # {lowercased word: _TrieNode}
+        self.entries = entries if entries is not None else []     # [(index, annotation)] ending at this node
 
-        else:
-            # We've reached a gap
-            # Are gaps allowed?
-            if x[3]:
-                # If previous word was NOT part of a gap, this is a new gap, so increment gap counter
-                if not x[5][0]:
-                    x[5][1] += 1
-                x[5][0] = True  # Mark that this word was part of a gap
-
-                # Avoid having another verb within a verb multi-word expression:
-                # delete current incomplete multi-word expr. if it starts with a verb and if current word has POS tag VB
-                if "..vbm." in x[0]["lem"][0] and msdtag.startswith("VB"):
-                    todelfromincomplete.append(i)
 
+def _build_multiword_tries(ann_tags_words):
+    """Build tries of the multi-word expressions that may start with the current token.
+
+    Expressions are grouped by kind, (gap_allowed, is_particle, is_verb_multiword), since everything in a trie
+    must be treated the same way when a gap is encountered. Expressions are numbered in lexicon order, so that completed
+    expressions can be reported in the same order as if they were matched one by one.
+    """
+    tries = {}
+    index = 0
+    for annotation, _, wordslist, gap_allowed, is_particle, _ in ann_tags_words:
+        for words in wordslist:
+            kind = (gap_allowed, is_particle, "..vbm." in annotation["lem"][0])
+            node = tries.setdefault(kind, _TrieNode())
+            for w in words:
+                node = node.children.setdefault(w.lower(), _TrieNode())
+            node.entries.append((index, annotation))
+            index += 1
+    return tries
+
+
+def _find_multiword_expressions(incomplete_multis, complete_multis, thewords, ref, msdtag, max_gaps, tries, position,
+                                msd_annotation, sent, skip_pos_check):
+    """Advance the incomplete multi-word expressions with the current token, and start new ones.
+
+    Every incomplete expression is a position in a trie, together with the refs of the tokens matched so far and the
+    current gap state. Only the trie edges matching the current token are visited, so the matching is linear in the
+    number of tokens. A "*" edge marks a position where a gap is expected.
+
+    Returns:
+        The new list of incomplete multi-word expressions.
+    """
+    words = {w.lower() for w in thewords}
+    # Last word may not be PP if this is a particle-multi-word
+    pp_blocked = not skip_pos_check and msdtag.startswith("PP")
+    is_verb = msdtag.startswith("VB")
+    completed = []  # [((start, index), [ref], annotation)]
+    still_incomplete = []
+
+    for edges, refs, last_word_was_gap, gap_count, kind, start in incomplete_multis:
+        gap_allowed, is_particle, is_verb_multi = kind
+        block_last = is_particle and pp_blocked
+        matched = []         # Nodes reached by matching the current token
+        gap_edges = edges    # Edges still waiting for their next word
+
+        for w in words:
+            child = edges.get(w)
+            if child is None or w == "*":
+                continue
+            if gap_edges is edges:
+                gap_edges = dict(edges)
+            del gap_edges[w]
+            if block_last and child.entries:
+                gap_edges[w] = _TrieNode(entries=child.entries)
+                if child.children:
+                    matched.append(_TrieNode(child.children))
             else:
-                # Gaps are not allowed for this multi-word expression
-                todelfromincomplete.append(i)
+                matched.append(child)
+
+        star = edges.get("*")
+        if star is not None:
+            # Is a gap necessary in this position? Then look for the word after the gap.
+            star_left = star.children
+            for w in words:
+                child = star.children.get(w)
+                if child is None:
+                    continue
+                if star_left is star.children:
+                    star_left = {k: v for k, v in star.children.items() if k not in words}
+                if block_last and child.entries:
+                    if gap_edges is edges:
+                        gap_edges = dict(edges)
+                    blocked = gap_edges.get(w)
+                    gap_edges[w] = _TrieNode(entries=(blocked.entries if blocked else []) + child.entries)
+                    if child.children:
+                        matched.append(_TrieNode(child.children))
+                else:
+                    matched.append(child)
+            if "*" in words and star_left:
+                matched.append(_TrieNode(star_left))
+                star_left = {}
+            if star_left is not star.children:
+                if gap_edges is edges:
+                    gap_edges = dict(edges)
+                if star_left:
+                    gap_edges["*"] = _TrieNode(star_left)
+                else:
+                    del gap_edges["*"]
+
+        if matched:
+            new_refs = refs + [ref]
+            for node in matched:
+                for index, annotation in node.entries:
+                    completed.append(((start, index), new_refs, annotation))
+                if node.children:
+                    still_incomplete.append((node.children, new_refs, False, gap_count, kind, start))
+
+        # We've reached a gap. Are gaps allowed?
+        if gap_edges and gap_allowed:
+            # If previous word was NOT part of a gap, this is a new gap, so increment gap counter
+            if not last_word_was_gap:
+                gap_count += 1
+            # If current gap is greater than max_gaps, stop searching.
+            # Avoid having another verb within a verb multi-word expression.
+            if gap_count <= max_gaps and not (is_verb_multi and is_verb):
+                still_incomplete.append((gap_edges, refs, True, gap_count, kind, start))
+
+    # Report completed expressions in the order they were started
+    completed.sort(key=lambda c: c[0])
+    for _, refs, annotation in completed:
+        # Create a list of msdtags of words belonging to the completed multi-word expr.
+        msdtag_list = [msd_annotation[sent[int(ref) - 1]] for ref in refs]
+
+        # For completed verb multis, check that at least one of the words is a verb:
+        if not skip_pos_check and "..vbm." in annotation["lem"][0]:
+            if any(tag.startswith("VB") for tag in msdtag_list):
+                complete_multis.append((refs, annotation))
+
+        # For completed noun multis, check that at least one of the words is a noun:
+        elif not skip_pos_check and "..nnm." in annotation["lem"][0]:
+            if any(tag[:2] in ("NN", "PM", "UO") for tag in msdtag_list):
+                complete_multis.append((refs, annotation))
 
-    # Delete seeking words from incomplete_multis
-    for x in todelfromincomplete[::-1]:
-        del incomplete_multis[x]
+        else:
+            complete_multis.append((refs, annotation))
 
     # Collect possible multiword expressions:
     # Is this word a possible beginning of a multi-word expression?
-    looking_for = [(annotation, words, [ref], gap_allowed, is_particle, [False, 0])
-                   for (annotation, _, wordslist, gap_allowed, is_particle, _) in ann_tags_words if wordslist for words in wordslist]
-    if len(looking_for) > 0:
-        incomplete_multis.extend(looking_for)
+    if max_gaps >= 0:
+        for kind, root in tries.items():
+            still_incomplete.append((root.children, [ref], False, 0, kind, position))
+
+    return still_incomplete
 
 
 def _remove_unwanted_overlaps(complete_multis):
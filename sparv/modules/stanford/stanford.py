@@ -6,18 +6,74 @@ Please download, unzip and place contents inside sparv-pipeline/bin/stanford_par
 License for Stanford CoreNLP: GPL2 https://www.gnu.org/licenses/old-licenses/gpl-2.0.html
 """
 
+import atexit
+import http.client
+import json
+import socket
+import subprocess
 import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import List, Optional
 
-from sparv.api import Annotation, BinaryDir, Config, Language, Output, Text, annotator, get_logger, util
+from sparv.api import (Annotation, BinaryDir, Config, Language, Output, SparvErrorMessage, Text, annotator, get_logger,
+                       util)
 from sparv.api.util.tagsets import pos_to_upos
 
 logger = get_logger(__name__)
 
+ANNOTATORS = "tokenize,ssplit,pos,lemma,depparse,ner"
+# The output columns are taken from edu.stanford.nlp.ling.AnnotationLookup:
+OUTPUT_COLUMNS = "idx,current,lemma,pos,ner,headidx,deprel,BEGIN_POS,END_POS"
+# Maximum time in seconds for the CoreNLP server to process one text
+SERVER_TIMEOUT = 600
+# Maximum time in seconds to wait for a new CoreNLP server to start
+SERVER_START_TIMEOUT = 300
+
+
+def preloader(binary, server_threads):
+    """Start a local CoreNLP server with the models loaded, to be used by all the preloader processes."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("localhost", 0))
+        port = sock.getsockname()[1]
+    java = util.system.find_binary("java", raise_error=True)
+    process = subprocess.Popen([java, "-cp", binary + "/*", "edu.stanford.nlp.pipeline.StanfordCoreNLPServer",
+                                "-port", str(port), "-threads", str(server_threads),
+                                "-timeout", str(SERVER_TIMEOUT * 1000), "-preload", ANNOTATORS, "-quiet"],
+                               stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    atexit.register(util.system.kill_process, process)
+    url = f"http://localhost:{port}"
+
+    # Wait for the server to load its models
+    start_time = time.time()
+    while True:
+        if process.poll() is not None:
+            raise SparvErrorMessage("The Stanford CoreNLP server stopped unexpectedly while starting.")
+        try:
+            with urllib.request.urlopen(f"{url}/ready", timeout=1):
+                break
+        except OSError:
+            if time.time() - start_time > SERVER_START_TIMEOUT:
+                util.system.kill_process(process)
+                raise SparvErrorMessage("The Stanford CoreNLP server didn't start in time.")
+            time.sleep(1)
+    return {"url": url, "process": process}
+
 
 @annotator("Parse and annotate with Stanford Parser", language=["eng"], config=[
-    Config("stanford.bin", default="stanford_parser", description="Path to directory containing Stanford executables")
-])
+    Config("stanford.bin", default="stanford_parser", description="Path to directory containing Stanford executables"),
+    Config("stanford.server_url", description="URL of an already running Stanford CoreNLP server to use instead of "
+                                              "starting Stanford CoreNLP for every source file, e.g. "
+                                              "'http://localhost:9000'", datatype=str),
+    Config("stanford.server_threads", default=4, description="Maximum number of texts sent to the CoreNLP server at "
+                                                             "the same time by one annotator, and the number of threads "
+                                                             "used by the server started by the preloader",
+           datatype=int, min=1)
+], preloader=preloader, preloader_params=["binary", "server_threads"], preloader_target="server")
 def annotate(corpus_text: Text = Text(),
              lang: Language = Language(),
              text: Annotation = Annotation("<text>"),
@@ -33,21 +89,67 @@ def annotate(corpus_text: Text = Text(),
                                          description="Dependency relations to the head"),
              out_dephead_ref: Output = Output("<token>:stanford.dephead_ref", cls="token:dephead_ref",
                                               description="Sentence-relative positions of the dependency heads"),
-             binary: BinaryDir = BinaryDir("[stanford.bin]")):
-    """Use Stanford Parser to parse and annotate text."""
-    args = ["-cp", binary + "/*", "edu.stanford.nlp.pipeline.StanfordCoreNLP",
-            "-annotators", "tokenize,ssplit,pos,lemma,depparse,ner",
-            # The output columns are taken from edu.stanford.nlp.ling.AnnotationLookup:
-            "-output.columns", "idx,current,lemma,pos,ner,headidx,deprel,BEGIN_POS,END_POS",
-            "-outputFormat", "conll"]
-
+             binary: BinaryDir = BinaryDir("[stanford.bin]"),
+             server_url: Optional[str] = Config("stanford.server_url"),
+             server_threads: int = Config("stanford.server_threads"),
+             server: Optional[dict] = None):
+    """Use Stanford Parser to parse and annotate text.
+
+    If a CoreNLP server is available, either one started by the preloader or one given by server_url, the texts are
+    sent to the server. Otherwise, or if the server can't be reached, Stanford CoreNLP is started for this source file.
+    The server argument should never be set from the command line.
+    """
     # Read corpus_text and text_spans
     text_data = corpus_text.read()
     text_spans = list(text.read_spans())
+    texts = [text_data[start:end] for start, end in text_spans]
+
+    outputs = None
+    url = server["url"] if server else server_url
+    if url:
+        try:
+            outputs = _annotate_server(url, texts, server_threads)
+        except (OSError, http.client.HTTPException) as e:
+            logger.warning("Could not use the Stanford CoreNLP server at %s (%s), running Stanford CoreNLP for "
+                           "this file instead", url, e)
+    if outputs is None:
+        outputs = _annotate_files(binary, texts)
 
     sentence_segments = []
     all_tokens = []
 
+    for nr, ((start, end), output) in enumerate(zip(text_spans, outputs)):
+        logger.debug("Reading text %d (%d-%d): %r...%r", nr, start, end, output[:20], output[-20:])
+        processed_sentences = _parse_output(output, lang, start)
+
+        for sentence in processed_sentences:
+            logger.debug("Parsed: %s", " ".join(f"{tok.baseform}/{tok.pos}" for tok in sentence))
+            for token in sentence:
+                all_tokens.append(token)
+                if token.word != text_data[token.start:token.end]:
+                    logger.warning("Stanford word (%r) differs from surface word (%r), using the Stanford word",
+                                   token.word, text_data[token.start:token.end])
+            sentence_segments.append((sentence[0].start, sentence[-1].end))
+
+    # Write annotations
+    out_sentence.write(sentence_segments)
+    out_token.write([(t.start, t.end) for t in all_tokens])
+    out_baseform.write([t.baseform for t in all_tokens])
+    out_upos.write([t.upos for t in all_tokens])
+    out_pos.write([t.pos for t in all_tokens])
+    out_ne.write([t.ne for t in all_tokens])
+    out_dephead_ref.write([t.dephead_ref for t in all_tokens])
+    out_deprel.write([t.deprel for t in all_tokens])
+
+
+def _annotate_files(binary: str, texts: List[str]) -> List[str]:
+    """Run Stanford CoreNLP on texts, by writing them to temporary files, and return the CoNLL output per text."""
+    args = ["-cp", binary + "/*", "edu.stanford.nlp.pipeline.StanfordCoreNLP",
+            "-annotators", ANNOTATORS,
+            "-output.columns", OUTPUT_COLUMNS,
+            "-outputFormat", "conll"]
+    outputs = []
+
     with tempfile.TemporaryDirectory() as tmpdirstr:
         tmpdir = Path(tmpdirstr)
         logger.debug("Creating temporary directoty: %s", tmpdir)
@@ -55,46 +157,42 @@ def annotate(corpus_text: Text = Text(),
         # Write all texts to temporary files
         filelist = tmpdir / "filelist.txt"
         with open(filelist, "w", encoding="utf-8") as LIST:
-            for nr, (start, end) in enumerate(text_spans):
+            for nr, text in enumerate(texts):
                 filename = tmpdir / f"text-{nr}.txt"
                 print(filename, file=LIST)
                 with open(filename, "w", encoding="utf-8") as F:
-                    print(text_data[start:end], file=F)
-                logger.debug("Writing text %d (%d-%d): %r...%r --> %s", nr, start, end,
-                             text_data[start:start + 20], text_data[end - 20:end], filename.name)
+                    print(text, file=F)
+                logger.debug("Writing text %d: %r...%r --> %s", nr, text[:20], text[-20:], filename.name)
 
         # Call the Stanford parser with all the text files
         args += ["-filelist", filelist]
         args += ["-outputDirectory", tmpdir]
         util.system.call_binary("java", arguments=args)
 
-        # Read and parse each of the output files
-        for nr, (start, end) in enumerate(text_spans):
-            filename = tmpdir / f"text-{nr}.txt.conll"
-            with open(filename, encoding="utf-8") as F:
-                output = F.read()
-            logger.debug("Reading text %d (%d-%d): %s --> %r...%r", nr, start, end,
-                         filename.name, output[:20], output[-20:])
-            processed_sentences = _parse_output(output, lang, start)
-
-            for sentence in processed_sentences:
-                logger.debug("Parsed: %s", " ".join(f"{tok.baseform}/{tok.pos}" for tok in sentence))
-                for token in sentence:
-                    all_tokens.append(token)
-                    if token.word != text_data[token.start:token.end]:
-                        logger.warning("Stanford word (%r) differs from surface word (%r), using the Stanford word",
-                                       token.word, text_data[token.start:token.end])
-                sentence_segments.append((sentence[0].start, sentence[-1].end))
+        # Read each of the output files
+        for nr in range(len(texts)):
+            with open(tmpdir / f"text-{nr}.txt.conll", encoding="utf-8") as F:
+                outputs.append(F.read())
 
-    # Write annotations
-    out_sentence.write(sentence_segments)
-    out_token.write([(t.start, t.end) for t in all_tokens])
-    out_baseform.write([t.baseform for t in all_tokens])
-    out_upos.write([t.upos for t in all_tokens])
-    out_pos.write([t.pos for t in all_tokens])
-    out_ne.write([t.ne for t in all_tokens])
-    out_dephead_ref.write([t.dephead_ref for t in all_tokens])
-    out_deprel.write([t.deprel for t in all_tokens])
+    return outputs
+
+
+def _annotate_server(url: str, texts: List[str], max_concurrent: int) -> List[str]:
+    """Send texts to a Stanford CoreNLP server and return the CoNLL output per text.
+
+    At most max_concurrent texts are sent to the server at the same time.
+    """
+    properties = json.dumps({"annotators": ANNOTATORS, "outputFormat": "conll", "output.columns": OUTPUT_COLUMNS})
+    request_url = f"{url.rstrip('/')}/?properties={urllib.parse.quote(properties)}"
+
+    def annotate_text(text: str) -> str:
+        request = urllib.request.Request(request_url, data=text.encode("utf-8"),
+                                         headers={"Content-Type": "text/plain; charset=utf-8"})
+        with urllib.request.urlopen(request, timeout=SERVER_TIMEOUT) as response:
+            return response.read().decode("utf-8")
+
+    with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+        return list(executor.map(annotate_text, texts))
 
 
 @annotator("Annotate tokens with IDs relative to their sentences", language=["eng"])
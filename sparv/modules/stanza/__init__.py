@@ -40,6 +40,31 @@ __config__ = [
         "be excluded from analysis. Disabled by default.",
         datatype=int,
     ),
+    Config(
+        "stanza.quantize",
+        description="Set to 'dynamic' to apply dynamic int8 quantization to the Stanza models when running on CPU, "
+        "for faster inference at the cost of a small change in accuracy (only used for Swedish)",
+        datatype=str,
+        choices=("dynamic",),
+    ),
+    Config(
+        "stanza.quantize_check",
+        default=False,
+        description="When quantizing the Stanza models, also annotate a sample of the text with the unquantized models "
+        "and log the share of identical annotations. This is meant for evaluating quantization, since it makes the "
+        "annotation slower. Not done when the models are quantized by the preloader.",
+        datatype=bool,
+    ),
+    Config(
+        "stanza.cpu_threads",
+        default=0,
+        description="Number of threads used by PyTorch in each Stanza process (or preloader worker) when running on "
+        "CPU. By default (0), the cores given to Sparv are divided between the Stanza jobs that may run in parallel "
+        "(if limited by the 'threads' config section) or between the preloader processes, to avoid oversubscription. "
+        "Otherwise PyTorch's default is used.",
+        datatype=int,
+        min=0,
+    ),
     Config(
         "stanza.sentence_chunk",
         default="<text>",
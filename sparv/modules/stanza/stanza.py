@@ -8,7 +8,18 @@ from . import stanza_utils
 logger = get_logger(__name__)
 
 
-@annotator("POS, lemma and dependency relations from Stanza", language=["eng"])
+def preloader(resources_file, lang, use_gpu, batch_size, cpu_threads):
+    """Preload the Stanza pipeline used when no existing sentence segmentation or tokenization is used."""
+    stanza_utils.set_torch_threads(cpu_threads)
+    stanza_utils.select_gpu(use_gpu)
+    pipelines = {}
+    stanza_utils.get_pipeline(_nlp_args(lang, resources_file, use_gpu, batch_size), pipelines)
+    return pipelines
+
+
+@annotator("POS, lemma and dependency relations from Stanza", language=["eng"], preloader=preloader,
+           preloader_params=["resources_file", "lang", "use_gpu", "batch_size", "cpu_threads"],
+           preloader_target="pipelines", preloader_shared=False)
 def annotate(corpus_text: Text = Text(),
              lang: Language = Language(),
              sentence_chunk: Optional[Annotation] = Annotation("[stanza.sentence_chunk]"),
@@ -37,43 +48,30 @@ def annotate(corpus_text: Text = Text(),
              use_gpu: bool = Config("stanza.use_gpu"),
              batch_size: int = Config("stanza.batch_size"),
              max_sentence_length: int = Config("stanza.max_sentence_length"),
-             cpu_fallback: bool = Config("stanza.cpu_fallback")):
-    """Do dependency parsing using Stanza."""
-    import torch
-    from stanza.pipeline.core import DownloadMethod
-
+             cpu_fallback: bool = Config("stanza.cpu_fallback"),
+             cpu_threads: int = Config("stanza.cpu_threads"),
+             pipelines: Optional[dict] = None):
+    """Do dependency parsing using Stanza.
+
+    The pipelines argument is used by the preloader to keep the Stanza pipelines between calls, and should never be set
+    from the command line.
+    """
     # cpu_fallback only makes sense if use_gpu is True
     cpu_fallback = cpu_fallback and use_gpu
 
-    # Select the GPU with most free memory available
-    try:
-        if use_gpu:
-            gpus = util.system.gpus()
-            if gpus:
-                torch.cuda.set_device(gpus[0])
-    except:
-        pass
+    stanza_utils.set_torch_threads(cpu_threads)
+    stanza_utils.select_gpu(use_gpu)
 
     # Read corpus_text and text_spans
     text_data = corpus_text.read()
 
     # Define some values needed for Stanza Pipeline
-    nlp_args = {
-        "lang": util.misc.get_language_part1_by_part3(lang),
-        "processors": "tokenize,mwt,pos,lemma,depparse,ner",  # Comma-separated list of processors to use
-        "dir": str(resources_file.path.parent),
-        "depparse_max_sentence_size": 200,  # Create new batch when encountering sentences larger than this
-        "depparse_batch_size": batch_size,
-        "pos_batch_size": batch_size,
-        "lemma_batch_size": batch_size,
-        "use_gpu": use_gpu,
-        "verbose": False,
-        "download_method": DownloadMethod.NONE
-    }
+    nlp_args = _nlp_args(lang, resources_file, use_gpu, batch_size)
     stanza_args = {
         "use_gpu": use_gpu,
         "batch_size": batch_size,
         "max_sentence_length": max_sentence_length,
+        "pipelines": pipelines
     }
 
     write_tokens = True
@@ -115,11 +113,9 @@ def annotate(corpus_text: Text = Text(),
 
 def process_tokens(sentences, token_spans, text_data, nlp_args, stanza_args):
     """Process pre-tokenized text with Stanza."""
-    import stanza
-
     # Init Stanza pipeline
     nlp_args["tokenize_pretokenized"] = True
-    nlp = stanza.Pipeline(**nlp_args)
+    nlp = stanza_utils.get_pipeline(nlp_args, stanza_args["pipelines"])
 
     # Format document for stanza: list of lists of string
     document = [[text_data[token_spans[i][0][0]:token_spans[i][1][0]] for i in s] for s in sentences]
@@ -163,11 +159,9 @@ def process_tokens(sentences, token_spans, text_data, nlp_args, stanza_args):
 
 def process_sentences(sentence_spans, text_data, nlp_args, stanza_args):
     """Process pre-sentence segmented text with Stanza."""
-    import stanza
-
     # Init Stanza pipeline
     nlp_args["tokenize_no_ssplit"] = True
-    nlp = stanza.Pipeline(**nlp_args)
+    nlp = stanza_utils.get_pipeline(nlp_args, stanza_args["pipelines"])
 
     # Format document for stanza: separate sentences by double new lines
     document = "\n\n".join([text_data[sent_span[0]:sent_span[1]].replace("\n", " ") for sent_span in sentence_spans])
@@ -213,10 +207,8 @@ def process_sentences(sentence_spans, text_data, nlp_args, stanza_args):
 
 def process_text(text_spans, text_data, nlp_args, stanza_args):
     """Process text with Stanza (including sentence segmentation)."""
-    import stanza
-
     # Init Stanza pipeline
-    nlp = stanza.Pipeline(**nlp_args)
+    nlp = stanza_utils.get_pipeline(nlp_args, stanza_args["pipelines"])
 
     sentence_segments = []
     all_tokens = []
@@ -245,6 +237,24 @@ def process_text(text_spans, text_data, nlp_args, stanza_args):
     return sentence_segments, all_tokens, ne_segments, ne_types
 
 
+def _nlp_args(lang: str, resources_file: Model, use_gpu: bool, batch_size: int) -> dict:
+    """Return the arguments for the Stanza pipeline."""
+    from stanza.pipeline.core import DownloadMethod
+
+    return {
+        "lang": util.misc.get_language_part1_by_part3(lang),
+        "processors": "tokenize,mwt,pos,lemma,depparse,ner",  # Comma-separated list of processors to use
+        "dir": str(resources_file.path.parent),
+        "depparse_max_sentence_size": 200,  # Create new batch when encountering sentences larger than this
+        "depparse_batch_size": batch_size,
+        "pos_batch_size": batch_size,
+        "lemma_batch_size": batch_size,
+        "use_gpu": use_gpu,
+        "verbose": False,
+        "download_method": DownloadMethod.NONE
+    }
+
+
 class Token:
     """Object to store annotation information for a token."""
 
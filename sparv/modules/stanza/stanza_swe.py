@@ -1,12 +1,32 @@
 """POS tagging, lemmatisation and dependency parsing with Stanza."""
 
-from sparv.api import Annotation, Config, Model, Output, annotator, get_logger, util
+from typing import Dict, List, Optional, Tuple
+
+from sparv.api import (AllSourceFilenames, Annotation, AnnotationAllSourceFiles, Config, Model, Output,
+                       OutputAllSourceFiles, annotator, get_logger, util)
 from . import stanza_utils
 
 logger = get_logger(__name__)
 
 
-@annotator("POS, lemma and dependency relations from Stanza", language=["swe"], order=1)
+def preloader_swe(pos_model, pos_pretrain_model, lem_model, dep_model, dep_pretrain_model, resources_file, use_gpu,
+                  batch_size, cpu_threads, quantize):
+    """Preload the Stanza pipeline for POS tagging, lemmatisation and dependency parsing, quantizing it if requested."""
+    stanza_utils.set_torch_threads(cpu_threads)
+    stanza_utils.select_gpu(use_gpu)
+    pipelines = {}
+    nlp_args = _swe_nlp_args(resources_file, pos_model, pos_pretrain_model, lem_model, dep_model, dep_pretrain_model,
+                             batch_size)
+    nlp_args["processors"] = "tokenize,pos,lemma,depparse"
+    nlp_args["use_gpu"] = use_gpu
+    stanza_utils.get_pipeline(nlp_args, pipelines, quantize)
+    return pipelines
+
+
+@annotator("POS, lemma and dependency relations from Stanza", language=["swe"], order=1, preloader=preloader_swe,
+           preloader_params=["pos_model", "pos_pretrain_model", "lem_model", "dep_model", "dep_pretrain_model",
+                             "resources_file", "use_gpu", "batch_size", "cpu_threads", "quantize"],
+           preloader_target="pipelines", preloader_shared=False)
 def annotate_swe(
         out_msd: Output = Output("<token>:stanza.msd", cls="token:msd",
                                  description="Part-of-speeches with morphological descriptions"),
@@ -34,56 +54,170 @@ def annotate_swe(
         batch_size: int = Config("stanza.batch_size"),
         max_sentence_length: int = Config("stanza.max_sentence_length"),
         cpu_fallback: bool = Config("stanza.cpu_fallback"),
-        max_token_length: int = Config("stanza.max_token_length")):
-    """Do dependency parsing using Stanza."""
-    import stanza
-    import torch
-    from stanza.pipeline.core import DownloadMethod
+        max_token_length: int = Config("stanza.max_token_length"),
+        cpu_threads: int = Config("stanza.cpu_threads"),
+        quantize: Optional[str] = Config("stanza.quantize"),
+        quantize_check: bool = Config("stanza.quantize_check"),
+        pipelines: Optional[dict] = None):
+    """Do dependency parsing using Stanza.
+
+    The pipelines argument is used by the preloader to keep the Stanza pipelines between calls, and should never be set
+    from the command line.
+    """
+    stanza_utils.set_torch_threads(cpu_threads)
+    stanza_utils.select_gpu(use_gpu)
 
+    sentences_all, orphans = sentence.get_children(token)
+    nlp_args = _swe_nlp_args(resources_file, pos_model, pos_pretrain_model, lem_model, dep_model, dep_pretrain_model,
+                             batch_size)
+    result, = _annotate_documents([(sentences_all, orphans, list(word.read()))], nlp_args, pipelines, use_gpu,
+                                  cpu_fallback, batch_size, max_sentence_length, max_token_length, quantize,
+                                  quantize_check)
+
+    out_msd.write(result["msd"])
+    out_pos.write(result["pos"])
+    out_feats.write(result["feats"])
+    out_baseform.write(result["baseform"])
+    out_dephead_ref.write(result["dephead_ref"])
+    out_dephead.write(result["dephead"])
+    out_deprel.write(result["deprel"])
+
+
+@annotator("POS, lemma and dependency relations from Stanza, running the source files in batches", language=["swe"],
+           order=0, config=[
+               Config("stanza.batch_word", description="Word annotation to use when running Stanza on several source "
+                                                       "files at once. Setting this (e.g. to '<token:word>') enables "
+                                                       "batching.", datatype=str),
+               Config("stanza.batch_files", default=100, description="Maximum number of source files per Stanza run "
+                                                                      "when batching is enabled", datatype=int, min=1)
+           ], preloader=preloader_swe,
+           preloader_params=["pos_model", "pos_pretrain_model", "lem_model", "dep_model", "dep_pretrain_model",
+                             "resources_file", "use_gpu", "batch_size", "cpu_threads", "quantize"],
+           preloader_target="pipelines", preloader_shared=False)
+def annotate_swe_batch(
+        source_files: AllSourceFilenames = AllSourceFilenames(),
+        out_msd: OutputAllSourceFiles = OutputAllSourceFiles(
+            "<token>:stanza.msd", cls="token:msd", description="Part-of-speeches with morphological descriptions"),
+        out_pos: OutputAllSourceFiles = OutputAllSourceFiles("<token>:stanza.pos", cls="token:pos",
+                                                             description="Part-of-speech tags"),
+        out_feats: OutputAllSourceFiles = OutputAllSourceFiles("<token>:stanza.ufeats", cls="token:ufeats",
+                                                               description="Universal morphological features"),
+        out_baseform: OutputAllSourceFiles = OutputAllSourceFiles("<token>:stanza.baseform", cls="token:baseform",
+                                                                  description="Baseform from Stanza"),
+        out_dephead: OutputAllSourceFiles = OutputAllSourceFiles("<token>:stanza.dephead", cls="token:dephead",
+                                                                 description="Positions of the dependency heads"),
+        out_dephead_ref: OutputAllSourceFiles = OutputAllSourceFiles(
+            "<token>:stanza.dephead_ref", cls="token:dephead_ref",
+            description="Sentence-relative positions of the dependency heads"),
+        out_deprel: OutputAllSourceFiles = OutputAllSourceFiles("<token>:stanza.deprel", cls="token:deprel",
+                                                                description="Dependency relations to the head"),
+        word: AnnotationAllSourceFiles = AnnotationAllSourceFiles("[stanza.batch_word]"),
+        token: AnnotationAllSourceFiles = AnnotationAllSourceFiles("<token>"),
+        sentence: AnnotationAllSourceFiles = AnnotationAllSourceFiles("<sentence>"),
+        pos_model: Model = Model("[stanza.swe_pos_model]"),
+        pos_pretrain_model: Model = Model("[stanza.swe_pretrain_pos_model]"),
+        lem_model: Model = Model("[stanza.swe_lem_model]"),
+        dep_model: Model = Model("[stanza.swe_dep_model]"),
+        dep_pretrain_model: Model = Model("[stanza.swe_pretrain_dep_model]"),
+        resources_file: Model = Model("[stanza.resources_file]"),
+        use_gpu: bool = Config("stanza.use_gpu"),
+        batch_size: int = Config("stanza.batch_size"),
+        max_sentence_length: int = Config("stanza.max_sentence_length"),
+        cpu_fallback: bool = Config("stanza.cpu_fallback"),
+        max_token_length: int = Config("stanza.max_token_length"),
+        cpu_threads: int = Config("stanza.cpu_threads"),
+        quantize: Optional[str] = Config("stanza.quantize"),
+        quantize_check: bool = Config("stanza.quantize_check"),
+        batch_files: int = Config("stanza.batch_files"),
+        pipelines: Optional[dict] = None):
+    """Do dependency parsing using Stanza, with sentences from several source files in the same Stanza batches.
+
+    Stanza batches are otherwise limited to a single source file, so for corpora with many short source files most
+    batches are nearly empty. Here the sentences from up to batch_files source files are processed together and the
+    results split up by source file again. This annotator is only used when 'stanza.batch_word' is set, since a change
+    to any source file means that all files have to be annotated again.
+
+    The pipelines argument is used by the preloader to keep the Stanza pipelines between calls, and should never be set
+    from the command line.
+    """
+    stanza_utils.set_torch_threads(cpu_threads)
+    stanza_utils.select_gpu(use_gpu)
+
+    nlp_args = _swe_nlp_args(resources_file, pos_model, pos_pretrain_model, lem_model, dep_model, dep_pretrain_model,
+                             batch_size)
+    if pipelines is None:
+        # Keep the pipelines between the batches
+        pipelines = {}
+
+    for i in range(0, len(source_files), batch_files):
+        batch = source_files[i:i + batch_files]
+        logger.info("Running Stanza on %d source files", len(batch))
+        documents = []
+        for file in batch:
+            sentences_all, orphans = sentence.get_children(file, token)
+            documents.append((sentences_all, orphans, list(word.read(file))))
+        results = _annotate_documents(documents, nlp_args, pipelines, use_gpu, cpu_fallback, batch_size,
+                                      max_sentence_length, max_token_length, quantize, quantize_check)
+
+        for file, result in zip(batch, results):
+            out_msd.write(result["msd"], file)
+            out_pos.write(result["pos"], file)
+            out_feats.write(result["feats"], file)
+            out_baseform.write(result["baseform"], file)
+            out_dephead_ref.write(result["dephead_ref"], file)
+            out_dephead.write(result["dephead"], file)
+            out_deprel.write(result["deprel"], file)
+
+
+def _annotate_documents(documents: List[Tuple[list, list, List[str]]], nlp_args: dict, pipelines: Optional[dict],
+                        use_gpu: bool, cpu_fallback: bool, batch_size: int, max_sentence_length: int,
+                        max_token_length: int, quantize: Optional[str] = None,
+                        quantize_check: bool = False) -> List[Dict[str, list]]:
+    """Run Stanza on the sentences of one or more documents, processing all the sentences together.
+
+    Args:
+        documents: List of tuples with sentences (lists of token indices), orphan tokens and words, one per document.
+        quantize: Quantization method to apply to the Stanza models, if any.
+        quantize_check: Compare the quantized models with the unquantized ones on a sample, when quantizing.
+
+    Returns:
+        A dictionary per document, with a list of values per attribute.
+    """
     # cpu_fallback only makes sense if use_gpu is True
     cpu_fallback = cpu_fallback and use_gpu
 
-    # Select the GPU with most free memory available
-    try:
-        if use_gpu:
-            gpus = util.system.gpus()
-            if gpus:
-                torch.cuda.set_device(gpus[0])
-    except:
-        pass
-
-    sentences_all, orphans = sentence.get_children(token)
-    if orphans:
-        logger.warning(f"Found {len(orphans)} tokens not belonging to any sentence. These will not be annotated with "
-                       f"dependency relations.")
-
+    # Lists of (document number, sentence)
     sentences_dep = []
     sentences_pos = []
     skipped = 0
     skipped_token = 0
-
-    word_list = list(word.read())
-
-    for s in sentences_all:
-        if not s:
-            continue
-        elif len(s) > batch_size:
-            skipped += 1
-        else:
-            if max_token_length:
-                skip = False
-                for i in s:
-                    if len(word_list[i]) > max_token_length:
-                        skipped_token += 1
-                        skip = True
-                        break
-                if skip:
-                    continue
-            if len(s) <= max_sentence_length or not max_sentence_length:
-                sentences_dep.append(s)
+    orphan_count = 0
+
+    for doc_no, (sentences_all, orphans, word_list) in enumerate(documents):
+        for s in sentences_all:
+            if not s:
+                continue
+            elif len(s) > batch_size:
+                skipped += 1
             else:
-                sentences_pos.append(s)
-
+                if max_token_length:
+                    skip = False
+                    for i in s:
+                        if len(word_list[i]) > max_token_length:
+                            skipped_token += 1
+                            skip = True
+                            break
+                    if skip:
+                        continue
+                if len(s) <= max_sentence_length or not max_sentence_length:
+                    sentences_dep.append((doc_no, s))
+                else:
+                    sentences_pos.append((doc_no, s))
+        orphan_count += len(orphans)
+
+    if orphan_count:
+        logger.warning(f"Found {orphan_count} tokens not belonging to any sentence. These will not be annotated with "
+                       f"dependency relations.")
     if sentences_pos and not cpu_fallback:
         n = len(sentences_pos)
         logger.warning(f"Found {n} sentence{'s' if n > 1 else ''} exceeding the max sentence length "
@@ -97,32 +231,13 @@ def annotate_swe(
         logger.warning(f"Found {skipped_token} sentence{'s' if skipped_token > 1 else ''} with tokens exceeding the "
                        f"max token length ({max_token_length}). {'These' if skipped_token > 1 else 'This'} "
                        f"sentence{'s' if skipped_token > 1 else ''} will not be annotated.")
-    if orphans:
-        sentences_pos.append(orphans)
-    msd = word.create_empty_attribute()
-    pos = word.create_empty_attribute()
-    feats = word.create_empty_attribute()
-    baseforms = word.create_empty_attribute()
-    dephead = word.create_empty_attribute()
-    dephead_ref = word.create_empty_attribute()
-    deprel = word.create_empty_attribute()
+    for doc_no, (_sentences_all, orphans, _word_list) in enumerate(documents):
+        if orphans:
+            sentences_pos.append((doc_no, orphans))
 
-    nlp_args = {
-        "lang": "sv",
-        "dir": str(resources_file.path.parent),
-        "tokenize_pretokenized": True,  # Assume the text is tokenized by whitespace and sentence split by newline.
-        "lemma_model_path": str(lem_model.path),
-        "pos_pretrain_path": str(pos_pretrain_model.path),
-        "pos_model_path": str(pos_model.path),
-        "depparse_pretrain_path": str(dep_pretrain_model.path),
-        "depparse_model_path": str(dep_model.path),
-        "depparse_max_sentence_size": 200,  # Create new batch when encountering sentences larger than this
-        "depparse_batch_size": batch_size,
-        "pos_batch_size": batch_size,
-        "lemma_batch_size": batch_size,
-        "verbose": False,
-        "download_method": DownloadMethod.NONE
-    }
+    results = [{attr: [None] * len(word_list)
+                for attr in ("msd", "pos", "feats", "baseform", "dephead", "dephead_ref", "deprel")}
+               for _sentences_all, _orphans, word_list in documents]
 
     for sentences, dep, fallback in ((sentences_dep, True, False), (sentences_pos, False, cpu_fallback)):
         if not sentences:
@@ -137,42 +252,37 @@ def annotate_swe(
             )
             nlp_args["processors"] = "tokenize,pos,lemma,depparse"  # Comma-separated list of processors to use
             nlp_args["use_gpu"] = use_gpu and not fallback
-            nlp = stanza.Pipeline(**nlp_args)
 
         else:
             logger.debug("Running POS-taggning on %d sentences.", len(sentences))
             nlp_args["processors"] = "tokenize,pos"  # Comma-separated list of processors to use
             nlp_args["use_gpu"] = use_gpu
-            nlp = stanza.Pipeline(**nlp_args)
 
         # Format document for stanza: list of lists of string
-        document = [[word_list[i] for i in s] for s in sentences]
+        document = [[documents[doc_no][2][i] for i in s] for doc_no, s in sentences]
+        nlp = stanza_utils.get_pipeline(nlp_args, pipelines, quantize,
+                                        document[:stanza_utils.QUANTIZATION_SAMPLE_SIZE] if quantize_check else None)
 
         doc = stanza_utils.run_stanza(nlp, document, batch_size, max_sentence_length)
-        stanza_utils.check_sentence_respect(len(list(s for s in sentences if s)), len(doc.sentences))
-        word_count_real = sum(len(s) for s in sentences)
+        stanza_utils.check_sentence_respect(len(list(s for _doc_no, s in sentences if s)), len(doc.sentences))
+        word_count_real = sum(len(s) for _doc_no, s in sentences)
         word_count = 0
-        for sent, tagged_sent in zip(sentences, doc.sentences):
+        for (doc_no, sent), tagged_sent in zip(sentences, doc.sentences):
+            result = results[doc_no]
             for w_index, w in zip(sent, tagged_sent.words):
                 feats_str = util.misc.cwbset(w.feats.split("|") if w.feats else "")
-                msd[w_index] = w.xpos
-                pos[w_index] = w.upos
-                feats[w_index] = feats_str
-                baseforms[w_index] = w.lemma
+                result["msd"][w_index] = w.xpos
+                result["pos"][w_index] = w.upos
+                result["feats"][w_index] = feats_str
+                result["baseform"][w_index] = w.lemma
                 if dep or fallback:
-                    dephead[w_index] = str(sent[w.head - 1]) if w.head > 0 else "-"
-                    dephead_ref[w_index] = str(w.head) if w.head > 0 else ""
-                    deprel[w_index] = w.deprel
+                    result["dephead"][w_index] = str(sent[w.head - 1]) if w.head > 0 else "-"
+                    result["dephead_ref"][w_index] = str(w.head) if w.head > 0 else ""
+                    result["deprel"][w_index] = w.deprel
             word_count += len(tagged_sent.words)
         stanza_utils.check_token_respect(word_count_real, word_count)
 
-    out_msd.write(msd)
-    out_pos.write(pos)
-    out_feats.write(feats)
-    out_baseform.write(baseforms)
-    out_dephead_ref.write(dephead_ref)
-    out_dephead.write(dephead)
-    out_deprel.write(deprel)
+    return results
 
 
 @annotator("Part-of-speech annotation with morphological descriptions from Stanza", language=["swe"], order=2)
@@ -365,6 +475,29 @@ def pos_backoff_hunpos(
                            backoff_name="hunpos")
 
 
+def _swe_nlp_args(resources_file: Model, pos_model: Model, pos_pretrain_model: Model, lem_model: Model,
+                  dep_model: Model, dep_pretrain_model: Model, batch_size: int) -> dict:
+    """Return the arguments for the Swedish Stanza pipeline, excluding processors and use_gpu."""
+    from stanza.pipeline.core import DownloadMethod
+
+    return {
+        "lang": "sv",
+        "dir": str(resources_file.path.parent),
+        "tokenize_pretokenized": True,  # Assume the text is tokenized by whitespace and sentence split by newline.
+        "lemma_model_path": str(lem_model.path),
+        "pos_pretrain_path": str(pos_pretrain_model.path),
+        "pos_model_path": str(pos_model.path),
+        "depparse_pretrain_path": str(dep_pretrain_model.path),
+        "depparse_model_path": str(dep_model.path),
+        "depparse_max_sentence_size": 200,  # Create new batch when encountering sentences larger than this
+        "depparse_batch_size": batch_size,
+        "pos_batch_size": batch_size,
+        "lemma_batch_size": batch_size,
+        "verbose": False,
+        "download_method": DownloadMethod.NONE
+    }
+
+
 def _build_doc(sentences, word, baseform, msd, feats, ref):
     """Build stanza input for dependency parsing."""
     document = []
@@ -1,6 +1,15 @@
 """Util functions used in stanza."""
 
-from sparv.api import Annotation, Output, SparvErrorMessage, annotator
+from typing import List, Optional, Tuple
+
+from sparv.api import Annotation, Output, SparvErrorMessage, annotator, get_logger, util
+
+logger = get_logger(__name__)
+
+# Processors with models that are quantized when quantization is enabled
+QUANTIZED_PROCESSORS = ("pos", "lemma", "depparse")
+# Number of sentences used for comparing quantized models with unquantized ones
+QUANTIZATION_SAMPLE_SIZE = 100
 
 
 @annotator("Annotate tokens with IDs relative to their sentences")
@@ -13,6 +22,123 @@ def make_ref(out: Output = Output("<token>:stanza.ref", cls="token:ref",
     number.number_relative(out, sentence, token)
 
 
+def select_gpu(use_gpu: bool):
+    """Select the GPU with most free memory available."""
+    import torch
+    try:
+        if use_gpu:
+            gpus = util.system.gpus()
+            if gpus:
+                torch.cuda.set_device(gpus[0])
+    except:
+        pass
+
+
+def set_torch_threads(threads: int):
+    """Set the number of threads used by PyTorch for CPU inference in this process.
+
+    If threads is 0, the number of threads available to the current job according to Sparv is used. If Sparv doesn't
+    limit the number of threads for the job either, PyTorch's default is kept.
+    """
+    threads = threads or util.system.job_cpu_threads
+    if not threads:
+        return
+    import torch
+    if torch.get_num_threads() != threads:
+        torch.set_num_threads(threads)
+    if torch.get_num_interop_threads() != threads:
+        try:
+            torch.set_num_interop_threads(threads)
+        except RuntimeError:
+            # The number of inter-op threads can't be changed once any inter-op parallel work has started
+            pass
+
+
+def get_pipeline(nlp_args: dict, pipelines: Optional[dict] = None, quantize: Optional[str] = None,
+                 sample: Optional[list] = None):
+    """Return a Stanza pipeline created using nlp_args.
+
+    If pipelines is set (e.g. by the preloader), it is used as a cache of pipelines, keyed by their arguments and the
+    quantization method, to avoid loading (and quantizing) the same models again.
+
+    If quantize is set to 'dynamic', the models of the pipeline are quantized when it is created (only when running on
+    CPU). If a sample document is given, the result is compared to that of the unquantized models on the sample.
+    """
+    key = pipeline_key(nlp_args, quantize)
+    if pipelines is not None and key in pipelines:
+        return pipelines[key]
+
+    import stanza
+    logger.debug("Creating Stanza pipeline with processors: %s", nlp_args.get("processors"))
+    nlp = stanza.Pipeline(**nlp_args)
+    if quantize == "dynamic":
+        if nlp_args.get("use_gpu") and _cuda_available():
+            logger.warning("Quantization of Stanza models is only supported on CPU. Using the models without "
+                           "quantization.")
+        else:
+            quantize_pipeline(nlp, sample)
+    if pipelines is not None:
+        pipelines[key] = nlp
+    return nlp
+
+
+def pipeline_key(nlp_args: dict, quantize: Optional[str] = None) -> str:
+    """Return the key for a pipeline in the pipeline cache."""
+    key = repr(sorted(nlp_args.items()))
+    return f"{key} quantize={quantize}" if quantize else key
+
+
+def quantize_pipeline(nlp, sample: Optional[list] = None) -> None:
+    """Apply dynamic int8 quantization to the LSTM and linear layers of the models in a Stanza pipeline.
+
+    If a sample document is given, it is annotated both before and after quantization, and the share of identical
+    annotations is logged.
+    """
+    import torch
+
+    before = _get_tags(nlp(sample)) if sample else None
+    for name in QUANTIZED_PROCESSORS:
+        processor = nlp.processors.get(name)
+        model = getattr(getattr(processor, "trainer", None), "model", None)
+        if model is None:
+            continue
+        try:
+            processor.trainer.model = torch.quantization.quantize_dynamic(model, {torch.nn.LSTM, torch.nn.Linear},
+                                                                          dtype=torch.qint8)
+        except Exception as e:
+            logger.warning("Could not quantize the Stanza %s model, using it without quantization: %s", name, e)
+
+    if before:
+        after = _get_tags(nlp(sample))
+        pos_agreement, dep_agreement = tag_agreement(before, after)
+        logger.info("Quantized Stanza models: %.2f%% identical POS tags and %.2f%% identical dependency relations "
+                    "compared to the unquantized models, on a sample of %d tokens", pos_agreement, dep_agreement,
+                    len(before))
+
+
+def tag_agreement(before: List[tuple], after: List[tuple]) -> Tuple[float, float]:
+    """Return the share (in percent) of identical POS tags and dependency relations in two lists of tag tuples.
+
+    The tuples contain UPOS, XPOS, head and dependency relation.
+    """
+    if not before:
+        return 100.0, 100.0
+    pos = sum(b[:2] == a[:2] for b, a in zip(before, after))
+    dep = sum(b[2:] == a[2:] for b, a in zip(before, after))
+    return 100 * pos / len(before), 100 * dep / len(before)
+
+
+def _get_tags(doc) -> List[tuple]:
+    """Return a tuple of UPOS, XPOS, head and dependency relation for every word in a Stanza document."""
+    return [(w.upos, w.xpos, w.head, w.deprel) for sent in doc.sentences for w in sent.words]
+
+
+def _cuda_available() -> bool:
+    """Return True if PyTorch can use a GPU."""
+    import torch
+    return torch.cuda.is_available()
+
+
 def run_stanza(nlp, document, batch_size, max_sentence_length: int = 0, max_token_length: int = 0):
     """Run Stanza and handle possible errors."""
     try:
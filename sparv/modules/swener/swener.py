@@ -4,16 +4,21 @@ import re
 import xml.etree.ElementTree as etree
 import xml.sax.saxutils
 
-from sparv.api import Annotation, Binary, Config, Output, SparvErrorMessage, annotator, get_logger, util
+from typing import List, Optional
+
+from sparv.api import (AllSourceFilenames, Annotation, AnnotationAllSourceFiles, Binary, Config, Output,
+                       OutputAllSourceFiles, SparvErrorMessage, annotator, get_logger, util)
 
 logger = get_logger(__name__)
 
 RESTART_THRESHOLD_LENGTH = 64000
 SENT_SEP = "\n"
 TOK_SEP = " "
+# Line put after every source file when running SweNER on several files at once, to split up the output by file
+FILE_DELIMITER = "__SPARV_END_OF_SOURCE_FILE__"
 
 
-@annotator("Named entity tagging with SweNER", language=["swe"],
+@annotator("Named entity tagging with SweNER", language=["swe"], order=2,
            config=[Config("swener.binary", default="hfst-swener", description="SweNER executable", datatype=str)])
 def annotate(out_ne: Output = Output("swener.ne", cls="named_entity", description="Named entity segments from SweNER"),
              out_ne_ex: Output = Output("swener.ne:swener.ex", description="Named entity expressions from SweNER"),
@@ -53,8 +58,6 @@ def annotate(out_ne: Output = Output("swener.ne", cls="named_entity", descriptio
     word_annotation = list(word.read())
     stdin = SENT_SEP.join(TOK_SEP.join(word_annotation[token_index] for token_index in sent)
                           for sent in sentences)
-    # Escape <, > and &
-    stdin = xml.sax.saxutils.escape(stdin)
 
     # keep_process = len(stdin) < RESTART_THRESHOLD_LENGTH and process_dict is not None
     # logger.info("Stdin length: %s, keep process: %s", len(stdin), keep_process)
@@ -72,29 +75,142 @@ def annotate(out_ne: Output = Output("swener.ne", cls="named_entity", descriptio
 
     # else:
     # Otherwise use communicate which buffers properly
-    # logger.info("STDIN %s %s", type(stdin.encode(encoding)), stdin.encode(encoding))
+    stdout = run_swener(process, stdin)
+
+    parse_swener_output(sentences, token, stdout, out_ne, out_ne_ex, out_ne_type, out_ne_subtype, out_ne_name)
+
+
+@annotator("Named entity tagging with SweNER, running the source files in batches", language=["swe"], order=1,
+           config=[
+               Config("swener.batch_word", description="Word annotation to use when running SweNER on several "
+                                                       "source files at once. Setting this (e.g. to '<token:word>') "
+                                                       "enables batching.", datatype=str),
+               Config("swener.batch_size", default=100, description="Maximum number of source files per SweNER run "
+                                                                    "when batching is enabled", datatype=int, min=1)
+           ])
+def annotate_batch(
+        source_files: AllSourceFilenames = AllSourceFilenames(),
+        out_ne: OutputAllSourceFiles = OutputAllSourceFiles("swener.ne", cls="named_entity",
+                                                            description="Named entity segments from SweNER"),
+        out_ne_ex: OutputAllSourceFiles = OutputAllSourceFiles("swener.ne:swener.ex",
+                                                               description="Named entity expressions from SweNER"),
+        out_ne_type: OutputAllSourceFiles = OutputAllSourceFiles("swener.ne:swener.type", cls="named_entity:type",
+                                                                 description="Named entity types from SweNER"),
+        out_ne_subtype: OutputAllSourceFiles = OutputAllSourceFiles("swener.ne:swener.subtype",
+                                                                    cls="named_entity:subtype",
+                                                                    description="Named entity sub types from SweNER"),
+        out_ne_name: OutputAllSourceFiles = OutputAllSourceFiles("swener.ne:swener.name", cls="named_entity:name",
+                                                                 description="Names in SweNER named entities"),
+        word: AnnotationAllSourceFiles = AnnotationAllSourceFiles("[swener.batch_word]"),
+        sentence: AnnotationAllSourceFiles = AnnotationAllSourceFiles("<sentence>"),
+        token: AnnotationAllSourceFiles = AnnotationAllSourceFiles("<token>"),
+        binary: Binary = Binary("[swener.binary]"),
+        batch_size: int = Config("swener.batch_size")):
+    """Tag named entities using HFST-SweNER, running several source files in each SweNER process.
+
+    Starting SweNER and loading its transducers takes a lot longer than tagging a small source file, so for corpora
+    with many small files the files are concatenated into batches of at most batch_size files, with one SweNER run per
+    batch. A delimiter line is put after every file, and the output is split up per file again at the delimiters. If
+    the output for a file doesn't match its sentences, SweNER is run on that file on its own instead. This annotator is
+    only used when 'swener.batch_word' is set, since a change to any source file means that all files have to be
+    annotated again.
+    """
+    for i in range(0, len(source_files), batch_size):
+        batch = source_files[i:i + batch_size]
+        logger.info("Running SweNER on %d source files", len(batch))
+
+        file_sentences = {}
+        file_lines = {}
+        for file in batch:
+            sentences, _orphans = sentence.get_children(file, token, orphan_alert=True)
+            word_annotation = list(word.read(file))
+            file_sentences[file] = sentences
+            file_lines[file] = [TOK_SEP.join(word_annotation[token_index] for token_index in sent)
+                                for sent in sentences]
+
+        if any(file_lines.values()):
+            stdin = "".join(SENT_SEP.join(file_lines[file] + [FILE_DELIMITER]) + SENT_SEP for file in batch)
+            process = swenerstart(binary, "", util.constants.UTF8, verbose=False)
+            output = split_batch_output(run_swener(process, stdin), len(batch))
+        else:
+            output = [[] for _ in batch]
+        if output is None:
+            logger.warning("The output from SweNER could not be split up by source file. Running SweNER on every "
+                           "file on its own instead.")
+
+        for n, file in enumerate(batch):
+            sentences = file_sentences[file]
+            tagged_sentences = output[n] if output is not None else None
+            if tagged_sentences is None or len(tagged_sentences) != len(sentences):
+                if output is not None:
+                    logger.warning("The output from SweNER for %s doesn't match its sentences. Running SweNER on the "
+                                   "file on its own instead.", file)
+                process = swenerstart(binary, "", util.constants.UTF8, verbose=False)
+                tagged_sentences = run_swener(process, SENT_SEP.join(file_lines[file])).strip().split(SENT_SEP)
+            ne_spans, ex, types, subtypes, names = parse_sentences(sentences, list(token.read_spans(file)),
+                                                                   tagged_sentences)
+            out_ne.write(ne_spans, file)
+            out_ne_ex.write(ex, file)
+            out_ne_type.write(types, file)
+            out_ne_subtype.write(subtypes, file)
+            out_ne_name.write(names, file)
+
+
+def run_swener(process, stdin: str) -> str:
+    """Send the input to a started SweNER process and return its output."""
+    # Escape <, > and &
+    stdin = xml.sax.saxutils.escape(stdin)
     stdout, stderr = process.communicate(stdin.encode(util.constants.UTF8))
     if process.returncode > 0:
         raise SparvErrorMessage(f"An error occurred while running HFST-SweNER:\n\n{stderr.decode()}")
-    # logger.info("STDOUT %s %s", type(stdout.decode(encoding)), stdout.decode(encoding))
+    return stdout.decode(util.constants.UTF8)
+
 
-    parse_swener_output(sentences, token, stdout.decode(util.constants.UTF8), out_ne, out_ne_ex, out_ne_type,
-                        out_ne_subtype, out_ne_name)
+def split_batch_output(output: str, files: int) -> Optional[List[List[str]]]:
+    """Split the SweNER output for a batch of source files into a list of tagged sentences per file.
+
+    Returns None if the file delimiters in the output don't match the number of files.
+    """
+    tagged_files = [[]]
+    for line in output.split(SENT_SEP):
+        # Ignore any tags SweNER might have put around the delimiter
+        if re.sub(r"<[^>]*>", "", line).strip() == FILE_DELIMITER:
+            tagged_files.append([])
+        else:
+            tagged_files[-1].append(line)
+    # Nothing but the final line break is expected after the last delimiter
+    if len(tagged_files) != files + 1 or any(tagged_files[-1]):
+        return None
+    return tagged_files[:-1]
 
 
 def parse_swener_output(sentences: list, token: Annotation, output, out_ne: Output, out_ne_ex: Output,
                         out_ne_type: Output, out_ne_subtype: Output, out_ne_name: Output):
     """Parse the SweNER output and write annotation files."""
+    out_ne_spans, out_ex, out_type, out_subtype, out_name = parse_sentences(sentences, list(token.read_spans()),
+                                                                            output.strip().split(SENT_SEP))
+
+    # Write annotations
+    out_ne.write(out_ne_spans)
+    out_ne_ex.write(out_ex)
+    out_ne_type.write(out_type)
+    out_ne_subtype.write(out_subtype)
+    out_ne_name.write(out_name)
+
+
+def parse_sentences(sentences: list, token_spans: list, tagged_sentences: List[str]):
+    """Parse NE-tagged sentences from SweNER.
+
+    Returns lists with spans, expressions, types, sub types and names of the named entities.
+    """
     out_ne_spans = []
     out_ex = []
     out_type = []
     out_subtype = []
-    out_name = []
-
-    token_spans = list(token.read_spans())
+    out_name: List[Optional[str]] = []
 
     # Loop through the NE-tagged sentences and parse each one with ElemenTree
-    for sent, tagged_sent in zip(sentences, output.strip().split(SENT_SEP)):
+    for sent, tagged_sent in zip(sentences, tagged_sentences):
         xml_sent = "<sroot>" + tagged_sent + "</sroot>"
 
         # Filter out tags on the format <EnamexXxxXxx> since they seem to always overlap with <ENAMEX> elements,
@@ -154,12 +270,7 @@ def parse_swener_output(sentences: list, token: Annotation, output, out_ne: Outp
             logger.warning("Error parsing sentence. Skipping.")
             continue
 
-    # Write annotations
-    out_ne.write(out_ne_spans)
-    out_ne_ex.write(out_ex)
-    out_ne_type.write(out_type)
-    out_ne_subtype.write(out_subtype)
-    out_ne_name.write(out_name)
+    return out_ne_spans, out_ex, out_type, out_subtype, out_name
 
 
 def swenerstart(binary, stdin, encoding, verbose):
@@ -7,8 +7,8 @@ You do not need to download any parameter files as Sparv will download these for
 """
 
 
-from sparv.api import (Annotation, Binary, Config, Language, Model, ModelOutput, Output, annotator, get_logger,
-                       modelbuilder, util)
+from sparv.api import (Annotation, Binary, Config, Language, Model, ModelOutput, Output, SparvErrorMessage, annotator,
+                       get_logger, modelbuilder, util)
 from sparv.api.util.tagsets import pos_to_upos
 
 logger = get_logger(__name__)
@@ -19,6 +19,14 @@ TAG_SEP = "\t"
 TAG_COLUMN = 1
 LEM_COLUMN = 2
 
+# Tokens sent before and after every document to a running TreeTagger process, to find the document in the output
+START_SENTINEL = "__SPARV_START_OF_INPUT__"
+END_SENTINEL = "__SPARV_END_OF_INPUT__"
+# TreeTagger only writes its output when its buffer is full, so the end sentinel is followed by dummy tokens to push
+# the tagged document out of the buffer. More dummy tokens are sent until the end sentinel comes out, so this works
+# regardless of the buffer size. The output for the dummy tokens is skipped when reading the next document.
+FLUSH_TOKENS = ".\n" * 500
+
 TAG_SETS = {
     "bul": "BulTreeBank",
     "est": "TreeTagger",
@@ -37,12 +45,30 @@ TAG_SETS = {
 }
 
 
+def preloader(tt_binary, model):
+    """Preload TreeTagger process."""
+    return {"process": treetagger_start(tt_binary, model)}
+
+
+def treetagger_start(tt_binary, model):
+    """Start a TreeTagger process for tagging several documents and return it."""
+    process = util.system.call_binary(tt_binary, ["-quiet"] + get_args(model), return_command=True)
+    util.system.log_stderr(process, lambda line: logger.warning("Message from TreeTagger: %s", line))
+    return process
+
+
+def get_args(model: Model):
+    """Return command line arguments for TreeTagger."""
+    return ["-token", "-lemma", "-no-unknown", "-eos-tag", "<eos>", model.path]
+
+
 @annotator("Part-of-speech tags and baseforms from TreeTagger",
            language=["bul", "est", "fin", "lat", "nld", "pol", "ron", "slk", "deu", "eng", "fra", "spa", "ita", "rus"],
            config=[
                Config("treetagger.binary", "tree-tagger", description="TreeTagger executable"),
                Config("treetagger.model", "treetagger/[metadata.language].par", description="Path to TreeTagger model")
-           ])
+           ], preloader=preloader, preloader_params=["tt_binary", "model"], preloader_target="process_dict",
+           preloader_shared=False)
 def annotate(lang: Language = Language(),
              model: Model = Model("[treetagger.model]"),
              tt_binary: Binary = Binary("[treetagger.binary]"),
@@ -53,16 +79,23 @@ def annotate(lang: Language = Language(),
              out_baseform: Output = Output("<token>:treetagger.baseform", description="Baseforms from TreeTagger"),
              word: Annotation = Annotation("<token:word>"),
              sentence: Annotation = Annotation("<sentence>"),
-             encoding: str = util.constants.UTF8):
-    """POS/MSD tag and lemmatize using TreeTagger."""
+             encoding: str = util.constants.UTF8,
+             process_dict=None):
+    """POS/MSD tag and lemmatize using TreeTagger.
+
+    If process_dict is set, the TreeTagger process in it is used, and kept running for the next call.
+    The process_dict argument should never be set from the command line.
+    """
     sentences, _orphans = sentence.get_children(word)
     word_annotation = list(word.read())
     stdin = SENT_SEP.join(TOK_SEP.join(word_annotation[token_index] for token_index in sent)
                           for sent in sentences)
-    args = ["-token", "-lemma", "-no-unknown", "-eos-tag", "<eos>", model.path]
 
-    stdout, stderr = util.system.call_binary(tt_binary, args, stdin, encoding=encoding)
-    logger.debug("Message from TreeTagger:\n%s", stderr)
+    if process_dict is None:
+        stdout, stderr = util.system.call_binary(tt_binary, get_args(model), stdin, encoding=encoding)
+        logger.debug("Message from TreeTagger:\n%s", stderr)
+    else:
+        stdout = run_preloaded(process_dict, stdin, tt_binary, model, encoding)
 
     # Write pos and upos annotations.
     out_upos_annotation = word.create_empty_attribute()
@@ -95,6 +128,41 @@ def annotate(lang: Language = Language(),
     out_baseform.write(out_lemma_annotation)
 
 
+def run_preloaded(process_dict: dict, stdin: str, tt_binary, model: Model, encoding: str) -> str:
+    """Tag a document using the running TreeTagger process in process_dict and return the output."""
+    process = process_dict["process"]
+    # If process seems dead, spawn a new one
+    if process.stdin.closed or process.stdout.closed or process.poll() is not None:
+        util.system.kill_process(process)
+        process = treetagger_start(tt_binary, model)
+        process_dict["process"] = process
+
+    start_sentinel = START_SENTINEL.encode(encoding)
+    end_sentinel = END_SENTINEL.encode(encoding)
+    document = stdin + SENT_SEP if stdin else ""
+    # The start sentinel is put in a sentence of its own, to keep it and any dummy tokens left from the previous
+    # document from affecting the tagging of the first sentence
+    stdin = f"{SENT_SEP.lstrip()}{START_SENTINEL}{SENT_SEP}{document}".encode(encoding)
+    try:
+        lines = util.system.communicate_until(process, stdin, f"{END_SENTINEL}\n".encode(encoding),
+                                              lambda line: line.split(TAG_SEP.encode(encoding))[0] == end_sentinel,
+                                              flush=FLUSH_TOKENS.encode(encoding))
+    except OSError:
+        raise SparvErrorMessage("TreeTagger stopped unexpectedly.")
+
+    # Skip anything left from the previous document, i.e. the output for the dummy tokens, along with the start
+    # sentinel and the end-of-sentence tag following it
+    for i, line in enumerate(lines):
+        if line.split(TAG_SEP.encode(encoding))[0] == start_sentinel:
+            lines = lines[i + 2:]
+            break
+    stdout = b"".join(lines).decode(encoding)
+    # Remove the end-of-sentence tag before the end sentinel
+    if stdout.endswith(SENT_SEP.lstrip()):
+        stdout = stdout[:-len(SENT_SEP.lstrip())]
+    return stdout.strip()
+
+
 @modelbuilder("TreeTagger model for Bulgarian", language=["bul"])
 def get_bul_model(out: ModelOutput = ModelOutput("treetagger/bul.par"),
                   tt_binary: Binary = Binary("[treetagger.binary]")):
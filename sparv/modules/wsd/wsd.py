@@ -1,10 +1,20 @@
 """Word sense disambiguation based on SALDO annotation."""
 
-from sparv.api import Annotation, Binary, Config, Model, ModelOutput, Output, annotator, modelbuilder, get_logger, util
+from sparv.api import (Annotation, Binary, Config, Model, ModelOutput, Output, SparvErrorMessage, annotator,
+                       modelbuilder, get_logger, util)
 
 logger = get_logger(__name__)
 
 SENT_SEP = "$SENT$"
+# Word used in a sentence sent after every document to a running WSD process, to find the end of the output
+SENTINEL = "__SPARV_END_OF_INPUT__"
+
+
+def preloader(wsdjar, sense_model, context_model, encoding):
+    """Preload WSD process with its models."""
+    process = wsd_start(wsdjar, sense_model.path, context_model.path, encoding)
+    log_messages(process, encoding)
+    return {"process": process}
 
 
 @annotator("Word sense disambiguation", language=["swe"], config=[
@@ -14,7 +24,8 @@ SENT_SEP = "$SENT$"
     Config("wsd.jar", default="wsd/saldowsd.jar", description="Path name of the executable .jar file"),
     Config("wsd.prob_format", util.constants.SCORESEP + "%.3f", description="Format string for how to print the "
                                                                             "sense probability")
-])
+], preloader=preloader, preloader_params=["wsdjar", "sense_model", "context_model", "encoding"],
+   preloader_target="process_dict", preloader_shared=False)
 def annotate(wsdjar: Binary = Binary("[wsd.jar]"),
              sense_model: Model = Model("[wsd.sense_model]"),
              context_model: Model = Model("[wsd.context_model]"),
@@ -29,7 +40,8 @@ def annotate(wsdjar: Binary = Binary("[wsd.jar]"),
              token: Annotation = Annotation("<token>"),
              prob_format: str = Config("wsd.prob_format"),
              default_prob: float = Config("wsd.default_prob"),
-             encoding: str = util.constants.UTF8):
+             encoding: str = util.constants.UTF8,
+             process_dict=None):
     """Run the word sense disambiguation tool (saldowsd.jar) to add probabilities to the saldo annotation.
 
     Unanalyzed senses (e.g. multiword expressions) receive the probability value given by default_prob.
@@ -43,6 +55,7 @@ def annotate(wsdjar: Binary = Binary("[wsd.jar]"),
       - pos is an existing annotations for part-of-speech
       - prob_format is a format string for how to print the sense probability
       - default_prob is the default value for unanalyzed senses
+      - process_dict is used by the preloader and should never be set from the command line
     """
     word_annotation = list(word.read())
     ref_annotation = list(ref.read())
@@ -55,13 +68,19 @@ def annotate(wsdjar: Binary = Binary("[wsd.jar]"),
     # Remove empty sentences
     sentences = list(s for s in sentences if s)
 
-    # Start WSD process
-    process = wsd_start(wsdjar, sense_model.path, context_model.path, encoding)
-
-    # Construct input and send to WSD
+    # Construct input
     stdin = build_input(sentences, word_annotation, ref_annotation, lemgram_annotation, saldo_annotation,
                         pos_annotation)
 
+    if process_dict is not None:
+        # Use the preloaded process and keep it running
+        stdout = run_preloaded(process_dict, stdin, wsdjar, sense_model, context_model, encoding)
+        process_output(word, out, stdout, sentences, saldo_annotation, prob_format, default_prob)
+        return
+
+    # Start WSD process and send input
+    process = wsd_start(wsdjar, sense_model.path, context_model.path, encoding)
+
     if encoding:
         stdin = stdin.encode(encoding)
 
@@ -112,6 +131,41 @@ def wsd_start(wsdjar, sense_model, context_model, encoding):
     return process
 
 
+def run_preloaded(process_dict, stdin, wsdjar, sense_model, context_model, encoding):
+    """Send input to an already running WSD process and return its output for this input only."""
+    encoding = encoding or util.constants.UTF8
+    process = process_dict["process"]
+    # If process seems dead, spawn a new
+    if process.stdin.closed or process.stdout.closed or process.poll() is not None:
+        util.system.kill_process(process)
+        process = wsd_start(wsdjar, sense_model.path, context_model.path, encoding)
+        log_messages(process, encoding)
+        process_dict["process"] = process
+
+    # The sentinel is sent as an unanalyzed token in a sentence of its own
+    sentinel = "\n".join(["\t".join(["1", SENTINEL, "_", "_", SENTINEL + "..nn", "_"]),
+                          "\t".join(["_", "_", "_", "_", SENT_SEP, "_"])]) + "\n"
+    try:
+        stdout = util.system.communicate_until(
+            process, (stdin + "\n" if stdin else "").encode(encoding), sentinel.encode(encoding),
+            lambda line: line.split(b"\t")[1:2] == [SENTINEL.encode(encoding)], trailing_lines=1)
+    except OSError:
+        raise SparvErrorMessage("The WSD process stopped unexpectedly.")
+    return b"".join(stdout).decode(encoding)
+
+
+def log_messages(process, encoding):
+    """Log everything the running WSD process writes to stderr, reading it in the background."""
+    def log(line):
+        # Regular messages like "Reading sense vectors..." are also written to stderr
+        if line.startswith("Reading "):
+            logger.debug("Message from WSD: %s", line)
+        elif line:
+            logger.error("Message from WSD: %s", line)
+
+    return util.system.log_stderr(process, log, encoding or util.constants.UTF8)
+
+
 def build_input(sentences, word_annotation, ref_annotation, lemgram_annotation, saldo_annotation, pos_annotation):
     """Construct tab-separated input for WSD."""
     rows = []
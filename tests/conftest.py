@@ -0,0 +1,85 @@
+"""Pytest configuration, including support for performance regression tests."""
+
+import json
+import pathlib
+import time
+from typing import Callable, Optional
+
+import pytest
+
+
+def pytest_addoption(parser):
+    """Add command line options for performance tests."""
+    group = parser.getgroup("performance", "performance regression tests (run with '-m performance')")
+    group.addoption("--performance-baselines", default=".benchmarks/baselines.json",
+                    help="JSON file where performance baselines are stored")
+    group.addoption("--performance-threshold", type=float, default=0.25,
+                    help="Maximum allowed slowdown compared to the baseline, as a fraction (default: 0.25)")
+    group.addoption("--performance-update", action="store_true",
+                    help="Save the timings of this run as new baselines")
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip performance tests unless they are explicitly selected using '-m performance'."""
+    if "performance" in (config.getoption("markexpr") or ""):
+        return
+    skip_performance = pytest.mark.skip(reason="performance tests are only run when selected with '-m performance'")
+    for item in items:
+        if "performance" in item.keywords:
+            item.add_marker(skip_performance)
+
+
+class PerformanceBaselines:
+    """Storage of baseline timings for performance tests."""
+
+    def __init__(self, path: pathlib.Path, threshold: float, update: bool):
+        self.path = path
+        self.threshold = threshold
+        self.update = update
+        self.changed = False
+        self.data = json.loads(path.read_text(encoding="utf-8")) if path.is_file() else {}
+
+    def check(self, name: str, elapsed: float):
+        """Compare elapsed time to the baseline, or save it as baseline if there is none."""
+        baseline = self.data.get(name)
+        if baseline is None or self.update:
+            self.data[name] = elapsed
+            self.changed = True
+            return
+        assert elapsed <= baseline * (1 + self.threshold), (
+            f"{name} took {elapsed:.3f}s, which is more than {self.threshold:.0%} slower than the baseline "
+            f"({baseline:.3f}s)")
+
+    def save(self):
+        """Save baselines to file if anything was changed."""
+        if self.changed:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(json.dumps(self.data, indent=2, sort_keys=True), encoding="utf-8")
+
+
+@pytest.fixture(scope="session")
+def performance_baselines(request):
+    """Load performance baselines and save any new ones when the session is finished."""
+    baselines = PerformanceBaselines(pathlib.Path(request.config.getoption("performance_baselines")),
+                                     request.config.getoption("performance_threshold"),
+                                     request.config.getoption("performance_update"))
+    yield baselines
+    baselines.save()
+
+
+@pytest.fixture
+def perf_benchmark(request, performance_baselines):
+    """Return a function that times a callable and compares the best time to the stored baseline."""
+    def _benchmark(func: Callable, rounds: int = 5, setup: Optional[Callable] = None):
+        timings = []
+        result = None
+        for _ in range(rounds):
+            if setup:
+                setup()
+            start_time = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - start_time)
+        performance_baselines.check(request.node.nodeid, min(timings))
+        return result
+
+    return _benchmark
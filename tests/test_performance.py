@@ -0,0 +1,106 @@
+"""Performance regression tests for hot code paths and the bundled test corpora.
+
+These tests are skipped unless selected with '-m performance'. The first run stores baseline timings (see the
+'--performance-*' options), and subsequent runs fail if a test is slower than the baseline by more than the allowed
+threshold.
+"""
+
+import pathlib
+
+import pytest
+
+from sparv.api import Annotation, Model, Output
+from sparv.api.util.export import gather_annotations
+from sparv.core import io, log_handler  # noqa: F401 (log_handler adds progress logging)
+from . import utils
+
+SOURCE_FILE = "perf"
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Create a workdir with synthetic annotations and make it the current working directory."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(io, "compression", "gzip")
+    utils.write_synthetic_annotations(SOURCE_FILE, sentences=5000)
+    return tmp_path
+
+
+@pytest.mark.performance
+@pytest.mark.noexternal
+def test_read_annotation(workdir, perf_benchmark):
+    """Read token spans and attributes."""
+    token = Annotation("segment.token", source_file=SOURCE_FILE)
+    word = Annotation("segment.token:word", source_file=SOURCE_FILE)
+    perf_benchmark(lambda: (list(token.read_spans()), list(word.read())))
+
+
+@pytest.mark.performance
+@pytest.mark.noexternal
+def test_write_annotation(workdir, perf_benchmark):
+    """Write token attributes."""
+    values = list(Annotation("segment.token:word", source_file=SOURCE_FILE).read())
+    out = Output("segment.token:perf", source_file=SOURCE_FILE)
+    perf_benchmark(lambda: out.write(values))
+
+
+@pytest.mark.performance
+@pytest.mark.noexternal
+def test_get_children(workdir, perf_benchmark):
+    """Get tokens for every sentence."""
+    sentence = Annotation("segment.sentence", source_file=SOURCE_FILE)
+    token = Annotation("segment.token", source_file=SOURCE_FILE)
+    perf_benchmark(lambda: sentence.get_children(token))
+
+
+@pytest.mark.performance
+@pytest.mark.noexternal
+def test_gather_annotations(workdir, perf_benchmark):
+    """Calculate the span hierarchy used by the exporters."""
+    annotations = [Annotation(name, source_file=SOURCE_FILE) for name in
+                   ("text", "text:id", "segment.sentence", "segment.token", "segment.token:word",
+                    "segment.token:msd")]
+    perf_benchmark(lambda: gather_annotations(annotations, {}, source_file=SOURCE_FILE), rounds=3)
+
+
+@pytest.mark.performance
+@pytest.mark.noexternal
+def test_saldo_main(workdir, perf_benchmark):
+    """Run SALDO annotation, including multi-word expressions, with a synthetic lexicon."""
+    from sparv.modules.saldo import saldo, saldo_model
+
+    lexicon_path = workdir / "saldo.pickle"
+    utils.create_saldo_lexicon(lexicon_path)
+    model = Model(str(lexicon_path))
+    preloaded = {"saldo": saldo_model.SaldoLexicon(lexicon_path, verbose=False)}
+
+    def run():
+        saldo.main(token=Annotation("segment.token", source_file=SOURCE_FILE),
+                   word=Annotation("segment.token:word", source_file=SOURCE_FILE),
+                   sentence=Annotation("segment.sentence", source_file=SOURCE_FILE),
+                   reference=Annotation("segment.token:ref", source_file=SOURCE_FILE),
+                   out_sense=Output("segment.token:saldo.sense", source_file=SOURCE_FILE),
+                   out_lemgram=Output("segment.token:saldo.lemgram", source_file=SOURCE_FILE),
+                   out_baseform=Output("segment.token:saldo.baseform", source_file=SOURCE_FILE),
+                   models=[model], msd=Annotation("segment.token:msd", source_file=SOURCE_FILE), delimiter="|",
+                   affix="|", precision=None, precision_filter="max", min_precision=0.66, skip_multiword=False,
+                   max_gaps=1, allow_multiword_overlap=False, word_separator=None, models_preloaded=preloaded)
+
+    perf_benchmark(run, rounds=3)
+
+
+@pytest.mark.performance
+@pytest.mark.swe
+def test_mini_swe(tmp_path, perf_benchmark):
+    """Annotate the mini-swe corpus."""
+    gold_corpus_dir = pathlib.Path("tests/test_corpora/mini-swe")
+    perf_benchmark(lambda: utils.run_sparv(gold_corpus_dir, tmp_path), rounds=1)
+
+
+@pytest.mark.performance
+@pytest.mark.swe
+@pytest.mark.slow
+def test_standard_swe(tmp_path, perf_benchmark):
+    """Annotate the standard-swe corpus."""
+    gold_corpus_dir = pathlib.Path("tests/test_corpora/standard-swe")
+    perf_benchmark(lambda: utils.run_sparv(gold_corpus_dir, tmp_path), rounds=1)
@@ -0,0 +1,36 @@
+import pytest
+
+from sparv.core import bench
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_generate_corpus_is_reproducible(tmp_path):
+    tokens1 = bench.generate_corpus(tmp_path / "a", files=3, sentences=10, depth=2, seed=1)
+    tokens2 = bench.generate_corpus(tmp_path / "b", files=3, sentences=10, depth=2, seed=1)
+    assert tokens1 == tokens2
+    assert len(list((tmp_path / "a" / "source").iterdir())) == 3
+    for name in ("document1.xml", "document2.xml", "document3.xml"):
+        assert (tmp_path / "a" / "source" / name).read_text() == (tmp_path / "b" / "source" / name).read_text()
+    assert (tmp_path / "a" / "config.yaml").is_file()
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_io_benchmark():
+    result = bench.io_benchmark(items=100, compressions=["none", "gzip"])
+    assert set(result) == {"none", "gzip"}
+    assert set(result["none"]) == {"write_spans", "write_attributes", "read_spans", "read_attributes"}
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_io_benchmark_restores_compression(monkeypatch):
+    def fail(*_args, **_kwargs):
+        raise OSError("Disk full")
+
+    original_compression = bench.io.compression
+    monkeypatch.setattr(bench.Output, "write", fail)
+    with pytest.raises(OSError):
+        bench.io_benchmark(items=10, compressions=["gzip"])
+    assert bench.io.compression == original_compression
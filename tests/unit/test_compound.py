@@ -0,0 +1,150 @@
+import itertools
+import os
+import random
+
+import pytest
+
+from sparv.modules.saldo import compound
+
+
+@pytest.fixture()
+def model_file(tmp_path):
+    path = tmp_path / "model.pickle"
+    path.write_bytes(b"model")
+    return path
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_compound_cache(tmp_path, model_file):
+    altlexicon = compound.InFileLexicon([("glasskål", "NN.UTR.SIN.IND.NOM", "|"), ("skål", "NN.UTR.SIN.IND.NOM", "|")])
+    analysis = [(0.5, (("glas", "glas..nn.1", ("NN",)), ("skål", "skål..nn.1", ("NN",))))]
+
+    cache = compound.CompoundCache(tmp_path / "cache", [model_file], 10)
+    key = cache.key("glasskål", "NN.UTR.SIN.IND.NOM", altlexicon)
+    assert cache.get([key]) == {}
+    cache.update({key: analysis})
+    cache.close()
+
+    # The cache is shared between source files
+    cache = compound.CompoundCache(tmp_path / "cache", [model_file], 10)
+    assert cache.get([key]) == {key: analysis}
+
+    # Words from the source file that may be part of the analysis are part of the key
+    other_altlexicon = compound.InFileLexicon([("glasskål", "NN.UTR.SIN.IND.NOM", "|")])
+    assert cache.key("glasskål", "NN.UTR.SIN.IND.NOM", other_altlexicon) != key
+    unrelated_altlexicon = compound.InFileLexicon([("glasskål", "NN.UTR.SIN.IND.NOM", "|"),
+                                                   ("skål", "NN.UTR.SIN.IND.NOM", "|"),
+                                                   ("katten", "NN.UTR.SIN.DEF.NOM", "|")])
+    assert cache.key("glasskål", "NN.UTR.SIN.IND.NOM", unrelated_altlexicon) == key
+    cache.close()
+
+    # Changing a model invalidates the cache
+    model_file.write_bytes(b"new model")
+    os.utime(model_file, ns=(0, 10 ** 9))
+    cache = compound.CompoundCache(tmp_path / "cache", [model_file], 10)
+    assert cache.get([cache.key("glasskål", "NN.UTR.SIN.IND.NOM", altlexicon)]) == {}
+    cache.close()
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_compound_cache_eviction(tmp_path, model_file):
+    cache = compound.CompoundCache(tmp_path / "cache", [model_file], 10)
+    altlexicon = compound.InFileLexicon([])
+    keys = [cache.key(f"word{i}", "NN", altlexicon) for i in range(15)]
+    cache.update({key: [] for key in keys[:10]})
+    # Using the first analysis makes it recently used, so the next ones are removed before it
+    cache.update({key: [] for key in keys[10:]}, used=keys[:1])
+    cached = cache.get(keys)
+    assert len(cached) == 9
+    assert keys[0] in cached and keys[-1] in cached
+    cache.close()
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_compound_cache_size(tmp_path, model_file):
+    altlexicon = compound.InFileLexicon([])
+    cache = compound.CompoundCache(tmp_path / "cache", [model_file], 10)
+    keys = [cache.key(f"word{i}", "NN", altlexicon) for i in range(8)]
+    cache.update({key: [] for key in keys[:6]})
+    cache.close()
+
+    # The size is kept between runs, and analyses that are already cached are not counted twice
+    cache = compound.CompoundCache(tmp_path / "cache", [model_file], 10)
+    cache.update({key: [] for key in keys[3:]})
+    assert cache.db.execute("SELECT count FROM size").fetchone()[0] == 8
+    assert len(cache.get(keys)) == 8
+    cache.close()
+
+
+class FakeLexicon:
+    """Lexicon with fixed sets of valid prefixes, infixes and suffixes."""
+
+    def __init__(self, prefixes=(), infixes=(), suffixes=()):
+        self.prefixes = set(prefixes)
+        self.infixes = set(infixes)
+        self.suffixes = set(suffixes)
+
+    def get_prefixes(self, prefix):
+        return [prefix] if prefix in self.prefixes else []
+
+    def get_infixes(self, infix):
+        return [infix] if infix in self.infixes else []
+
+    def get_suffixes(self, suffix, msd=None):
+        return [suffix] if suffix in self.suffixes else []
+
+
+def reference_split_word(lexicon, w):
+    """Check every combination of split points and spellings."""
+    result = []
+    for n in range(1, len(w)):
+        for splitpoints in itertools.combinations(range(1, len(w)), n):
+            spans = list(zip((0,) + splitpoints, splitpoints + (None,)))
+            spellings = []
+            for (i, j) in spans[:-1]:
+                if w[j - 1].lower() in "bdfgjlmnprstv" and w[j - 1] == w[j]:
+                    spellings.append(sorted({w[i:j], w[i:j] + w[j - 1]}))
+                else:
+                    spellings.append([w[i:j]])
+            spellings.append([w[spans[-1][0]:]])
+            for comp in itertools.product(*spellings):
+                if (lexicon.get_prefixes(comp[0])
+                        and not compound.exception(comp[-1]) and lexicon.get_suffixes(comp[-1])
+                        and all(not compound.exception(infix) and lexicon.get_infixes(infix) for infix in comp[1:-1])):
+                    result.append(list(comp))
+    return result
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_split_word():
+    lexicon = FakeLexicon(prefixes=["glas", "glass", "bil"], infixes=["bil"], suffixes=["skål", "bil"])
+    empty = FakeLexicon()
+    assert compound.split_word(lexicon, empty, "glasskål", None) == [["glas", "skål"], ["glass", "skål"]]
+    assert compound.split_word(lexicon, empty, "glasbilskål", None) == [["glas", "bil", "skål"]]
+
+    # Long words are analysed completely, without giving up
+    assert len(compound.split_word(lexicon, empty, "bil" * 20 + "skål", None)) == 1
+
+    # Too many analyses
+    lexicon = FakeLexicon(prefixes=["ab", "abab"], infixes=["ab", "abab"], suffixes=["ab", "abab"])
+    assert len(compound.split_word(lexicon, empty, "ab" * 10, None)) == 89
+    assert compound.split_word(lexicon, empty, "ab" * 12, None) == []
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_split_word_matches_reference():
+    rnd = random.Random(0)
+    empty = FakeLexicon()
+    for _ in range(500):
+        pieces = ["".join(rnd.choice("abslkt") for _ in range(rnd.randint(1, 4))) for _ in range(12)]
+        lexicon = FakeLexicon(pieces[:6] + [p + p[-1] for p in pieces[:3]], pieces[3:9], pieces[6:])
+        w = "".join(rnd.choice(pieces) for _ in range(rnd.randint(2, 4)))
+        expected = reference_split_word(lexicon, w)
+        if len(expected) >= compound.SPLIT_LIMIT:
+            expected = []
+        assert compound.split_word(lexicon, empty, w, None) == expected, w
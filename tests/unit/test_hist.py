@@ -0,0 +1,32 @@
+import pytest
+
+from sparv.modules.hist import models
+
+VARIANTS = """\
+gata:::gatha,0.5^^gaata,0.7^^gatha,0.6
+konung:::konungh,0.3^^kunung,0.4^^Konung,0.9
+konung:::koning,0.8
+ära:::æra,0.2^^
+tom:::
+"""
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_spelling_variant_index(tmp_path):
+    text_file = tmp_path / "variants.txt"
+    text_file.write_text(VARIANTS, encoding="utf-8")
+    index_file = tmp_path / "variants.index"
+    models.write_variant_index(models.read_spelling_variants(text_file), index_file)
+
+    from_text = models.SpellingVariants(text_file, verbose=False)
+    from_index = models.SpellingVariants(index_file, verbose=False)
+    assert from_index.mmap is not None and from_text.mmap is None
+    assert from_index.count == from_text.count == 3
+
+    for word in ("gata", "konung", "ära", "tom", "a", "zzz", ""):
+        assert from_index.lookup(word) == from_text.lookup(word)
+    assert from_index.lookup("gata") == ("gaata", "gatha")
+    assert from_index.lookup("konung") == ("Konung", "koning", "konungh", "kunung")
+    assert from_index.lookup("ära") == ("æra",)
+    assert from_index.lookup("tom") == ()
@@ -0,0 +1,68 @@
+import re
+import sys
+
+import pytest
+
+from sparv.api import Model
+from sparv.modules.hunpos import hunpos
+
+# Fake tagger which, like Hunpos, writes messages to stderr and flushes its output after every sentence
+FAKE_HUNPOS = """
+import sys
+sys.stderr.write("reading model\\n" * 100000)
+sys.stderr.flush()
+for line in sys.stdin.buffer:
+    token = line.rstrip(b"\\n")
+    sys.stdout.buffer.write(token + b"\\tNN\\n" if token else b"\\n")
+    if not token:
+        sys.stdout.buffer.flush()
+"""
+
+PATTERNS = [
+    ("number", r"\d+([.,]\d+)?"),
+    ("year", r"1[89]\d\d"),
+    ("abbreviation", r"[A-ZÅÄÖ]{2,}"),
+    ("ordinal", r"\d+:(e|a)"),
+    ("prefix", r"^x|y$"),
+    ("url", r"(https?://|www\.).+"),
+]
+
+
+def replace_one_by_one(w):
+    for name, pattern in PATTERNS:
+        if re.match("^%s$" % pattern, w):
+            return "[[%s]]" % name
+    return w
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+@pytest.mark.parametrize("patterns", [PATTERNS, PATTERNS + [("repeated", r"(a)\1")]])
+def test_compiled_patterns_match_one_by_one(patterns):
+    replace_word = hunpos.compile_patterns(patterns)
+    words = ["1999", "12", "3,14", "EU", "Eu", "3:e", "xylofon", "y", "www.sparv.se", "https://x", "hund", ""]
+    for w in words:
+        assert replace_word(w) == replace_one_by_one(w), w
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_no_patterns():
+    assert hunpos.compile_patterns([])("1999") == "1999"
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_run_preloaded(tmp_path):
+    script = tmp_path / "fake_hunpos.py"
+    script.write_text(FAKE_HUNPOS)
+    process_dict = hunpos.preloader(sys.executable, Model(str(script)), None)
+    process = process_dict["process"]
+    try:
+        for document in ["Hej\nvärlden\n\nHej\n\n", "", "då\n\n"]:
+            stdout = hunpos.run_preloaded(process_dict, document, sys.executable, Model(str(script)), None, "UTF-8")
+            assert stdout == "".join(f"{t}\tNN\n" if t else "\n" for t in document.split("\n")[:-1])
+        assert process_dict["process"] is process
+    finally:
+        process.kill()
+        process.wait()
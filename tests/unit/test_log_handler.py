@@ -0,0 +1,60 @@
+import logging
+import socketserver
+import threading
+
+import pytest
+
+from sparv.core import log_handler
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture()
+def log_server():
+    server = socketserver.ThreadingTCPServer(("localhost", 0), RequestHandlerClass=log_handler.LogRecordStreamHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    receiver = logging.getLogger("sparv_logging")
+    receiver.setLevel(logging.DEBUG)
+    handler = ListHandler()
+    receiver.addHandler(handler)
+    yield server.server_address, handler
+    receiver.removeHandler(handler)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_progress_is_coalesced(log_server):
+    address, received = log_server
+    log_handler.setup_logging(address, log_level="info", log_file_level="info", file="doc", job="test:job")
+    logger = logging.getLogger("sparv")
+    try:
+        logger.progress(total=100000)
+        for _ in range(100000):
+            logger.progress()
+        logger.info("done")
+    finally:
+        for handler in logger.handlers:
+            handler.close()
+        logger.handlers.clear()
+
+    # Wait for the server to handle all records
+    for _ in range(50):
+        if any(r.msg == "done" for r in received.records):
+            break
+        threading.Event().wait(0.1)
+
+    progress = [r for r in received.records if r.msg == "progress"]
+    assert progress[0].total == 100000
+    assert sum(r.advance for r in progress[1:]) == 100000
+    assert len(progress) < 1000
+    assert all(r.job == "test:job" and r.file == "doc" for r in progress)
@@ -0,0 +1,62 @@
+import subprocess
+import sys
+
+import pytest
+
+from sparv.api import Model, util
+from sparv.modules.malt import malt
+
+# Fake parser that echoes every token line with a head and relation appended, in the same way as MaltParser
+FAKE_MALT = """
+import sys
+for line in sys.stdin.buffer:
+    line = line.rstrip(b"\\n")
+    sys.stdout.buffer.write(line + b"\\t0\\tROOT\\t_\\t_\\n" if line else b"\\n")
+    if not line:
+        sys.stdout.buffer.flush()
+"""
+
+# Fake parser writing a lot to stderr before parsing, in the same way as a verbose JVM
+NOISY_MALT = """
+import sys
+sys.stderr.write("message\\n" * 100000)
+sys.stderr.flush()
+""" + FAKE_MALT
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_malt_parse_streams_large_input():
+    process = subprocess.Popen([sys.executable, "-c", FAKE_MALT], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        # Much more data than fits in the pipe buffers
+        lengths = [(i % 20) + 1 for i in range(20000)]
+        stdin = ["".join(f"{n + 1}\tord\t_\tNN\tNN\tNN.UTR.SIN.IND.NOM\n" for n in range(length)).encode() + b"\n"
+                 for length in lengths]
+        parsed = malt.malt_parse(process, stdin, lengths, "UTF-8")
+        assert [len(sent) for sent in parsed] == lengths
+        assert parsed[-1][-1].split("\t")[malt.DEPREL_COLUMN] == "ROOT"
+
+        # The process can be reused for another document
+        assert malt.malt_parse(process, stdin[:1], lengths[:1], "UTF-8") == [parsed[0]]
+    finally:
+        process.kill()
+        process.wait()
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_maltstart_reads_stderr(monkeypatch):
+    def fake_call_java(*_args, **_kwargs):
+        return subprocess.Popen([sys.executable, "-c", NOISY_MALT], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+
+    monkeypatch.setattr(util.system, "call_java", fake_call_java)
+    process = malt.maltstart("unused.jar", Model("malt/unused.mco"), "UTF-8")
+    try:
+        # Without reading stderr, the process would block once the stderr pipe is full
+        stdin = [b"1\tord\t_\tNN\tNN\tNN\n\n"]
+        assert malt.malt_parse(process, stdin, [1], "UTF-8") == [["1\tord\t_\tNN\tNN\tNN\t0\tROOT\t_\t_"]]
+    finally:
+        process.kill()
+        process.wait()
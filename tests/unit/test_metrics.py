@@ -0,0 +1,39 @@
+import math
+
+import pytest
+
+from sparv.core import metrics
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_histogram():
+    histogram = metrics.Histogram()
+    for value in (0.001, 0.02, 0.02, 0.3, 1000):
+        histogram.observe(value)
+    assert histogram.count == 5
+    assert histogram.percentile(50) == 0.025
+    assert histogram.percentile(100) == math.inf
+    assert histogram.mean() == pytest.approx(1000.341 / 5)
+
+    other = metrics.Histogram.from_dict(histogram.to_dict())
+    other.merge(histogram)
+    assert other.count == 10
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_openmetrics():
+    worker_metrics = metrics.WorkerMetrics(1)
+    worker_metrics.request("saldo:annotate", 0.01, 0.2, failed=False)
+    worker_metrics.request("saldo:annotate", None, 0.4, failed=True)
+    worker_metrics.cleanup("saldo:annotate", 0.05)
+    text = metrics.to_openmetrics(worker_metrics.collect())
+
+    assert 'sparv_preloader_requests_total{annotator="saldo:annotate"} 2' in text
+    assert 'sparv_preloader_request_errors_total{annotator="saldo:annotate"} 1' in text
+    assert 'sparv_preloader_latency_seconds_bucket{annotator="saldo:annotate",le="0.25"} 1' in text
+    assert 'sparv_preloader_latency_seconds_bucket{annotator="saldo:annotate",le="+Inf"} 2' in text
+    assert 'sparv_preloader_wait_seconds_count{annotator="saldo:annotate"} 1' in text
+    assert 'sparv_preloader_worker_busy_ratio{worker="1"}' in text
+    assert text.endswith("# EOF\n")
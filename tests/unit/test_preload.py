@@ -0,0 +1,127 @@
+import os
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from sparv.api.classes import Model
+from sparv.core import log_handler, preload
+from sparv.core.misc import SparvErrorMessage
+
+
+def annotate(out, text, model):
+    if text == "bad":
+        raise SparvErrorMessage("Bad input")
+    out.append((model, text))
+
+
+def load_model(model_file):
+    return model_file.read()
+
+
+@pytest.fixture()
+def preloader(tmp_path):
+    log_server = socketserver.ThreadingTCPServer(("localhost", 0),
+                                                 RequestHandlerClass=log_handler.LogRecordStreamHandler)
+    log_server.daemon_threads = True
+    threading.Thread(target=log_server.serve_forever, daemon=True).start()
+
+    socket_path = str(tmp_path / "preload.sock")
+    server_socket = preload.socket.socket(preload.socket.AF_UNIX, preload.socket.SOCK_STREAM)
+    server_socket.bind(socket_path)
+    server_socket.listen(1)
+    model_file = tmp_path / "model.txt"
+    model_file.write_text("version 1")
+    annotator = preload.Preloader(annotate, "model", load_model, {"model_file": Model(str(model_file))}, None, False)
+    stop_event = threading.Event()
+    thread = threading.Thread(target=preload.worker,
+                              args=(1, server_socket, {"test:annotate": annotator}, stop_event, 0.05), daemon=True)
+    thread.start()
+    config = {"log_server": log_server.server_address, "log_level": "warning", "log_file_level": "warning"}
+    yield socket_path, config
+    preload.stop(socket_path)
+    thread.join(5)
+    server_socket.close()
+    log_server.shutdown()
+    log_server.server_close()
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_pipelined_requests(preloader):
+    socket_path, config = preloader
+    out = []
+    with preload.PreloaderClient(socket_path, max_in_flight=2) as client:
+        client.ping(timeout=1)
+        responses = client.run([("test:annotate", {"out": out, "text": text}, config, f"doc{i}")
+                                for i, text in enumerate(["a", "bad", "c", "d"])])
+        # The same connection can be used for commands after the requests
+        client.ping(timeout=1)
+
+    assert responses[0] is True and responses[2] is True and responses[3] is True
+    assert isinstance(responses[1], SparvErrorMessage)
+    info = preload.get_preloader_info(socket_path)["test:annotate"]
+    assert info["version"] == 1
+    assert list(info["params"]) == ["model_file"]
+
+    stats = preload.get_preloader_stats(socket_path)[1]["annotators"]["test:annotate"]
+    assert stats["requests"] == 4
+    assert stats["errors"] == 1
+    assert sum(stats["latency"]["counts"]) == 4
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_model_reload(preloader, tmp_path):
+    socket_path, _config = preloader
+    model_file = tmp_path / "model.txt"
+    info = preload.get_preloader_info(socket_path)["test:annotate"]
+    assert list(info["models"]) == [str(model_file.resolve())]
+
+    model_file.write_text("version 2")
+    os.utime(model_file, ns=(0, time.time_ns() + 10 ** 9))
+    for _ in range(100):
+        if preload.get_preloader_info(socket_path)["test:annotate"]["version"] == 2:
+            break
+        time.sleep(0.05)
+    assert preload.get_preloader_info(socket_path)["test:annotate"]["version"] == 2
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_legacy_request(preloader):
+    socket_path, config = preloader
+    with preload.socketcontext(socket_path) as sock:
+        preload.send_data(sock, preload.PING)
+        assert preload.receive_data(sock) == preload.PONG
+        preload.send_data(sock, ("test:annotate", {"out": [], "text": "a"}, config, "doc"))
+        assert preload.receive_data(sock) is True
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_replaced_version_closed(tmp_path):
+    def start_process(model_file):
+        return {"process": subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])}
+
+    model_file = tmp_path / "model.txt"
+    model_file.write_text("version 1")
+    annotator = preload.Preloader(None, "preloaded", start_process, {"model_file": Model(str(model_file))}, None,
+                                  False)
+    annotator.load()
+    first, version = annotator.acquire()
+
+    # The version used by a running request is kept until the request is done
+    annotator.load()
+    assert first["process"].poll() is None
+    annotator.release(first, version)
+    assert first["process"].poll() is not None
+
+    # A version not used by any request is closed directly
+    second = annotator.preloaded
+    annotator.load()
+    assert second["process"].poll() is not None
+    preload.close_preloaded(annotator.preloaded)
@@ -0,0 +1,55 @@
+import pytest
+
+from sparv.core import profiler
+
+
+def make_stats(job: str, wall_time: float, tokens=None) -> dict:
+    return {"job": job, "file": "f", "pid": 1, "wall_time": wall_time, "cpu_time": wall_time / 2,
+            "peak_rss": 1024, "bytes_read": 10, "bytes_written": 5, "tokens": tokens}
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_percentile():
+    assert profiler.percentile([5.0, 1.0, 3.0, 2.0, 4.0], 95) == 5.0
+    assert profiler.percentile([5.0, 1.0, 3.0, 2.0, 4.0], 50) == 3.0
+    assert profiler.percentile([1.0], 95) == 1.0
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_summarize():
+    summary = profiler.summarize([
+        make_stats("saldo:annotate", 2.0, 100),
+        make_stats("saldo:annotate", 4.0, 200),
+        make_stats("misc:id", 1.0)
+    ])
+    assert summary["saldo:annotate"]["jobs"] == 2
+    assert summary["saldo:annotate"]["total_time"] == 6.0
+    assert summary["saldo:annotate"]["mean_time"] == 3.0
+    assert summary["saldo:annotate"]["tokens_per_second"] == 50.0
+    assert summary["saldo:annotate"]["bytes_read"] == 20
+    assert summary["misc:id"]["tokens"] is None
+    assert summary["misc:id"]["tokens_per_second"] is None
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_profile_annotator(tmp_path):
+    options = {"files": ["doc*"], "dir": str(tmp_path)}
+    with profiler.profile_annotator("saldo:compound", "doc1", options):
+        sum(range(100))
+    with profiler.profile_annotator("saldo:compound", "other", options):
+        sum(range(100))
+    assert [p.name for p in (tmp_path / "saldo.compound").iterdir()] == ["doc1.pstats"]
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_profile_annotator_subdirectories(tmp_path):
+    options = {"files": [], "dir": str(tmp_path)}
+    for source_file in ("a/b_c", "a_b/c", "a_b_c"):
+        with profiler.profile_annotator("saldo:compound", source_file, options):
+            sum(range(100))
+    profiles = sorted(p.relative_to(tmp_path).as_posix() for p in tmp_path.rglob("*.pstats"))
+    assert profiles == ["saldo.compound/a/b_c.pstats", "saldo.compound/a_b/c.pstats", "saldo.compound/a_b_c.pstats"]
@@ -0,0 +1,177 @@
+import copy
+import random
+
+import pytest
+
+from sparv.api import Annotation, Model, Output
+from sparv.core import log_handler  # noqa: F401 (log_handler adds progress logging)
+from sparv.modules.saldo import saldo
+from tests import utils
+
+
+def entry(lemgram, wordslist, gap_allowed=False, is_particle=False):
+    """Return a lexicon lookup result for a multi-word expression, as returned by _find_single_word()."""
+    return {"lem": [lemgram], "saldo": [lemgram]}, [], wordslist, gap_allowed, is_particle, ""
+
+
+LEXICON = {
+    "ger": [entry("ge_upp..vbm.1", [["upp"]], True, True), entry("ge_sig_ut..vbm.1", [["sig", "ut"]], True, True)],
+    "tar": [entry("ta_hand_om..vbm.1", [["hand", "om"]], True), entry("ta_upp..vbm.1", [["upp"]], True, True),
+            entry("ta_med..vbm.1", [["med"]], True, True)],
+    "i": [entry("i_dag..abm.1", [["dag"]]), entry("i_och_med..ppm.1", [["och", "med"]])],
+    "var": [entry("var_än..abm.1", [["*", "än"]], True)],
+    "för": [entry("för_skull..ppm.1", [["*", "skull"], ["*", "skulle"]], True)],
+    "hela": [entry("hela_tiden..abm.1", [["tiden"]]), entry("hela_dagen..nnm.1", [["dagen"]])],
+    "Upp": [entry("upp_och_ner..abm.1", [["och", "ner"]])],
+}
+MSD = {"ger": "VB.PRS.AKT", "tar": "VB.PRS.AKT", "är": "VB.PRS.AKT", "om": "PP", "med": "PP", "i": "PP",
+       "upp": "PL", "dag": "NN.UTR.SIN.IND.NOM", "dagen": "NN.UTR.SIN.DEF.NOM"}
+VOCABULARY = list(LEXICON) + ["upp", "sig", "ut", "hand", "om", "med", "dag", "och", "än", "skull", "skulle",
+                              "tiden", "dagen", "ner", "*", "han", "är", "katten"]
+
+
+def reference_multiword_expressions(incomplete_multis, complete_multis, thewords, ref, msdtag, max_gaps, ann_tags_words,
+                                msd_annotation, sent, skip_pos_check):
+    todelfromincomplete = []  # list to keep track of which expressions that have been completed
+
+    for i, x in enumerate(incomplete_multis):
+        # x = (annotations, following_words, [ref], gap_allowed, is_particle, [part-of-gap-boolean, gap_count])
+        seeking_word = x[1][0]  # The next word we are looking for in this multi-word expression
+
+        # Is a gap necessary in this position for this expression?
+        if seeking_word == "*":
+            if x[1][1].lower() in (w.lower() for w in thewords):
+                seeking_word = x[1][1]
+                del x[1][0]
+
+        # If current gap is greater than max_gaps, stop searching
+        if x[5][1] > max_gaps:
+            todelfromincomplete.append(i)
+        elif seeking_word.lower() in (w.lower() for w in thewords) and (skip_pos_check or not (len(x[1]) == 1 and x[4] and msdtag.startswith("PP"))):
+            x[5][0] = False     # last word was not a gap
+            del x[1][0]
+            x[2].append(ref)
+
+            # Is current word the last word we are looking for?
+            if len(x[1]) == 0:
+                todelfromincomplete.append(i)
+
+                # Create a list of msdtags of words belonging to the completed multi-word expr.
+                msdtag_list = [msd_annotation[sent[int(ref) - 1]] for ref in x[2]]
+
+                # For completed verb multis, check that at least one of the words is a verb:
+                if not skip_pos_check and "..vbm." in x[0]["lem"][0]:
+                    for tag in msdtag_list:
+                        if tag.startswith("VB"):
+                            complete_multis.append((x[2], x[0]))
+                            break
+
+                # For completed noun multis, check that at least one of the words is a noun:
+                elif not skip_pos_check and "..nnm." in x[0]["lem"][0]:
+                    for tag in msdtag_list:
+                        if tag[:2] in ("NN", "PM", "UO"):
+                            complete_multis.append((x[2], x[0]))
+                            break
+
+                else:
+                    complete_multis.append((x[2], x[0]))
+
+        else:
+            # We've reached a gap
+            # Are gaps allowed?
+            if x[3]:
+                # If previous word was NOT part of a gap, this is a new gap, so increment gap counter
+                if not x[5][0]:
+                    x[5][1] += 1
+                x[5][0] = True  # Mark that this word was part of a gap
+
+                # Avoid having another verb within a verb multi-word expression:
+                # delete current incomplete multi-word expr. if it starts with a verb and if current word has POS tag VB
+                if "..vbm." in x[0]["lem"][0] and msdtag.startswith("VB"):
+                    todelfromincomplete.append(i)
+
+            else:
+                # Gaps are not allowed for this multi-word expression
+                todelfromincomplete.append(i)
+
+    # Delete seeking words from incomplete_multis
+    for x in todelfromincomplete[::-1]:
+        del incomplete_multis[x]
+
+    # Collect possible multiword expressions:
+    # Is this word a possible beginning of a multi-word expression?
+    looking_for = [(annotation, words, [ref], gap_allowed, is_particle, [False, 0])
+                   for (annotation, _, wordslist, gap_allowed, is_particle, _) in ann_tags_words if wordslist for words in wordslist]
+    if len(looking_for) > 0:
+        incomplete_multis.extend(looking_for)
+
+
+def run_sentence(find, tokens, max_gaps, skip_pos_check):
+    """Run multi-word matching over a sentence, with tokens given as lists of word variants."""
+    sent = list(range(len(tokens)))
+    msd_annotation = [MSD.get(t[0].lower(), "AB") for t in tokens]
+    complete_multis = []
+    incomplete_multis = []
+    tries = {}
+    for position, thewords in enumerate(tokens):
+        ref = str(position + 1)
+        # Lexicon lookups return new word lists every time, which the reference implementation relies on
+        ann_tags_words = [copy.deepcopy(e) for w in thewords for e in LEXICON.get(w, [])]
+        if find is reference_multiword_expressions:
+            find(incomplete_multis, complete_multis, thewords, ref, msd_annotation[position], max_gaps,
+                 ann_tags_words, msd_annotation, sent, skip_pos_check)
+        else:
+            tries.setdefault(tuple(thewords), saldo._build_multiword_tries(ann_tags_words))
+            incomplete_multis = find(incomplete_multis, complete_multis, thewords, ref, msd_annotation[position],
+                                     max_gaps, tries[tuple(thewords)], position, msd_annotation, sent,
+                                     skip_pos_check)
+    return complete_multis
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_multiword_examples():
+    tokens = [["han"], ["tar"], ["hand"], ["om"], ["katten"], ["i"], ["dag"]]
+    assert run_sentence(saldo._find_multiword_expressions, tokens, 1, False) == [
+        (["2", "3", "4"], LEXICON["tar"][0][0]), (["6", "7"], LEXICON["i"][0][0])]
+
+    # Particle may not be a preposition, and a verb within a gap stops a verb multi-word expression
+    assert run_sentence(saldo._find_multiword_expressions, [["tar"], ["katten"], ["med"]], 1, False) == []
+    assert run_sentence(saldo._find_multiword_expressions, [["ger"], ["är"], ["upp"]], 1, False) == []
+    assert run_sentence(saldo._find_multiword_expressions, [["ger"], ["han"], ["upp"]], 1, False) == [
+        (["1", "3"], LEXICON["ger"][0][0])]
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+@pytest.mark.parametrize("max_gaps,skip_pos_check", [(0, False), (1, False), (2, True), (-1, False)])
+def test_multiword_matches_reference(max_gaps, skip_pos_check):
+    rnd = random.Random(max_gaps)
+    for _ in range(2000):
+        tokens = [[rnd.choice(VOCABULARY) for _ in range(rnd.choice((1, 1, 1, 2)))]
+                  for _ in range(rnd.randint(1, 12))]
+        assert run_sentence(saldo._find_multiword_expressions, tokens, max_gaps, skip_pos_check) == run_sentence(
+            reference_multiword_expressions, tokens, max_gaps, skip_pos_check), tokens
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_parallel_annotation(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    utils.write_synthetic_annotations("doc", sentences=saldo.PARALLEL_MIN_SENTENCES)
+    utils.create_saldo_lexicon(tmp_path / "saldo.pickle")
+
+    results = []
+    for processes in (1, 3):
+        output = Output(f"segment.token:saldo.lemgram{processes}", source_file="doc")
+        saldo.main(token=Annotation("segment.token", source_file="doc"),
+                   word=Annotation("segment.token:word", source_file="doc"),
+                   sentence=Annotation("segment.sentence", source_file="doc"),
+                   reference=Annotation("segment.token:ref", source_file="doc"),
+                   out_sense=None, out_lemgram=output, out_baseform=None, models=[Model(str(tmp_path / "saldo.pickle"))],
+                   msd=Annotation("segment.token:msd", source_file="doc"), delimiter="|", affix="|", precision=None,
+                   precision_filter="max", min_precision=0.66, skip_multiword=False, max_gaps=1,
+                   allow_multiword_overlap=False, word_separator=None, models_preloaded=None, processes=processes)
+        results.append(list(Annotation(output.name, source_file="doc").read()))
+    assert results[0] == results[1]
+    assert any("..vbm." in value for value in results[0])
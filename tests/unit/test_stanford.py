@@ -0,0 +1,58 @@
+import http.server
+import json
+import threading
+import urllib.parse
+
+import pytest
+
+from sparv.modules.stanford import stanford
+
+
+class FakeCoreNLPHandler(http.server.BaseHTTPRequestHandler):
+    """Respond with one token per word, in the same format as the CoreNLP server."""
+
+    def do_POST(self):
+        properties = json.loads(urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)["properties"][0])
+        assert properties["outputFormat"] == "conll"
+        text = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+        lines = []
+        start = 0
+        for i, word in enumerate(text.split(" "), 1):
+            lines.append(f"{i}\t{word}\t{word.lower()}\tNN\tO\t0\troot\t{start}\t{start + len(word)}")
+            start += len(word) + 1
+        response = ("\n".join(lines) + "\n\n").encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_annotate_server():
+    server = http.server.ThreadingHTTPServer(("localhost", 0), FakeCoreNLPHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        outputs = stanford._annotate_server(f"http://localhost:{server.server_address[1]}", ["Hello world", "Bye"], 2)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    sentences = stanford._parse_output(outputs[0], "eng", 100)
+    assert [(t.word, t.baseform, t.start, t.end) for t in sentences[0]] == [("Hello", "hello", 100, 105),
+                                                                             ("world", "world", 106, 111)]
+    assert len(stanford._parse_output(outputs[1], "eng", 0)[0]) == 1
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_annotate_server_unreachable():
+    # Find a port with nothing listening, to make sure that the error leads to a fallback to running CoreNLP locally
+    server = http.server.HTTPServer(("localhost", 0), FakeCoreNLPHandler)
+    port = server.server_address[1]
+    server.server_close()
+    with pytest.raises(OSError):
+        stanford._annotate_server(f"http://localhost:{port}", ["Hello"], 1)
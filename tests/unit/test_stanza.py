@@ -0,0 +1,82 @@
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from sparv.modules.stanza import stanza_swe, stanza_utils
+
+
+class FakePipeline:
+    """Tag every word with its length, and attach every word to the first word of the sentence."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, document):
+        self.calls += 1
+        return SimpleNamespace(sentences=[
+            SimpleNamespace(words=[SimpleNamespace(xpos=f"X{len(w)}", upos=f"U{len(w)}", feats=None, lemma=w.lower(),
+                                                   head=0 if i == 0 else 1, deprel="root" if i == 0 else "dep")
+                                   for i, w in enumerate(sent)])
+            for sent in document])
+
+
+def get_pipelines(nlp_args):
+    """Return a pipeline cache with a fake pipeline for the processors used for Swedish."""
+    pipeline = FakePipeline()
+    pipelines = {}
+    for processors in ("tokenize,pos,lemma,depparse", "tokenize,pos"):
+        nlp_args.update({"processors": processors, "use_gpu": False})
+        pipelines[stanza_utils.pipeline_key(nlp_args)] = pipeline
+    return pipelines, pipeline
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_annotate_documents_batched():
+    documents = [([[0, 1], [2, 3, 4]], [], ["Hej", "du", "Det", "var", "kul"]),
+                 ([[1, 2]], [0], ["Orphan", "Bra", "jobbat"])]
+    args = {"batch_size": 100, "max_sentence_length": 2, "max_token_length": 0}
+
+    pipelines, pipeline = get_pipelines({})
+    batched = stanza_swe._annotate_documents(documents, {}, pipelines, False, False, **args)
+    # One call for sentences with dependency parsing, and one for the rest
+    assert pipeline.calls == 2
+
+    separate = []
+    for document in documents:
+        pipelines, _ = get_pipelines({})
+        separate.extend(stanza_swe._annotate_documents([document], {}, pipelines, False, False, **args))
+    assert batched == separate
+
+    assert batched[0]["msd"] == ["X3", "X2", "X3", "X3", "X3"]
+    assert batched[0]["dephead"] == ["-", "0", None, None, None]
+    assert batched[1]["baseform"] == ["orphan", "bra", "jobbat"]
+    assert batched[1]["deprel"] == [None, "root", "dep"]
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_tag_agreement():
+    before = [("NOUN", "NN", 0, "root"), ("VERB", "VB", 1, "dep"), ("ADJ", "JJ", 1, "amod"), ("ADV", "AB", 2, "adv")]
+    after = [("NOUN", "NN", 0, "root"), ("VERB", "VB", 1, "obj"), ("ADV", "AB", 1, "amod"), ("ADV", "AB", 2, "adv")]
+    assert stanza_utils.tag_agreement(before, after) == (75.0, 75.0)
+    assert stanza_utils.tag_agreement([], []) == (100.0, 100.0)
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_set_torch_threads_without_limit(monkeypatch):
+    # Without a thread limit from Sparv, PyTorch is left alone (and not even imported)
+    monkeypatch.setattr(stanza_utils.util.system, "job_cpu_threads", None)
+    monkeypatch.setitem(sys.modules, "torch", None)
+    stanza_utils.set_torch_threads(0)
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_pipeline_key():
+    nlp_args = {"processors": "tokenize,pos", "use_gpu": False}
+    assert stanza_utils.pipeline_key(nlp_args) == stanza_utils.pipeline_key(dict(reversed(nlp_args.items())))
+    # A quantized pipeline is never used for jobs without quantization, or the other way around
+    assert stanza_utils.pipeline_key(nlp_args, "dynamic") != stanza_utils.pipeline_key(nlp_args)
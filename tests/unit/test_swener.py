@@ -0,0 +1,36 @@
+import pytest
+
+from sparv.modules.swener import swener
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_parse_sentences():
+    # Two sentences: "Anna bor i Stockholm" and "Hej då"
+    sentences = [[0, 1, 2, 3], [4, 5]]
+    token_spans = [(0, 4), (5, 8), (9, 10), (11, 20), (21, 24), (25, 27)]
+    tagged = ['<ENAMEX TYPE="PRS" SBT="HUM">Anna</ENAMEX> bor i <ENAMEX TYPE="LOC" SBT="PPL">Stockholm</ENAMEX>',
+              "Hej då"]
+    spans, ex, types, subtypes, names = swener.parse_sentences(sentences, token_spans, tagged)
+    assert spans == [(0, 4), (11, 20)]
+    assert ex == ["ENAMEX", "ENAMEX"]
+    assert types == ["PRS", "LOC"]
+    assert subtypes == ["HUM", "PPL"]
+    assert names == ["Anna", "Stockholm"]
+
+    # Splitting batched output by file gives the same result as parsing each file on its own
+    first = swener.parse_sentences(sentences[:1], token_spans, tagged[:1])
+    second = swener.parse_sentences(sentences[1:], token_spans, tagged[1:])
+    assert first[0] == spans and second[0] == []
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_split_batch_output():
+    delimiter = swener.FILE_DELIMITER
+    output = f"Anna bor\n\n{delimiter}\n{delimiter}\n<ENAMEX>{delimiter}</ENAMEX>\nHej då\n{delimiter}\n"
+    # Empty sentences and files without sentences are kept, and tags around the delimiters are ignored
+    assert swener.split_batch_output(output, 4) == [["Anna bor", ""], [], [], ["Hej då"]]
+    # The output can't be split up if the number of delimiters is wrong, or if anything follows the last one
+    assert swener.split_batch_output(output, 3) is None
+    assert swener.split_batch_output(output + "Extra\n", 4) is None
@@ -0,0 +1,123 @@
+import subprocess
+import sys
+
+import pytest
+
+from sparv.api import util
+
+# Fake tagger that tags every token and outputs an empty line after every sentence, in the same way as Hunpos
+FAKE_TAGGER = """
+import sys
+for line in sys.stdin.buffer:
+    line = line.rstrip(b"\\n")
+    sys.stdout.buffer.write(line + b"\\tNN\\n" if line else b"\\n")
+    if not line:
+        sys.stdout.buffer.flush()
+"""
+
+# Fake process echoing its input, pausing for a while at every "STALL" line
+STALLING_ECHO = """
+import sys, time
+for line in sys.stdin.buffer:
+    if line == b"STALL\\n":
+        time.sleep(0.2)
+    sys.stdout.buffer.write(line)
+    sys.stdout.buffer.flush()
+"""
+
+# Fake process echoing its input until the sentinel, after which it stops reading
+STOP_READING = """
+import sys, time
+for line in sys.stdin.buffer:
+    sys.stdout.buffer.write(line)
+    sys.stdout.buffer.flush()
+    if line == b"END\\n":
+        time.sleep(60)
+"""
+
+# Fake process writing a lot to stderr before echoing its input
+NOISY_ECHO = """
+import sys
+sys.stderr.write("message\\n" * 100000)
+for line in sys.stdin:
+    print(line, end="", flush=True)
+"""
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_communicate_until():
+    process = subprocess.Popen([sys.executable, "-c", FAKE_TAGGER], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        for sentences in (100000, 1):
+            # Much more data than fits in the pipe buffers
+            stdin = b"ett\nord\n\n" * sentences
+            output = util.system.communicate_until(process, stdin, b"END\n\n", lambda line: line == b"END\tNN\n",
+                                                   trailing_lines=1)
+            assert output == [b"ett\tNN\n", b"ord\tNN\n", b"\n"] * sentences
+    finally:
+        process.kill()
+        process.wait()
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_communicate_until_stalling():
+    process = subprocess.Popen([sys.executable, "-c", STALLING_ECHO], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        stdin = b"".join(b"ord\n" if i % 10 else b"STALL\n" for i in range(1, 100))
+        output = util.system.communicate_until(process, stdin, b"END\n", lambda line: line == b"END\n",
+                                               flush=b".\n" * 10)
+        assert b"".join(output) == stdin
+        process.stdin.close()
+        dummy_lines = process.stdout.read().count(b".\n")
+        # The amount of dummy input is reset after every stall, so it doesn't keep growing through the document
+        assert dummy_lines <= 10 * 9 * (1 + 2 + 4 + 8)
+    finally:
+        process.kill()
+        process.wait()
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_communicate_until_not_reading(monkeypatch):
+    monkeypatch.setattr(util.system, "WRITE_TIMEOUT", 0.5)
+    process = subprocess.Popen([sys.executable, "-c", STOP_READING], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    # The dummy input doesn't fit in the pipe, and the process stops reading after the sentinel
+    output = util.system.communicate_until(process, b"ord\n", b"END\n", lambda line: line == b"END\n",
+                                           flush=b".\n" * 100000)
+    assert output == [b"ord\n"]
+    assert process.poll() is not None
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_communicate_until_process_stopped():
+    process = subprocess.Popen([sys.executable, "-c", "pass"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    with pytest.raises(OSError):
+        util.system.communicate_until(process, b"ord\n\n", b"END\n\n", lambda line: line == b"END\tNN\n")
+    process.wait()
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_cpu_threads(monkeypatch):
+    monkeypatch.setattr(util.system, "job_cpu_threads", None)
+    assert util.system.cpu_threads() >= 1
+    monkeypatch.setattr(util.system, "job_cpu_threads", 3)
+    assert util.system.cpu_threads() == 3
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_log_stderr():
+    # Without reading stderr, the process would block once the stderr pipe is full
+    process = subprocess.Popen([sys.executable, "-c", NOISY_ECHO], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    messages = []
+    thread = util.system.log_stderr(process, messages.append)
+    assert util.system.communicate_until(process, b"ord\n", b"END\n", lambda line: line == b"END\n") == [b"ord\n"]
+    process.stdin.close()
+    process.wait()
+    thread.join(5)
+    assert messages == ["message"] * 100000
@@ -0,0 +1,69 @@
+import subprocess
+import sys
+
+import pytest
+
+from sparv.api import Model
+from sparv.modules.treetagger import treetagger
+
+# Fake tagger writing one tagged token per line, with the output block buffered in the same way as TreeTagger
+FAKE_TREETAGGER = """
+import sys
+out = open(sys.stdout.fileno(), "wb", buffering=int(sys.argv[1]))
+for line in sys.stdin.buffer:
+    token = line.rstrip(b"\\n")
+    out.write(token + b"\\n" if token == b"<eos>" else token + b"\\tTAG\\t" + token.lower() + b"\\n")
+"""
+
+# Fake tagger tagging every token with its position in the sentence
+POSITION_TAGGER = """
+import sys
+out = open(sys.stdout.fileno(), "wb", buffering=4096)
+position = 0
+for line in sys.stdin.buffer:
+    token = line.rstrip(b"\\n")
+    if token == b"<eos>":
+        position = 0
+        out.write(token + b"\\n")
+    else:
+        position += 1
+        out.write(token + b"\\t" + str(position).encode() + b"\\t" + token + b"\\n")
+"""
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+@pytest.mark.parametrize("buffer_size", [4096, 8192, 65536])
+def test_run_preloaded(buffer_size):
+    process = subprocess.Popen([sys.executable, "-c", FAKE_TREETAGGER, str(buffer_size)], stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE)
+    process_dict = {"process": process}
+    try:
+        documents = ["Hello\nWorld\n<eos>\nBye", "", "Again"]
+        for document in documents:
+            stdout = treetagger.run_preloaded(process_dict, document, "unused", Model("unused"), "UTF-8")
+            expected = "\n".join(f"{t}\tTAG\t{t.lower()}" if t != "<eos>" else t
+                                 for t in document.split("\n") if t)
+            assert stdout == expected
+        assert process_dict["process"] is process
+    finally:
+        process.kill()
+        process.wait()
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_run_preloaded_sentence_context():
+    process = subprocess.Popen([sys.executable, "-c", POSITION_TAGGER], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    process_dict = {"process": process}
+    try:
+        document = "Hello\nWorld\n<eos>\nBye"
+        # The same document twice, the second time after the dummy tokens left from the first one
+        for _ in range(2):
+            stdout = treetagger.run_preloaded(process_dict, document, "unused", Model("unused"), "UTF-8")
+            expected = subprocess.run([sys.executable, "-c", POSITION_TAGGER], input=document.encode(),
+                                      stdout=subprocess.PIPE, check=True).stdout.decode().strip()
+            assert stdout == expected
+    finally:
+        process.kill()
+        process.wait()
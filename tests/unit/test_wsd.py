@@ -0,0 +1,41 @@
+import logging
+import subprocess
+import sys
+
+import pytest
+
+from sparv.api import Model
+from sparv.modules.wsd import wsd
+
+# Fake WSD process that appends a probability column to every row, and writes messages to stderr like the real one
+FAKE_WSD = """
+import sys
+sys.stderr.write("Reading sense vectors...\\n" * 10000 + "Something went wrong\\n")
+sys.stderr.flush()
+for line in sys.stdin.buffer:
+    sys.stdout.buffer.write(line.rstrip(b"\\n") + b"\\t0.5\\n")
+    sys.stdout.buffer.flush()
+"""
+
+
+@pytest.mark.unit
+@pytest.mark.noexternal
+def test_run_preloaded(caplog):
+    process = subprocess.Popen([sys.executable, "-c", FAKE_WSD], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    stderr_reader = wsd.log_messages(process, "UTF-8")
+    process_dict = {"process": process}
+    separator = "\t".join(["_", "_", "_", "_", wsd.SENT_SEP, "_"])
+    try:
+        with caplog.at_level(logging.DEBUG):
+            for document in [f"1\tord\t_\tord..nn.1\tord..nn\tord..1\n{separator}", ""]:
+                stdout = wsd.run_preloaded(process_dict, document, "unused", Model("unused"), Model("unused"),
+                                           "UTF-8")
+                assert stdout == "".join(f"{row}\t0.5\n" for row in document.split("\n") if row)
+            assert process_dict["process"] is process
+        process.stdin.close()
+        process.wait()
+        stderr_reader.join(5)
+    finally:
+        process.kill()
+    assert any(r.levelno == logging.ERROR and "Something went wrong" in r.getMessage() for r in caplog.records)
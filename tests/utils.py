@@ -3,6 +3,7 @@
 import difflib
 import filecmp
 import pathlib
+import random
 import re
 import shutil
 import subprocess
@@ -66,6 +67,77 @@ def cmp_export(gold_corpus_dir: pathlib.Path,
                      ), "export dir did not match the gold standard"
 
 
+def write_synthetic_annotations(source_file: str, sentences: int = 1000, sentence_length: int = 20,
+                                seed: int = 0) -> None:
+    """Write synthetic text, sentence and token annotations (with word, msd and ref attributes) to the workdir."""
+    from sparv.api import Output
+    from sparv.core import io
+
+    rnd = random.Random(seed)
+    words = ["han", "ger", "upp", "i", "dag", "och", "hon", "tar", "hand", "om", "katten", "hela", "tiden", "."]
+    msds = ["PN.UTR.SIN.DEF.SUB", "VB.PRS.AKT", "PL", "PP", "NN.UTR.SIN.IND.NOM", "KN", "PN.UTR.SIN.DEF.SUB",
+            "VB.PRS.AKT", "NN.UTR.SIN.IND.NOM", "PP", "NN.UTR.SIN.DEF.NOM", "JJ.POS.UTR+NEU.SIN.DEF.NOM",
+            "NN.UTR.SIN.DEF.NOM", "MAD"]
+    token_spans, token_words, token_msds, token_refs, sentence_spans = [], [], [], [], []
+    pos = 0
+    for _ in range(sentences):
+        sentence_start = pos
+        for ref in range(1, sentence_length + 1):
+            i = rnd.randrange(len(words))
+            token_spans.append((pos, pos + len(words[i])))
+            token_words.append(words[i])
+            token_msds.append(msds[i])
+            token_refs.append(str(ref))
+            pos += len(words[i]) + 1
+        sentence_spans.append((sentence_start, pos - 1))
+
+    io.write_data(source_file, io.TEXT_FILE, " " * pos)
+    Output("text", source_file=source_file).write([(0, pos)])
+    Output("text:id", source_file=source_file).write(["1"])
+    Output("segment.sentence", source_file=source_file).write(sentence_spans)
+    Output("segment.token", source_file=source_file).write(token_spans)
+    Output("segment.token:word", source_file=source_file).write(token_words)
+    Output("segment.token:msd", source_file=source_file).write(token_msds)
+    Output("segment.token:ref", source_file=source_file).write(token_refs)
+
+
+def create_saldo_lexicon(path: pathlib.Path) -> None:
+    """Create a small SALDO lexicon pickle, including multi-word expressions with gaps and particles."""
+    from sparv.modules.saldo.saldo_model import HashableDict, SaldoLexicon
+
+    def entry(baseform, lemgram, sense):
+        return HashableDict(gf=(baseform,), lem=(lemgram,), saldo=(sense,))
+
+    lexicon = {
+        "han": {entry("han", "han..pn.1", "han..1"): ({"PN.UTR.SIN.DEF.SUB"}, set(), False, False)},
+        "hon": {entry("hon", "hon..pn.1", "hon..1"): ({"PN.UTR.SIN.DEF.SUB"}, set(), False, False)},
+        "ger": {
+            entry("ge", "ge..vb.1", "ge..1"): ({"VB.PRS.AKT"}, set(), False, False),
+            entry("ge upp", "ge_upp..vbm.1", "ge_upp..1"): (set(), {("upp",)}, True, True)
+        },
+        "upp": {entry("upp", "upp..ab.1", "upp..1"): ({"AB", "PL"}, set(), False, False)},
+        "i": {
+            entry("i", "i..pp.1", "i..1"): ({"PP"}, set(), False, False),
+            entry("i dag", "i_dag..abm.1", "i_dag..1"): (set(), {("dag",)}, False, False)
+        },
+        "dag": {entry("dag", "dag..nn.1", "dag..1"): ({"NN.UTR.SIN.IND.NOM"}, set(), False, False)},
+        "och": {entry("och", "och..kn.1", "och..1"): ({"KN"}, set(), False, False)},
+        "tar": {
+            entry("ta", "ta..vb.1", "ta..1"): ({"VB.PRS.AKT"}, set(), False, False),
+            entry("ta hand om", "ta_hand_om..vbm.1", "ta_hand_om..1"): (set(), {("hand", "om")}, True, False)
+        },
+        "hand": {entry("hand", "hand..nn.1", "hand..1"): ({"NN.UTR.SIN.IND.NOM"}, set(), False, False)},
+        "om": {entry("om", "om..pp.1", "om..1"): ({"PP"}, set(), False, False)},
+        "katten": {entry("katt", "katt..nn.1", "katt..1"): ({"NN.UTR.SIN.DEF.NOM"}, set(), False, False)},
+        "hela": {
+            entry("hel", "hel..av.1", "hel..1"): ({"JJ.POS.UTR+NEU.SIN.DEF.NOM"}, set(), False, False),
+            entry("hela tiden", "hela_tiden..abm.1", "hela_tiden..1"): (set(), {("tiden",)}, False, False)
+        },
+        "tiden": {entry("tid", "tid..nn.1", "tid..1"): ({"NN.UTR.SIN.DEF.NOM"}, set(), False, False)}
+    }
+    SaldoLexicon.save_to_picklefile(path, lexicon, verbose=False)
+
+
 def print_error(msg: str):
     """Format msg into an error message."""
     console.print(f"[red]\n{msg}[/red]", highlight=False)